@@ -1,11 +1,57 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     """沙箱API服务基础信息配置"""
     log_level: str = "INFO" #日志等级
     server_timeout_minutes: int = 60  # 服务超时的时间
+    shell_output_max_bytes: int = 8 * 1024 * 1024  # 每个Shell会话输出缓冲区的最大字节数，也是单次读取输出的上限，<=0表示不限制
+    shell_output_rate_limit: int = 16 * 1024 * 1024  # 每个会话每秒读取的最大输出字节数，<=0表示不限制
+    shell_output_rate_policy: str = "pause"  # 超出输出速率时的策略: pause暂停读取(反压)/drop丢弃并计数
+    shell_output_max_read_size: int = 256 * 1024  # 自适应读取的最大单次读取字节数
+    shell_spill_max_bytes: int = 256 * 1024 * 1024  # 输出超过内存上限后溢出到磁盘保留的最大字节数，<=0表示不溢出(直接淘汰旧数据)
+    shell_spill_segment_bytes: int = 64 * 1024 * 1024  # 溢出文件的分段大小，超过磁盘上限时按分段删除最旧的数据
+    shell_spill_dir: str = ""  # 溢出文件所在目录，为空时使用系统临时目录
+    shell_stream_queue_size: int = 256  # 实时输出订阅者积压的最大输出事件数，超出后跳过积压数据(退出等控制事件不受限制)
+    shell_pool_size: int = 2  # 预热的常驻bash进程数量，<=0表示不预热
+    shell_pool_max_idle_seconds: int = 600  # 预热进程的最大空闲时间，超时后替换为新进程
+    shell_max_sessions: int = 64  # Shell会话数量上限，超出后按LRU淘汰，<=0表示不限制
+    shell_session_idle_ttl_seconds: int = 3600  # 没有命令执行的会话空闲超过该时间后被回收，<=0表示不回收
+    shell_reaper_interval_seconds: int = 60  # 空闲会话回收任务的执行间隔
+    shell_batch_concurrency: int = 8  # 批量执行命令时同时运行的最大进程数
+    shell_batch_timeout_seconds: int = 60  # 批量执行中命令的默认超时时间
+    shell_queue_max_size: int = 100  # 每个会话排队等待执行的命令数上限，<=0表示不限制
+    shell_queue_history_size: int = 256  # 每个会话保留的排队命令记录数，用于查询已结束命令的结果
+    shell_orphan_reap_interval_seconds: int = 30  # 泄漏进程(已结束会话残留的子孙进程)的扫描间隔，<=0表示不扫描
+    shell_orphan_kill: bool = True  # 是否强制结束扫描到的泄漏进程，否则只记录
+    shell_nice: Optional[int] = None  # Shell命令默认的nice值，为空表示不设置，调大(如10)可降低命令优先级保证API服务的响应
+    shell_ionice_class: int = 0  # Shell命令默认的IO调度类别，0表示不设置，2为尽力而为，3为空闲
+    shell_ionice_level: int = 7  # Shell命令默认的IO调度优先级(0-7)
+    shell_cgroup_root: str = ""  # 会话cgroup的根目录(cgroup v2，如/sys/fs/cgroup/sandbox-shell)，需要位于没有进程的cgroup下，为空表示不使用cgroup，只有设置了CPU或内存上限的会话才会创建cgroup
+    shell_cpu_limit: float = 0  # 每个会话默认可使用的CPU核数，<=0表示不限制
+    shell_memory_limit: int = 0  # 每个会话默认可使用的内存字节数，<=0表示不限制
+    shell_usage_sample_interval: float = 0.5  # 命令资源占用的采样间隔(秒)，<=0表示只在命令结束时采样
+    file_line_index_interval: int = 256 * 1024  # 行索引检查点之间的间隔字节数，越小定位越快占用内存越多
+    file_line_index_cache_size: int = 64  # 缓存行索引的文件数量，<=0表示不缓存
+    file_batch_read_concurrency: int = 16  # 批量读取文件的最大并发数
+    file_grep_workers: int = 0  # 目录搜索进程池的工作进程数，<=0表示使用CPU核数
+    file_grep_batch_size: int = 32  # 每个搜索任务包含的文件数
+    file_grep_max_file_size: int = 32 * 1024 * 1024  # 目录搜索跳过超过该大小的文件，<=0表示不限制
+    file_index_roots: str = ""  # 启动时建立内容索引的根目录，多个目录使用逗号分隔
+    file_index_dir: str = ""  # 内容索引的存储目录，为空时使用~/.cache/sandbox-file-index
+    file_index_overlay_limit: int = 2000  # 内存中增量更新的文件数超过该值后重建磁盘索引
+    file_index_debounce_seconds: float = 0.2  # 合并文件变化事件的等待时间(秒)
+    file_fuzzy_max_roots: int = 8  # 同时维护路径索引的根目录数量，超过后关闭最久未使用的索引
+    file_fuzzy_max_candidates: int = 5000  # 模糊查找时最多打分的候选路径数，超过后结果标记为truncated，<=0表示不限制
+    file_watch_debounce_seconds: float = 0.2  # 目录监听合并事件时等待事件静默的时间(秒)
+    file_watch_max_delay_seconds: float = 1.0  # 目录监听持续有事件时最长等待该时间后推送一次(秒)
+    file_watch_heartbeat_seconds: float = 15.0  # 目录监听没有变化时推送心跳的间隔(秒)
+    file_watch_max_subscriptions: int = 32  # 同时存在的目录监听订阅数上限
+    file_manifest_max_roots: int = 4  # 同时维护文件清单的根目录数量，超过后关闭最久未使用的清单
+    file_manifest_max_tombstones: int = 100000  # 文件清单保留的删除记录数，更早的令牌需要全量同步
+    file_download_chunk_size: int = 1024 * 1024  # 下载文件时每次读取发送的字节数
 
     model_config = SettingsConfigDict(
         env_file=".env",
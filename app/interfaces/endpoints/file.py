@@ -1,18 +1,31 @@
+import json
 import os.path
-from fastapi import APIRouter, Depends, File, Form, UploadFile
-from fastapi.responses import FileResponse
+from email.utils import parsedate_to_datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, Form, Query, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response as HTTPResponse, StreamingResponse
+from starlette.datastructures import Headers
+
+from app.core.config import get_settings
+from app.interfaces.errors.exceptions import AppException, BadRequestException
 from app.interfaces.schemas.base import Response
 from app.interfaces.schemas.file import (
     FileReadRequest,
+    FileBatchReadRequest,
     FileWriteRequest,
     FileReplaceRequest,
     FileSearchRequest,
+    FileGrepRequest,
+    FileIndexRequest,
     FileFindRequest,
+    FileFuzzyFindRequest,
+    FileChangesRequest,
     FileCheckRequest,
     FileDeleteRequest
     )
 from app.interfaces.service_dependencies import get_file_service
-from app.models.file import FileReadResult
+from app.models.file import FileReadResult, FileBatchReadResult, FileGrepResult, FileIndexInfo, FileFuzzyFindResult, FileChangesResult
 from app.services.file import (
     FileService,
     FileWriteResult,
@@ -28,7 +41,7 @@ from app.services.file import (
 router = APIRouter(prefix="/file", tags=["文件模块"])
 
 @router.post(
-    path="read-file",
+    path="/read-file",
     response_model=Response[FileReadResult]
 )
 async def read_file(
@@ -41,13 +54,34 @@ async def read_file(
         start_line=request.start_line,
         end_line=request.end_line,
         sudo=request.sudo,
-        max_lenght=request.max_lenght
+        max_length=request.max_length,
+        tail_lines=request.tail_lines,
+        if_none_match=request.if_none_match,
+        hash_algorithm=request.hash_algorithm,
     )
     return Response.success(
-        msg="文件读取成功",
+        msg="文件未修改" if result.not_modified else "文件读取成功",
         data=result
     )
 
+@router.post(
+    path="/read-files",
+    response_model=Response[FileBatchReadResult]
+)
+async def read_files(
+    request: FileBatchReadRequest,
+    file_service: FileService = Depends(get_file_service)
+) -> Response[FileBatchReadResult]:
+    """并发读取一组文件，一次返回每个文件的读取结果或错误"""
+    if not request.files:
+        raise BadRequestException("文件列表为空，请核实后重试")
+    result = await file_service.read_files(files=request.files)
+    succeeded = sum(1 for item in result.results if item.success)
+    return Response.success(
+        msg=f"批量读取完成，成功{succeeded}个，失败{len(result.results) - succeeded}个",
+        data=result,
+    )
+
 @router.post(
     path="/write-file",
     response_model=Response[FileWriteResult],
@@ -115,6 +149,96 @@ async def search_in_file(
     )
 
 
+@router.post(
+    path="/grep",
+    response_model=Response[FileGrepResult],
+)
+async def grep(
+        request: FileGrepRequest,
+        file_service: FileService = Depends(get_file_service),
+) -> HTTPResponse:
+    """在目录树中递归搜索正则，stream为true时以NDJSON逐条返回匹配，最后一行为summary"""
+    options = dict(
+        dir_path=request.dir_path,
+        regex=request.regex,
+        include=request.include,
+        exclude=request.exclude,
+        exclude_dirs=request.exclude_dirs,
+        ignore_case=bool(request.ignore_case),
+        context_lines=request.context_lines,
+        max_results=request.max_results,
+        use_index=request.use_index is not False,
+    )
+    if not request.stream:
+        result = await file_service.grep(**options)
+        return Response.success(
+            msg=f"搜索完毕, 在{result.files_matched}个文件中找到{result.total_matches}处匹配",
+            data=result,
+        )
+
+    events = file_service.grep_stream(**options)
+
+    async def ndjson_stream():
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except AppException as e:
+            yield json.dumps({"type": "error", "msg": e.msg}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post(
+    path="/index",
+    response_model=Response[FileIndexInfo],
+)
+async def enable_index(
+        request: FileIndexRequest,
+        file_service: FileService = Depends(get_file_service),
+) -> Response[FileIndexInfo]:
+    """为目录启用内容索引，索引在后台建立，建立完成后/grep自动使用索引筛选候选文件"""
+    result = await file_service.enable_index(root=request.root)
+    return Response.success(
+        msg=f"目录索引已启用, 当前状态: {result.status}",
+        data=result,
+    )
+
+
+@router.post(
+    path="/index/remove",
+    response_model=Response[FileIndexInfo],
+)
+async def disable_index(
+        request: FileIndexRequest,
+        file_service: FileService = Depends(get_file_service),
+) -> Response[FileIndexInfo]:
+    """停用目录的内容索引"""
+    result = await file_service.disable_index(root=request.root, delete_files=request.delete_files)
+    return Response.success(
+        msg="目录索引已停用",
+        data=result,
+    )
+
+
+@router.get(
+    path="/indexes",
+    response_model=Response[List[FileIndexInfo]],
+)
+async def list_indexes(
+        file_service: FileService = Depends(get_file_service),
+) -> Response[List[FileIndexInfo]]:
+    """获取所有目录索引的状态"""
+    result = file_service.list_indexes()
+    return Response.success(
+        msg=f"共{len(result)}个目录索引",
+        data=result,
+    )
+
+
 @router.post(
     path="/find-files",
     response_model=Response[FileFindResult],
@@ -122,19 +246,125 @@ async def search_in_file(
 async def find_files(
         request: FileFindRequest,
         file_service: FileService = Depends(get_file_service),
-) -> Response[FileFindRequest]:
-    """根据传递的文件夹+glob文件规则查找文件列表"""
-    result = await file_service.find_files(
+) -> HTTPResponse:
+    """根据传递的文件夹+glob文件规则查找文件列表，stream为true时以NDJSON逐条返回条目，最后一行为summary"""
+    options = dict(
         dir_path=request.dir_path,
         glob_pattern=request.glob_pattern,
+        exclude=request.exclude,
+        exclude_dirs=request.exclude_dirs,
+        max_depth=request.max_depth,
+        max_results=request.max_results,
+        cursor=request.cursor,
+        with_metadata=bool(request.with_metadata),
+    )
+    if not request.stream:
+        result = await file_service.find_files(**options)
+        return Response.success(
+            msg=f"查找完毕, 检索到{len(result.files)}个文件" + (", 还有更多结果" if result.truncated else ""),
+            data=result,
+        )
+
+    events = file_service.find_stream(**options)
+
+    async def ndjson_stream():
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except AppException as e:
+            yield json.dumps({"type": "error", "msg": e.msg}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+
+@router.post(
+    path="/fuzzy-find",
+    response_model=Response[FileFuzzyFindResult],
+)
+async def fuzzy_find(
+        request: FileFuzzyFindRequest,
+        file_service: FileService = Depends(get_file_service),
+) -> Response[FileFuzzyFindResult]:
+    """按文件名的一部分模糊查找文件，返回得分最高的文件列表，首次查找某个目录时需要等待路径索引建立"""
+    result = await file_service.fuzzy_find(
+        dir_path=request.dir_path,
+        query=request.query,
+        limit=request.limit,
+    )
     return Response.success(
-        msg=f"查找完毕, 检索到{len(result.files)}个文件",
+        msg=f"查找完毕, 在{result.candidates}个候选文件中返回{len(result.matches)}个",
         data=result,
     )
 
 
+@router.post(
+    path="/changes",
+    response_model=Response[FileChangesResult],
+)
+async def changes_since(
+        request: FileChangesRequest,
+        file_service: FileService = Depends(get_file_service),
+) -> Response[FileChangesResult]:
+    """获取根目录下自上次token以来新增、修改、删除的文件，用于增量同步工作区"""
+    result = await file_service.changes_since(
+        root=request.root,
+        since=request.since,
+        limit=request.limit,
+        hash_algorithm=request.hash_algorithm,
+    )
+    return Response.success(
+        msg=f"获取文件变化成功, 共{len(result.changes)}处变化" + (", 还有更多变化" if result.has_more else ""),
+        data=result,
+    )
+
+
+@router.get(path="/watch")
+async def watch(
+        paths: List[str] = Query(..., description="监听的路径，可以传递多个，目录递归监听，文件可以尚不存在"),
+        debounce: Optional[float] = Query(default=None, description="合并事件时等待事件静默的秒数"),
+        file_service: FileService = Depends(get_file_service),
+) -> StreamingResponse:
+    """使用SSE推送路径的创建、修改、删除、移动变化，短时间内的多次变化合并后推送"""
+    events = file_service.watch(paths=paths, debounce=debounce)
+
+    async def event_stream():
+        try:
+            async for event in events:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except AppException as e:
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'msg': e.msg}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket(path="/watch")
+async def watch_ws(
+        websocket: WebSocket,
+        paths: List[str] = Query(...),
+        debounce: Optional[float] = None,
+        file_service: FileService = Depends(get_file_service),
+) -> None:
+    """使用WebSocket推送路径的变化，客户端断开连接时停止监听"""
+    await websocket.accept()
+    try:
+        events = file_service.watch(paths=paths, debounce=debounce)
+        async for event in events:
+            await websocket.send_json(event)
+    except AppException as e:
+        await websocket.send_json({"type": "error", "msg": e.msg})
+        await websocket.close(code=1008)
+    except WebSocketDisconnect:
+        pass
+
+
 @router.post(
     path="/upload-file",
     response_model=Response[FileUploadResult],
@@ -158,24 +388,59 @@ async def upload_file(
     )
 
 
+def is_not_modified(request_headers: Headers, response_headers: Headers) -> bool:
+    """根据If-None-Match/If-Modified-Since判断客户端缓存的文件是否仍然有效"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match使用弱比较，存在时忽略If-Modified-Since
+        etag = response_headers["etag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(response_headers["last-modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 @router.get(path="/download-file")
+# HEAD单独注册并指定operation_id，避免与GET共用一个路由时生成重复的operation_id
+@router.head(path="/download-file", operation_id="download_file_head")
 async def download_file(
+        request: Request,
         filepath: str,
         file_service: FileService = Depends(get_file_service),
-) -> FileResponse:
-    """根据传递的filepath下载指定的文件"""
-    # 1.确保下当前文件存在
-    await file_service.ensure_file(filepath)
+) -> HTTPResponse:
+    """根据传递的filepath下载指定的文件，支持Range/If-Range断点续传、多段范围以及ETag/Last-Modified条件请求"""
+    # 1.确保当前路径是一个存在的文件，文件信息只获取一次，响应头与发送的内容保持一致
+    stat_result = await file_service.stat_file(filepath)
 
     # 2.提取文件名字
     filename = os.path.basename(filepath)
 
-    # 3.返回文件下载响应
-    return FileResponse(
+    # 3.构建文件下载响应，Range/If-Range、206以及multipart/byteranges由FileResponse处理，
+    # ASGI服务器支持http.response.pathsend扩展时直接由服务器发送文件
+    response = FileResponse(
         path=filepath,
         filename=filename,
         media_type="application/octet-stream",
+        stat_result=stat_result,
     )
+    response.chunk_size = get_settings().file_download_chunk_size
+
+    # 4.客户端缓存的文件未发生变化时返回304
+    if is_not_modified(request.headers, response.headers):
+        return HTTPResponse(
+            status_code=304,
+            headers={
+                "etag": response.headers["etag"],
+                "last-modified": response.headers["last-modified"],
+                "accept-ranges": "bytes",
+            },
+        )
+    return response
 
 
 @router.post(
@@ -1,13 +1,35 @@
-import os
-from fastapi import APIRouter, Depends
+import json
+from typing import List, Optional
 
-from app.interfaces.errors.exceptions import BadRequestException
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from app.interfaces.errors.exceptions import AppException, BadRequestException
 from app.interfaces.schemas.base import Response
-from app.interfaces.schemas.shell import ShellExecuteRequest, ShellKillRequest, ShellReadRequest, ShellWaitRequest, ShellWriteRequest
+from app.interfaces.schemas.shell import (
+    ShellBatchExecuteRequest,
+    ShellExecuteRequest,
+    ShellExpectRequest,
+    ShellKillRequest,
+    ShellReadRequest,
+    ShellWaitCommandRequest,
+    ShellWaitRequest,
+    ShellWriteRequest,
+)
 from app.interfaces.service_dependencies import get_shell_service
 from app.models import shell
 from app.services.shell import ShellService
-from app.models.shell import ShellExecuteResult, ShellKillResult, ShellReadResult, ShellWaitResult, ShellWriteResult
+from app.models.shell import (
+    ShellBatchExecuteResult,
+    ShellExecuteResult,
+    ShellExpectResult,
+    ShellKillResult,
+    ShellOrphanProcess,
+    ShellReadResult,
+    ShellSessionInfo,
+    ShellWaitResult,
+    ShellWriteResult,
+)
 
 router = APIRouter(prefix="/shell", tags=["shell模块"])
 
@@ -24,18 +46,59 @@ async def exec_command(
     # 判断session_id是否存在，不存在新建一个
     if not request.session_id or request.session_id == "":
         request.session_id = shell_service.create_session_id()
-    # 判断运行的目录是否存在，不存在使用根目录
-    if not request.exec_dir or request.exec_dir == "":
-        request.exec_dir = os.path.expanduser("~")
+    # 运行目录为空时由服务处理: 普通会话使用主目录，常驻会话沿用当前工作目录
     result = await shell_service.exec_command(
         session_id=request.session_id,
         exec_dir = request.exec_dir,
-        command = request.command
+        command = request.command,
+        persistent=bool(request.persistent),
+        queued=bool(request.queued),
+        limits=request.limits,
     )
 
     return Response.success(data=result)
 
 
+@router.post(
+    path="/wait-command",
+    response_model=Response[ShellExecuteResult]
+)
+async def wait_command(
+    request: ShellWaitCommandRequest,
+    shell_service: ShellService = Depends(get_shell_service)
+) -> Response[ShellExecuteResult]:
+    """根据会话id+排队命令id等待命令执行结束，超时后返回命令当前的状态"""
+    if not request.session_id or not request.command_id:
+        raise BadRequestException("Shell会话ID或命令ID为空，请核实后重试")
+    result = await shell_service.wait_command(
+        session_id=request.session_id,
+        command_id=request.command_id,
+        seconds=request.seconds,
+    )
+    return Response.success(data=result)
+
+
+
+@router.post(
+    path="/exec-batch",
+    response_model=Response[ShellBatchExecuteResult]
+)
+async def exec_batch(
+    request: ShellBatchExecuteRequest,
+    shell_service: ShellService = Depends(get_shell_service)
+) -> Response[ShellBatchExecuteResult]:
+    """并发执行一组相互独立的命令，一次返回所有命令的执行结果"""
+    if not request.commands:
+        raise BadRequestException("命令列表为空，请核实后重试")
+    result = await shell_service.exec_batch(
+        commands=request.commands,
+        max_output_length=request.max_output_length,
+    )
+    return Response.success(
+        msg=f"批量执行完成，共{len(result.results)}条命令",
+        data=result,
+    )
+
 
 @router.post(
     path="/read-shell-output",
@@ -50,7 +113,13 @@ async def read_shell_output(
     if not request.session_id or request.session_id == "":
         raise BadRequestException("shell会话ID为空，请核实后重拾")
     # 调用服务获取命令执行结果
-    result = await shell_service.read_shell_output(request.session_id, request.console)
+    result = await shell_service.read_shell_output(
+        session_id=request.session_id,
+        console=request.console,
+        offset=request.offset,
+        tail_lines=request.tail_lines,
+        limit=request.limit,
+    )
 
     return Response.success(data=result)
 
@@ -64,14 +133,47 @@ async def wait_process(
 ) -> Response[ShellWaitResult]:
     """根据会话id+超市时间获取shell结果"""
     # 判断sesionid是否存在
-    if request.session_id or request.session_id == "":
+    if not request.session_id or request.session_id == "":
         raise BadRequestException("Shell会话Id为空，请核实后重试")
-    result = shell_service.wait_process(request.session_id,request.seconds)
+    result = await shell_service.wait_process(request.session_id,request.seconds)
     return Response.success(
         msg=f"进程结束，返回状态码(returncode):{result.returncode}",
         data=result
     )
 
+@router.post(
+    path="/wait-output",
+    response_model=Response[ShellExpectResult]
+)
+async def wait_output(
+    request: ShellExpectRequest,
+    shell_service: ShellService = Depends(get_shell_service)
+) -> Response[ShellExpectResult]:
+    """等待会话输出匹配正则表达式或命令结束，传递多个会话id时任意一个满足条件即返回"""
+    if request.session_ids:
+        result = await shell_service.wait_output_any(
+            session_ids=request.session_ids,
+            pattern=request.pattern,
+            seconds=request.seconds,
+        )
+    elif request.session_id:
+        result = await shell_service.wait_output(
+            session_id=request.session_id,
+            pattern=request.pattern,
+            offset=request.offset,
+            seconds=request.seconds,
+        )
+    else:
+        raise BadRequestException("Shell会话Id为空，请核实后重试")
+
+    if result.matched:
+        msg = "输出匹配成功"
+    elif result.exited:
+        msg = f"命令已结束，返回状态码(returncode):{result.returncode}"
+    else:
+        msg = "等待输出超时"
+    return Response.success(msg=msg, data=result)
+
 @router.post(
     path="/write-shell-input",
     response_model=Response[ShellWriteResult]
@@ -82,10 +184,10 @@ async def write_shell_input(
 ) -> Response[ShellWriteResult]:
     """根据会话加写入内容和按下回车标识向子进程写入数据"""
     # 判断shell会话是否存在
-    if request.session_id or request.session_id == "":
+    if not request.session_id or request.session_id == "":
         raise BadRequestException("Shell会话ID为空，请核实后重试")
     # 调研服务向子进程写入数据
-    result = shell_service.write_shell_input(
+    result = await shell_service.write_shell_input(
         session_id=request.session_id,
         input_text=request.input_text,
         press_enter=request.press_enter
@@ -105,10 +207,83 @@ async def kill_process(
     """根据传递的Shell会话id关闭指定会话"""
 
     # 判断会话是否存在
-    if request.session_id or request.session_id == "":
+    if not request.session_id or request.session_id == "":
         raise BadRequestException("shell会话ID为空，请核实后重试")
-    result= shell_service.kill_process(request.session_id)
+    result= await shell_service.kill_process(request.session_id)
     return Response.success(
         msg="进程中指" if result.status == "terminated" else "进程已结束",
         data=result
-    )
\ No newline at end of file
+    )
+
+
+@router.get(
+    path="/sessions",
+    response_model=Response[List[ShellSessionInfo]]
+)
+async def list_sessions(
+    shell_service: ShellService = Depends(get_shell_service)
+) -> Response[List[ShellSessionInfo]]:
+    """列出所有Shell会话的存活时长、缓冲字节数和进程状态"""
+    sessions = shell_service.list_sessions()
+    return Response.success(
+        msg=f"获取Shell会话成功，共{len(sessions)}个会话",
+        data=sessions,
+    )
+
+
+@router.get(
+    path="/orphans",
+    response_model=Response[List[ShellOrphanProcess]]
+)
+async def list_orphans(
+    shell_service: ShellService = Depends(get_shell_service)
+) -> Response[List[ShellOrphanProcess]]:
+    """列出最近发现的已结束会话泄漏的进程"""
+    orphans = list(shell_service.orphan_processes)
+    return Response.success(
+        msg=f"最近发现{len(orphans)}个泄漏进程",
+        data=orphans,
+    )
+
+
+@router.get(path="/{session_id}/stream")
+async def stream_shell_output(
+    session_id: str,
+    raw: bool = False,
+    offset: Optional[int] = None,
+    shell_service: ShellService = Depends(get_shell_service)
+) -> StreamingResponse:
+    """使用SSE实时推送Shell会话的输出，进程结束时推送exit事件"""
+    events = shell_service.stream_output(session_id=session_id, raw=raw, offset=offset)
+
+    async def event_stream():
+        async for event in events:
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket(path="/{session_id}/stream")
+async def stream_shell_output_ws(
+    websocket: WebSocket,
+    session_id: str,
+    raw: bool = False,
+    offset: Optional[int] = None,
+    shell_service: ShellService = Depends(get_shell_service)
+) -> None:
+    """使用WebSocket实时推送Shell会话的输出，进程结束时推送exit事件后关闭连接"""
+    await websocket.accept()
+    try:
+        events = shell_service.stream_output(session_id=session_id, raw=raw, offset=offset)
+        async for event in events:
+            await websocket.send_json(event)
+        await websocket.close()
+    except AppException as e:
+        await websocket.send_json({"type": "error", "msg": e.msg})
+        await websocket.close(code=1008)
+    except WebSocketDisconnect:
+        pass
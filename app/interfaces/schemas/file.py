@@ -1,12 +1,27 @@
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import List, Optional
+from pydantic import AliasChoices, BaseModel, Field
+
+from app.models.file import FileBatchReadItem
 
 class FileReadRequest(BaseModel):
+    """读取文件请求结构体"""
     filepath: str = Field(..., description="要读取文件的绝对路径")
-    start_line: Optional[int] = Field(default=None, description="（可选）读取的起始行数，从零开始")
-    end_line: Optional[int] = Field(default=None, description="（可选）读取的结束行号，不包含该行")
+    start_line: Optional[int] = Field(default=None, description="（可选）读取的起始行数，从零开始，负数表示倒数第几行")
+    end_line: Optional[int] = Field(default=None, description="（可选）读取的结束行号，不包含该行，负数表示倒数第几行")
+    tail_lines: Optional[int] = Field(default=None, description="（可选）读取文件的最后几行，传递后忽略起始和结束行号")
     sudo: Optional[bool] = Field(default=False, description="（可选）是否使用root权限")
-    max_lenght: Optional[int] = Field(default=10000, description="（可选）返回的最大长度")
+    max_length: Optional[int] = Field(
+        default=10000,
+        validation_alias=AliasChoices("max_length", "max_lenght"),
+        description="（可选）返回的最大长度，tail模式下保留末尾的内容",
+    )
+    if_none_match: Optional[str] = Field(default=None, description="（可选）上次读取返回的指纹或内容哈希，文件未修改时不返回内容")
+    hash_algorithm: Optional[str] = Field(default=None, description="（可选）计算内容哈希的算法: sha256/sha1/md5/blake2b，为空时不计算")
+
+class FileBatchReadRequest(BaseModel):
+    """批量读取文件请求结构体"""
+    files: List[FileBatchReadItem] = Field(..., description="需要读取的文件列表，文件之间相互独立并发读取")
+
 
 class FileWriteRequest(BaseModel):
     """写入文件请求结构体"""
@@ -33,10 +48,52 @@ class FileSearchRequest(BaseModel):
     sudo: Optional[bool] = Field(default=False, description="(可选)是否使用sudo权限")
 
 
+class FileGrepRequest(BaseModel):
+    """目录递归搜索请求结构体"""
+    dir_path: str = Field(..., description="搜索的目录绝对路径")
+    regex: str = Field(..., description="搜索正则表达式，按行匹配")
+    include: Optional[List[str]] = Field(default=None, description="(可选)只搜索文件名或相对路径匹配这些glob规则的文件")
+    exclude: Optional[List[str]] = Field(default=None, description="(可选)跳过文件名或相对路径匹配这些glob规则的文件和目录")
+    exclude_dirs: Optional[List[str]] = Field(default=None, description="(可选)跳过的目录名，为空时跳过.git、node_modules等常见目录")
+    ignore_case: Optional[bool] = Field(default=False, description="(可选)是否忽略大小写")
+    context_lines: Optional[int] = Field(default=0, description="(可选)返回匹配行前后的上下文行数")
+    max_results: Optional[int] = Field(default=1000, description="(可选)最多返回的匹配数，达到后提前结束搜索")
+    stream: Optional[bool] = Field(default=False, description="(可选)是否以NDJSON流的方式边搜索边返回")
+    use_index: Optional[bool] = Field(default=True, description="(可选)目录已建立索引时是否使用索引筛选候选文件")
+
+
+class FileIndexRequest(BaseModel):
+    """目录索引请求结构体"""
+    root: str = Field(..., description="建立索引的根目录绝对路径")
+    delete_files: Optional[bool] = Field(default=False, description="(可选)停用索引时是否删除磁盘上的索引文件")
+
+
 class FileFindRequest(BaseModel):
     """文件查找请求结构体"""
     dir_path: str = Field(..., description="搜索的目录绝对路径")
-    glob_pattern: str = Field(..., description="文件名模式(glob语法)")
+    glob_pattern: str = Field(..., description="文件名模式(glob语法)，匹配相对于dir_path的路径，**匹配任意层目录")
+    exclude: Optional[List[str]] = Field(default=None, description="(可选)跳过文件名或相对路径匹配这些glob规则的文件和目录")
+    exclude_dirs: Optional[List[str]] = Field(default=None, description="(可选)跳过的目录名，为空时跳过.git、node_modules等常见目录")
+    max_depth: Optional[int] = Field(default=None, description="(可选)最大遍历深度，1表示只查找dir_path的直接子项")
+    max_results: Optional[int] = Field(default=1000, description="(可选)单次最多返回的条目数，达到后提前结束并返回next_cursor")
+    cursor: Optional[str] = Field(default=None, description="(可选)上一次查找返回的next_cursor，从该位置继续查找")
+    with_metadata: Optional[bool] = Field(default=False, description="(可选)是否返回每个条目的大小和修改时间")
+    stream: Optional[bool] = Field(default=False, description="(可选)是否以NDJSON流的方式边查找边返回")
+
+
+class FileFuzzyFindRequest(BaseModel):
+    """文件名模糊查找请求结构体"""
+    dir_path: str = Field(..., description="查找的目录绝对路径")
+    query: str = Field(..., description="查询字符串，按子序列匹配文件的相对路径，全部为小写时忽略大小写")
+    limit: Optional[int] = Field(default=50, description="(可选)返回得分最高的前limit个文件")
+
+
+class FileChangesRequest(BaseModel):
+    """获取文件变化请求结构体"""
+    root: str = Field(..., description="同步的根目录绝对路径")
+    since: Optional[str] = Field(default=None, description="(可选)上一次返回的token，为空时返回全部文件")
+    limit: Optional[int] = Field(default=10000, description="(可选)单次最多返回的变化数，超过时分页，使用返回的token继续获取")
+    hash_algorithm: Optional[str] = Field(default=None, description="(可选)为新增和修改的文件计算内容哈希的算法: sha256/sha1/md5/blake2b")
 
 
 class FileCheckRequest(BaseModel):
@@ -1,22 +1,49 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
+from app.models.shell import ShellBatchCommand, ShellResourceLimits
+
 class ShellExecuteRequest(BaseModel):
     """执行shell的请求体"""
     session_id: Optional[str] = Field(default=None,description="会话的唯一标识符")
     exec_dir: Optional[str] = Field(default=None, description="执行命令的工作目录")
     command: str = Field(..., description="shell命令")
+    persistent: Optional[bool] = Field(default=False, description="(可选)新建会话时是否使用常驻的PTY bash，命令之间保留工作目录和环境变量")
+    queued: Optional[bool] = Field(default=False, description="(可选)会话已存在时将命令加入队列，等上一条命令结束后再执行，立即返回command_id")
+    limits: Optional[ShellResourceLimits] = Field(default=None, description="(可选)新建会话时设置的nice/ionice和cgroup资源上限，对已存在的会话无效")
+
+class ShellBatchExecuteRequest(BaseModel):
+    """批量执行shell命令的请求体"""
+    commands: List[ShellBatchCommand] = Field(..., description="需要执行的命令列表，命令之间相互独立并发执行")
+    max_output_length: Optional[int] = Field(default=10000, description="(可选)每条命令返回的最大输出字节数，超出时保留末尾部分")
 
 class ShellReadRequest(BaseModel):
     """查看Shell执行内容请求结构体"""
     session_id: str = Field(..., description="目标Shell会话多唯一标识富符")
     console: Optional[bool] = Field(default=None, description="是否返回控制台记录列表")
+    offset: Optional[int] = Field(default=None, description="(可选)读取起始的绝对偏移，传递上次返回的next_offset实现增量读取")
+    tail_lines: Optional[int] = Field(default=None, description="(可选)只返回最后N行输出")
+    limit: Optional[int] = Field(default=None, description="(可选)最多读取的字节数，配合next_offset分页读取大量输出")
 
 class ShellWaitRequest(BaseModel):
     session_id: str = Field(...,description="shell会话id")
     seconds: Optional[int] = Field(default=None, description="等待时机，单位为s")
 
+class ShellExpectRequest(BaseModel):
+    """等待输出匹配的请求结构体"""
+    session_id: Optional[str] = Field(default=None, description="目标Shell会话唯一标识符")
+    session_ids: Optional[List[str]] = Field(default=None, description="(可选)同时等待多个会话，任意一个满足条件即返回")
+    pattern: Optional[str] = Field(default=None, description="(可选)匹配输出的正则表达式，为空表示有任意新输出即返回")
+    offset: Optional[int] = Field(default=None, description="(可选)从该绝对偏移开始匹配，默认从当前命令的输出开头开始，仅等待单个会话时有效")
+    seconds: Optional[int] = Field(default=None, description="等待超时时间，单位为s")
+
+class ShellWaitCommandRequest(BaseModel):
+    """等待排队命令结果的请求结构体"""
+    session_id: str = Field(..., description="目标Shell会话唯一标识符")
+    command_id: str = Field(..., description="排队执行时返回的命令ID")
+    seconds: Optional[int] = Field(default=None, description="等待超时时间，单位为s，超时后返回命令当前的状态")
+
 class ShellWriteRequest(BaseModel):
     """Shell写入请求结构体"""
     session_id: str = Field(..., description="目标Shell会话唯一标识符")
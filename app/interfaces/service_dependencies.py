@@ -10,7 +10,7 @@ def get_shell_service() -> ShellService:
 
 @lru_cache
 def get_file_service() -> FileService:
-    return FileService
+    return FileService()
 
 @lru_cache
 def get_supervisor_service() -> SupervisorService:
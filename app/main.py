@@ -6,6 +6,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import get_settings
+from app.interfaces.service_dependencies import get_file_service, get_shell_service
 from app.interfaces.endpoints.routers import router
 from app.interfaces.errors.exception_handler import register_exception_handlers
 def setup_logging() -> None:
@@ -38,10 +39,17 @@ def setup_logging() -> None:
 async def lifespan(app: FastAPI):
     """fastapi的生命上下文周期管理器"""
     logger.info("沙箱正在初始化")
+    # 启动Shell服务的后台任务(预热bash进程池)
+    shell_service = get_shell_service()
+    await shell_service.start()
+    # 启动文件服务的后台任务(目录内容索引)
+    await get_file_service().start()
 
     try:
         yield
     finally:
+        await shell_service.close()
+        await get_file_service().close()
         logger.info("沙箱关闭成功")
 
 setup_logging()
@@ -5,17 +5,52 @@ class FileReadResult(BaseModel):
     """文件读取的结果"""
     filepath: str = Field(..., description="要读取的文件绝对路径")
     content: str = Field(..., description="读取文件的结果")
+    start_line: Optional[int] = Field(default=None, description="返回内容的起始行号，从零开始，无法确定时为空")
+    end_line: Optional[int] = Field(default=None, description="返回内容的结束行号，不包含该行，无法确定时为空")
+    total_lines: Optional[int] = Field(default=None, description="文件的总行数，尚未扫描到文件末尾时为空")
+    file_size: Optional[int] = Field(default=None, description="文件的大小, 单位为字节")
+    truncated: bool = Field(default=False, description="返回的内容是否因超过最大长度被截断")
+    fingerprint: Optional[str] = Field(default=None, description="文件指纹(inode-修改时间-大小)，可作为下次读取的if_none_match")
+    content_hash: Optional[str] = Field(default=None, description="按需计算的内容哈希，格式为算法:十六进制摘要")
+    not_modified: bool = Field(default=False, description="文件与if_none_match一致未被修改，此时不返回内容")
+
+class FileBatchReadItem(BaseModel):
+    """批量读取中的单个文件"""
+    filepath: str = Field(..., description="要读取文件的绝对路径")
+    start_line: Optional[int] = Field(default=None, description="（可选）读取的起始行数，从零开始，负数表示倒数第几行")
+    end_line: Optional[int] = Field(default=None, description="（可选）读取的结束行号，不包含该行，负数表示倒数第几行")
+    tail_lines: Optional[int] = Field(default=None, description="（可选）读取文件的最后几行，传递后忽略起始和结束行号")
+    sudo: Optional[bool] = Field(default=False, description="（可选）是否使用root权限")
+    max_length: Optional[int] = Field(default=10000, description="（可选）返回的最大长度，tail模式下保留末尾的内容")
+    if_none_match: Optional[str] = Field(default=None, description="（可选）上次读取返回的指纹或内容哈希，文件未修改时不返回内容")
+    hash_algorithm: Optional[str] = Field(default=None, description="（可选）计算内容哈希的算法: sha256/sha1/md5/blake2b，为空时不计算")
+
+class FileBatchReadItemResult(BaseModel):
+    """批量读取中单个文件的结果"""
+    index: int = Field(..., description="文件在请求列表中的下标")
+    filepath: str = Field(..., description="要读取的文件绝对路径")
+    success: bool = Field(default=False, description="是否读取成功")
+    result: Optional[FileReadResult] = Field(default=None, description="读取成功时的读取结果")
+    error: Optional[str] = Field(default=None, description="读取失败时的错误信息")
+
+
+class FileBatchReadResult(BaseModel):
+    """批量读取文件的结果"""
+    results: List[FileBatchReadItemResult] = Field(default_factory=list, description="与请求顺序一致的文件读取结果")
+
 
 class FileWriteResult(BaseModel):
     """文件写入结果"""
     filepath: str = Field(..., description="要写入的文件绝对路径")
     bytes_written: Optional[int] = Field(default=None, description="写入文件内容的字节数")
+    fingerprint: Optional[str] = Field(default=None, description="写入后的文件指纹")
 
 
 class FileReplaceResult(BaseModel):
     """文件内容替换结果模型"""
     filepath: str = Field(..., description="要替换内容的文件绝对路径")
     replaced_count: int = Field(default=0, description="替换内容的次数")
+    fingerprint: Optional[str] = Field(default=None, description="替换后的文件指纹")
 
 
 class FileSearchResult(BaseModel):
@@ -25,10 +60,99 @@ class FileSearchResult(BaseModel):
     line_numbers: List[int] = Field(default_factory=list, description="匹配的行号列表")
 
 
+class FileGrepMatch(BaseModel):
+    """目录搜索中的一处匹配"""
+    filepath: str = Field(..., description="匹配所在文件的绝对路径")
+    line_number: int = Field(..., description="匹配所在的行号，从零开始")
+    line: str = Field(..., description="匹配所在行的内容")
+    before_context: List[str] = Field(default_factory=list, description="匹配行之前的上下文")
+    after_context: List[str] = Field(default_factory=list, description="匹配行之后的上下文")
+
+
+class FileGrepResult(BaseModel):
+    """目录搜索结果"""
+    dir_path: str = Field(..., description="搜索的目录绝对路径")
+    matches: List[FileGrepMatch] = Field(default_factory=list, description="匹配列表")
+    files_scanned: int = Field(default=0, description="搜索过的文件数")
+    files_matched: int = Field(default=0, description="存在匹配的文件数")
+    files_skipped: int = Field(default=0, description="因二进制、体积过大或无法读取而跳过的文件数")
+    total_matches: int = Field(default=0, description="返回的匹配数")
+    truncated: bool = Field(default=False, description="是否因达到max_results提前结束")
+    indexed: bool = Field(default=False, description="是否使用了目录索引筛选候选文件")
+
+
+class FileIndexInfo(BaseModel):
+    """目录内容索引的状态"""
+    root: str = Field(..., description="建立索引的根目录")
+    status: str = Field(..., description="索引状态: pending/building/ready/error/closed")
+    error: Optional[str] = Field(default=None, description="建立索引失败时的错误信息")
+    files: int = Field(default=0, description="基础索引中的文件数")
+    trigrams: int = Field(default=0, description="基础索引中的三元组数")
+    built_at: Optional[float] = Field(default=None, description="基础索引开始建立的时间戳")
+    overlay_files: int = Field(default=0, description="基础索引之后发生变化、保存在内存中的文件数")
+    pending_files: int = Field(default=0, description="已收到变化事件、尚未重新索引的文件数")
+    watching: bool = Field(default=False, description="是否正在通过inotify监听目录变化")
+    watched_dirs: int = Field(default=0, description="监听的目录数")
+
+
+class FileFindEntry(BaseModel):
+    """文件查找到的一个条目"""
+    path: str = Field(..., description="条目的绝对路径")
+    relpath: str = Field(..., description="条目相对于搜索目录的路径")
+    file_type: str = Field(..., description="条目类型: file/dir/symlink/other")
+    size: Optional[int] = Field(default=None, description="条目大小(字节)，with_metadata为true时返回")
+    mtime: Optional[float] = Field(default=None, description="条目修改时间戳，with_metadata为true时返回")
+
+
 class FileFindResult(BaseModel):
     """文件查找结果"""
     dir_path: str = Field(..., description="搜索的目录绝对路径")
     files: List[str] = Field(default_factory=list, description="检索到的文件列表")
+    entries: List[FileFindEntry] = Field(default_factory=list, description="检索到的条目及其类型、大小、修改时间")
+    truncated: bool = Field(default=False, description="是否因达到max_results提前结束")
+    next_cursor: Optional[str] = Field(default=None, description="继续查找下一页时传递的游标，没有更多结果时为空")
+
+
+class FileFuzzyMatch(BaseModel):
+    """模糊查找到的一个文件"""
+    path: str = Field(..., description="文件的绝对路径")
+    relpath: str = Field(..., description="文件相对于查找目录的路径")
+    score: int = Field(..., description="匹配得分，越高越靠前")
+    positions: List[int] = Field(default_factory=list, description="查询字符在relpath中的匹配位置")
+
+
+class FileFuzzyFindResult(BaseModel):
+    """文件名模糊查找结果"""
+    dir_path: str = Field(..., description="查找的目录绝对路径")
+    query: str = Field(..., description="查询字符串")
+    matches: List[FileFuzzyMatch] = Field(default_factory=list, description="按得分从高到低排列的文件列表")
+    candidates: int = Field(default=0, description="包含查询子序列、参与打分的文件数")
+    truncated: bool = Field(default=False, description="候选文件过多时是否只对其中一部分打分")
+    index_root: str = Field(..., description="使用的路径索引的根目录")
+    indexed_files: int = Field(default=0, description="路径索引中的文件总数")
+
+
+class FileChange(BaseModel):
+    """文件清单中的一个变化"""
+    action: str = Field(..., description="变化类型: created/modified/deleted")
+    path: str = Field(..., description="文件的绝对路径")
+    relpath: str = Field(..., description="文件相对于根目录的路径")
+    seq: int = Field(..., description="变化的序号")
+    size: Optional[int] = Field(default=None, description="文件大小(字节)，删除时为空")
+    mtime: Optional[float] = Field(default=None, description="文件修改时间戳，删除时为空")
+    fingerprint: Optional[str] = Field(default=None, description="文件指纹，删除时为空")
+    content_hash: Optional[str] = Field(default=None, description="文件内容哈希，格式为算法:十六进制摘要，请求hash_algorithm时返回")
+
+
+class FileChangesResult(BaseModel):
+    """文件变化查询结果"""
+    root: str = Field(..., description="同步的根目录绝对路径")
+    since: Optional[str] = Field(default=None, description="请求中传递的token")
+    token: str = Field(..., description="下一次请求传递的token")
+    full: bool = Field(default=False, description="是否为全量结果(未传递token或token已失效)，客户端应删除结果中不存在的本地文件")
+    has_more: bool = Field(default=False, description="是否还有更多变化，为true时使用token继续获取")
+    changes: List[FileChange] = Field(default_factory=list, description="按序号从小到大排列的变化列表")
+    total_files: int = Field(default=0, description="清单中当前的文件总数")
 
 
 class FileUploadResult(BaseModel):
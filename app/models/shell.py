@@ -1,12 +1,29 @@
 import asyncio
-from sys import ps1
-from tkinter import N, NO
-from token import OP
-from click import command
+import collections
+import time
 from pydantic import BaseModel, Field, ConfigDict
 
-from typing import Optional, List
+from typing import Any, Deque, Dict, Optional, List
 
+from app.models.shell_output import AnsiStripper, ShellOutputBuffer
+
+
+class ShellResourceLimits(BaseModel):
+    """Shell会话中命令的调度优先级和资源上限，未设置的字段使用服务的默认配置"""
+    nice: Optional[int] = Field(default=None, ge=-20, le=19, description="进程的nice值，越大优先级越低")
+    ionice_class: Optional[int] = Field(default=None, ge=0, le=3, description="IO调度类别: 0不设置/1实时/2尽力而为/3空闲")
+    ionice_level: Optional[int] = Field(default=None, ge=0, le=7, description="IO调度优先级，越大优先级越低")
+    cpu_limit: Optional[float] = Field(default=None, ge=0, description="会话可使用的CPU核数(cgroup cpu.max)，0表示不限制")
+    memory_limit: Optional[int] = Field(default=None, ge=0, description="会话可使用的内存字节数(cgroup memory.max)，0表示不限制")
+
+class ShellCommandUsage(BaseModel):
+    """单条命令的资源占用统计"""
+    started_at: float = Field(..., description="命令开始时间(unix时间戳)")
+    finished_at: Optional[float] = Field(default=None, description="命令结束时间(unix时间戳)，命令未结束时为空")
+    wall_time: float = Field(default=0, description="墙钟时间，单位为s")
+    cpu_user: float = Field(default=0, description="用户态CPU时间，单位为s")
+    cpu_system: float = Field(default=0, description="内核态CPU时间，单位为s")
+    peak_rss: int = Field(default=0, description="单个进程的内存峰值(RSS)，单位为字节")
 
 class ShellExecuteResult(BaseModel):
     """shell命令执行结果"""
@@ -15,33 +32,149 @@ class ShellExecuteResult(BaseModel):
     status: str = Field(..., description="执行状态")
     returncode: Optional[int] = Field(default=None, description="进程返回的代码，进程结束返回")
     output: Optional[str] = Field(default=None, description="进程执行结束后的结果，执行完后才有值")
+    output_offset: Optional[int] = Field(default=None, description="output在会话缓冲区中的起始偏移")
+    truncated: bool = Field(default=False, description="输出超过单次读取上限时只返回末尾部分，之前的输出可通过read-shell-output按偏移分页读取")
+    usage: Optional[ShellCommandUsage] = Field(default=None, description="命令的资源占用统计，未结束时为当前的统计")
+    command_id: Optional[str] = Field(default=None, description="排队执行的命令ID，可通过wait-command等待该命令的结果")
 
 class ConsoleRecord(BaseModel):
     """Shell命令控制台记录"""
     ps1: str = Field(..., description="ps1")
     command: str = Field(..., description="执行的命令")
     output: str = Field(default="", description="输出内容")
+    truncated: bool = Field(default=False, description="输出超过单次读取上限，只返回了末尾部分")
+    start_offset: int = Field(default=0, description="该命令输出在会话缓冲区中的起始偏移")
+    end_offset: Optional[int] = Field(default=None, description="该命令输出在会话缓冲区中的结束偏移，命令未结束时为空")
+    usage: Optional[ShellCommandUsage] = Field(default=None, description="该命令的资源占用统计")
+    returncode: Optional[int] = Field(default=None, description="该命令的返回码，命令未结束时为空")
+
+    @property
+    def finished(self) -> bool:
+        """命令是否已经结束(正常结束或被后续命令替换)"""
+        return self.returncode is not None or self.end_offset is not None
+
+class QueuedCommand(BaseModel):
+    """会话中排队执行的命令"""
+    command_id: str = Field(..., description="命令ID")
+    command: str = Field(..., description="shell执行的命令")
+    exec_dir: Optional[str] = Field(default=None, description="执行命令的工作目录")
+    status: str = Field(default="queued", description="执行状态: queued/running/completed/cancelled/error")
+    record: Optional[ConsoleRecord] = Field(default=None, description="命令开始执行后对应的控制台记录")
+    error: Optional[str] = Field(default=None, description="命令启动失败的原因")
+    done: asyncio.Event = Field(default_factory=asyncio.Event, description="命令结束事件")
+
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True,
+    )
+
 class Shell(BaseModel):
     """会话模型"""
     process: asyncio.subprocess.Process = Field(..., description="会话中的子进程")
     exec_dir: str = Field(..., description="会话执行目录")
-    output: str = Field(..., description="会话输出")
+    buffer: ShellOutputBuffer = Field(..., description="会话输出缓冲区，由会话和控制台记录共享")
+    stripper: AnsiStripper = Field(default_factory=AnsiStripper, description="会话输出的增量ANSI过滤器")
+    # 运行期对象(ShellOutputThrottle、PtyShell、ProcessUsageTracker)由服务层创建，模型层不依赖服务层的实现
+    throttle: Any = Field(..., description="会话输出读取的流量控制器(ShellOutputThrottle)")
+    output_reader: Optional[asyncio.Task] = Field(default=None, description="当前进程的输出读取任务")
+    pty: Optional[Any] = Field(default=None, description="常驻会话的PTY bash(PtyShell)，为空表示每条命令启动一个新进程")
     console_records: List[ConsoleRecord] = Field(default_factory=list, description="Shell会话中控制记录列表")
+    usage_tracker: Optional[Any] = Field(default=None, description="当前命令的资源占用统计器(ProcessUsageTracker)")
+    lock: asyncio.Lock = Field(default_factory=asyncio.Lock, description="启动命令时持有的锁，避免并发请求同时替换进程")
+    command_queue: Deque[QueuedCommand] = Field(default_factory=collections.deque, description="等待执行的命令队列(FIFO)")
+    queued_commands: Dict[str, QueuedCommand] = Field(default_factory=dict, description="排队命令ID到命令的映射，保留最近的命令用于查询结果")
+    queue_worker: Optional[asyncio.Task] = Field(default=None, description="按顺序执行排队命令的后台任务")
+    limits: ShellResourceLimits = Field(default_factory=ShellResourceLimits, description="会话生效的调度优先级和资源上限")
+    cgroup_path: Optional[str] = Field(default=None, description="会话所在的cgroup目录，cgroup不可用时为空")
+    created_at: float = Field(default_factory=time.time, description="会话创建时间戳")
+    last_active_at: float = Field(default_factory=time.time, description="会话最近访问时间戳")
 
     model_config = ConfigDict(
         arbitrary_types_allowed=True,
     )
 
 
+class ShellBatchCommand(BaseModel):
+    """批量执行中的单条命令"""
+    command: str = Field(..., description="shell命令")
+    exec_dir: Optional[str] = Field(default=None, description="(可选)执行命令的工作目录，默认为主目录")
+    timeout: Optional[int] = Field(default=None, description="(可选)命令超时时间，单位为s")
+
+class ShellBatchCommandResult(BaseModel):
+    """批量执行中单条命令的结果"""
+    index: int = Field(..., description="命令在请求列表中的下标")
+    command: str = Field(..., description="shell执行的命令")
+    exec_dir: str = Field(..., description="执行命令的工作目录")
+    status: str = Field(..., description="执行状态: completed/timeout/error")
+    returncode: Optional[int] = Field(default=None, description="进程返回的代码")
+    duration: float = Field(default=0, description="命令执行耗时，单位为s")
+    output: str = Field(default="", description="命令输出，超出长度时只保留末尾部分")
+    truncated: bool = Field(default=False, description="输出是否被截断")
+
+class ShellBatchExecuteResult(BaseModel):
+    """批量执行shell命令的结果"""
+    results: List[ShellBatchCommandResult] = Field(default_factory=list, description="与请求顺序一致的命令执行结果")
+
+
 class ShellWaitResult(BaseModel):
     """会话等待结果模型"""
     returncode: int = Field(..., description="子进程返回的代码")
+    usage: Optional[ShellCommandUsage] = Field(default=None, description="命令的资源占用统计")
+
+class ShellExpectResult(BaseModel):
+    """等待输出匹配的结果"""
+    session_id: str = Field(..., description="满足条件的Shell会话ID")
+    matched: bool = Field(default=False, description="输出是否匹配")
+    match: Optional[str] = Field(default=None, description="匹配到的文本")
+    groups: List[Optional[str]] = Field(default_factory=list, description="正则表达式的分组内容")
+    exited: bool = Field(default=False, description="命令是否已经结束")
+    returncode: Optional[int] = Field(default=None, description="命令结束时的返回码")
+    timed_out: bool = Field(default=False, description="是否等待超时")
+    output: str = Field(default="", description="从起始偏移到当前的输出，超过单次读取上限时只保留末尾部分")
+    output_offset: int = Field(default=0, description="output在会话缓冲区中的起始偏移")
+    truncated: bool = Field(default=False, description="输出是否因超过单次读取上限被截断")
+    pending: str = Field(default="", description="尚未换行的当前行(如交互提示)，不计入next_offset，换行后会出现在下次读取的output中")
+    next_offset: int = Field(default=0, description="下次增量读取时传递的偏移")
 
 class ShellReadResult(BaseModel):
     """shell命令结果模型"""
     session_id: str = Field(..., description="Shell会话ID")
     output: str = Field(..., description="Shell会话输出内容")
+    output_offset: int = Field(default=0, description="output在会话缓冲区中的起始偏移")
+    truncated: bool = Field(default=False, description="输出超过单次读取上限: 读取当前命令或最后N行时只返回末尾部分，按偏移读取时next_offset之后还有未读取的输出")
     console_records: List[ConsoleRecord] = Field(default_factory=list, description="控制台记录")
+    pending: str = Field(default="", description="尚未换行的当前行(如交互提示)，只在读取到末尾时返回，不计入next_offset，换行后会出现在下次读取的output中")
+    next_offset: int = Field(default=0, description="下次增量读取时传递的偏移")
+
+
+class ShellSessionInfo(BaseModel):
+    """Shell会话状态信息"""
+    session_id: str = Field(..., description="Shell会话ID")
+    pid: Optional[int] = Field(default=None, description="会话当前进程的pid，常驻会话为bash的pid")
+    persistent: bool = Field(default=False, description="是否为常驻PTY会话")
+    running: bool = Field(..., description="是否有命令正在执行")
+    returncode: Optional[int] = Field(default=None, description="最近一条命令的返回码")
+    exec_dir: str = Field(..., description="会话执行目录")
+    command: Optional[str] = Field(default=None, description="最近执行的命令")
+    command_count: int = Field(default=0, description="会话中执行过的命令数")
+    age_seconds: float = Field(..., description="会话存活时长，单位为秒")
+    idle_seconds: float = Field(..., description="会话空闲时长，单位为秒")
+    output_bytes_read: int = Field(default=0, description="累计读取的输出字节数")
+    output_bytes_dropped: int = Field(default=0, description="超出输出速率被丢弃的字节数")
+    throttled_seconds: float = Field(default=0, description="超出输出速率暂停读取的累计时间，单位为秒")
+    buffered_bytes: int = Field(default=0, description="输出缓冲区中保留的字节数，包含溢出到磁盘的数据")
+    spilled_bytes: int = Field(default=0, description="溢出到磁盘的字节数")
+    memory_bytes: int = Field(default=0, description="会话占用内存的估算值，单位为字节")
+    limits: Optional[ShellResourceLimits] = Field(default=None, description="会话生效的调度优先级和资源上限")
+    cgroup: Optional[str] = Field(default=None, description="会话所在的cgroup目录")
+
+
+class ShellOrphanProcess(BaseModel):
+    """已结束会话泄漏的进程"""
+    pid: int = Field(..., description="进程pid")
+    tag: str = Field(..., description="进程所属的会话或命令标记")
+    command: str = Field(default="", description="进程的命令行")
+    found_at: float = Field(..., description="发现时间(unix时间戳)")
+    killed: bool = Field(default=False, description="是否已经强制结束")
 
 
 class ShellWriteResult(BaseModel):
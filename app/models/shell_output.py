@@ -0,0 +1,460 @@
+import asyncio
+import collections
+import logging
+import mmap
+import os
+import re
+import tempfile
+from array import array
+from typing import Any, Awaitable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class AnsiStripper:
+    """增量ANSI转义序列过滤器，在输出写入时执行一次，支持跨数据块的转义序列以及回车覆盖(进度条)语义"""
+
+    # 按控制字符切分: OSC序列、CSI序列、字符集选择及其他ESC序列、换行/回车/退格以及普通文本
+    token_regex = re.compile(
+        r"\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+        r"|\x1b\[[0-?]*[ -/]*[@-~]"
+        r"|\x1b[()*+\-./#%][ -~]"
+        r"|\x1b[ -~]?"
+        r"|\r\n|[\r\n\b]"
+        r"|[^\x1b\r\n\b]+"
+    )
+    # 数据块末尾不完整的转义序列，保留到下一块数据到达后再处理
+    partial_regex = re.compile(r"\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[()*+\-./#%])?\Z")
+    control_chars = ("\x1b", "\r", "\b")
+
+    def __init__(self, max_line_size: int = 64 * 1024) -> None:
+        """构造函数，当前行超过max_line_size仍未换行时强制提交，避免单行无限增长"""
+        self.max_line_size = max_line_size
+        self.line = ""  # 当前未结束的行，回车后会被后续内容覆盖
+        self._col = 0  # 当前行的光标位置
+        self._pending = ""  # 上一块数据末尾不完整的转义序列
+
+    def feed(self, text: str) -> str:
+        """传入新的原始输出，返回已完成(以换行结尾)的干净文本，未结束的行保存在line中"""
+        text = self._pending + text
+        self._pending = ""
+        partial = self.partial_regex.search(text)
+        if partial and len(text) - partial.start() <= 4096:
+            self._pending = partial.group()
+            text = text[:partial.start()]
+
+        # 1.快速路径: 不包含控制字符且光标在行尾时直接按最后一个换行切分
+        if self._col == len(self.line) and not any(char in text for char in self.control_chars):
+            last_newline = text.rfind("\n")
+            if last_newline == -1:
+                committed = ""
+                self.line += text
+            else:
+                committed = self.line + text[:last_newline + 1]
+                self.line = text[last_newline + 1:]
+            self._col = len(self.line)
+            return committed + self._limit_line()
+
+        # 2.逐个处理控制字符和文本片段
+        committed = []
+        for match in self.token_regex.finditer(text):
+            token = match.group()
+            if token == "\n" or token == "\r\n":
+                committed.append(self.line + "\n")
+                self.line = ""
+                self._col = 0
+            elif token == "\r":
+                self._col = 0
+            elif token == "\b":
+                self._col = max(self._col - 1, 0)
+            elif token.startswith("\x1b"):
+                # 清除到行尾(ESC[K/ESC[0K)常与回车配合刷新进度条，其余转义序列直接丢弃
+                if token in ("\x1b[K", "\x1b[0K"):
+                    self.line = self.line[:self._col]
+            else:
+                self.line = self.line[:self._col] + token + self.line[self._col + len(token):]
+                self._col += len(token)
+        return "".join(committed) + self._limit_line()
+
+    def _limit_line(self) -> str:
+        """当前行超过上限时强制提交"""
+        if len(self.line) <= self.max_line_size:
+            return ""
+        line = self.line
+        self.line = ""
+        self._col = 0
+        return line
+
+    def flush(self) -> str:
+        """命令结束时提交未结束的行"""
+        line = self.line
+        self.line = ""
+        self._col = 0
+        self._pending = ""
+        return line
+
+
+class ShellOutputSubscriber:
+    """Shell输出订阅者，限制队列中积压的输出事件数，消费过慢时跳过积压数据而不阻塞输出读取器，
+    退出等控制事件不受限制，始终会送达订阅者"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = max(maxsize, 1)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.backlog = 0  # 队列中积压的输出事件数
+        self.skipped_bytes = 0  # 因消费过慢而跳过的字节数
+
+    def put(self, event: Dict[str, Any]) -> None:
+        """非阻塞的投递事件，积压的输出达到上限时丢弃积压的输出并插入一条跳过事件"""
+        if event["type"] != "output":
+            self.queue.put_nowait(event)
+            return
+        if self.backlog < self.maxsize:
+            self.backlog += 1
+            self.queue.put_nowait(event)
+            return
+
+        # 1.清空队列，统计积压的输出事件跳过的字节数，保留退出等控制事件
+        skipped = 0
+        kept = []
+        while not self.queue.empty():
+            pending = self.queue.get_nowait()
+            if pending["type"] == "output":
+                skipped += pending["next_offset"] - pending["offset"]
+            elif pending["type"] == "skipped":
+                skipped += pending["bytes"]
+            else:
+                kept.append(pending)
+        self.skipped_bytes += skipped
+
+        # 2.通知订阅者跳过的范围，可通过read-shell-output按偏移补齐，随后放回控制事件和新的输出
+        self.queue.put_nowait({"type": "skipped", "bytes": skipped, "next_offset": event["offset"]})
+        for pending in kept:
+            self.queue.put_nowait(pending)
+        self.queue.put_nowait(event)
+        self.backlog = 1
+
+    async def get(self) -> Dict[str, Any]:
+        """等待并获取下一个事件"""
+        event = await self.queue.get()
+        if event["type"] == "output":
+            self.backlog -= 1
+        return event
+
+
+class ShellOutputSpillSegment:
+    """溢出到磁盘的输出分段文件，只追加写入，读取时通过mmap映射"""
+
+    def __init__(self, start_offset: int, directory: Optional[str] = None) -> None:
+        self.start_offset = start_offset  # 分段第一个字节的绝对偏移
+        self.size = 0
+        self.fd, self.path = tempfile.mkstemp(prefix="sandbox-shell-", suffix=".log", dir=directory or None)
+
+    def write(self, data: bytes) -> None:
+        """追加写入数据"""
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        self.size += len(data)
+
+    def map(self) -> Optional[mmap.mmap]:
+        """只读映射分段当前的全部数据，分段为空时返回None"""
+        if self.size <= 0:
+            return None
+        return mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        """关闭并删除分段文件"""
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class ShellOutputBuffer:
+    """Shell会话输出缓冲区，按块存储已过滤ANSI序列的utf-8字节数据，超过上限后淘汰最旧的数据(环形缓冲)，
+    开启溢出时超过内存上限的输出改为追加写入磁盘分段文件，读取通过mmap按范围进行"""
+
+    # 小于该大小的数据块会与上一个块合并，避免大量零碎的bytes对象
+    merge_chunk_size: int = 4096
+
+    def __init__(
+            self,
+            max_bytes: int = 0,
+            spill_max_bytes: int = 0,
+            spill_dir: Optional[str] = None,
+            spill_segment_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        """构造函数，max_bytes<=0表示不限制缓冲区大小，spill_max_bytes>0时内存数据超过max_bytes后溢出到磁盘，
+        磁盘上保留的数据超过spill_max_bytes后按分段淘汰最旧的数据"""
+        self.max_bytes = max_bytes
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_dir = spill_dir
+        self.spill_segment_bytes = spill_segment_bytes
+        self._segments: Deque[ShellOutputSpillSegment] = collections.deque()
+        self._closed = False
+        self._chunks: Deque[bytes] = collections.deque()
+        self._size = 0
+        self.start_offset = 0  # 缓冲区中最早保留数据的绝对偏移，即已淘汰的字节数
+        self.end_offset = 0  # 已写入数据的绝对偏移，即累计写入的字节数
+        self.pending = ""  # 尚未换行的当前行，可能被回车覆盖，不占用偏移，由调用方与读取结果分开返回
+        # 行偏移索引: 记录每个换行符之后的绝对偏移，_line_head之前的条目已随数据淘汰
+        self._line_offsets = array("q")
+        self._line_head = 0
+        # 实时输出的订阅者列表
+        self._subscribers: Set[ShellOutputSubscriber] = set()
+        # 输出变化事件，每次有新输出或广播事件时触发并替换为新的事件对象
+        self._changed = asyncio.Event()
+
+    @property
+    def size(self) -> int:
+        """缓冲区当前保留的字节数，包含溢出到磁盘的数据"""
+        return self.end_offset - self.start_offset
+
+    @property
+    def spilled(self) -> bool:
+        """输出是否已经溢出到磁盘"""
+        return bool(self._segments)
+
+    def disk_usage(self) -> int:
+        """溢出到磁盘的字节数"""
+        return sum(segment.size for segment in self._segments)
+
+    def memory_usage(self) -> int:
+        """估算缓冲区占用的内存: 数据块、行偏移索引以及未结束的当前行"""
+        index_size = self._line_offsets.itemsize * len(self._line_offsets)
+        return self._size + index_size + len(self.pending)
+
+    def close(self) -> None:
+        """释放缓冲区，删除溢出到磁盘的分段文件，之后写入的数据将被丢弃"""
+        self._closed = True
+        while self._segments:
+            self._segments.popleft().close()
+        self._chunks.clear()
+        self._size = 0
+
+    def append(self, data: bytes, pending: Optional[str] = None, raw: Optional[str] = None) -> None:
+        """向缓冲区末尾追加已完成的数据并更新未结束的当前行，raw为对应的原始输出，仅用于实时推送"""
+        if self._closed:
+            return
+        if pending is not None:
+            self.pending = pending
+        if data:
+            self._append(data)
+        if data or pending is not None:
+            self._notify()
+
+        # 将新数据广播给所有订阅者
+        if self._subscribers and (data or pending is not None or raw):
+            self.publish({
+                "type": "output",
+                "offset": self.end_offset - len(data),
+                "next_offset": self.end_offset,
+                "data": data.decode("utf-8", errors="replace"),
+                "pending": self.pending,
+                "raw": raw if raw is not None else data.decode("utf-8", errors="replace"),
+            })
+
+    def _append(self, data: bytes) -> None:
+        """追加数据块并维护行偏移索引，超出上限时淘汰最旧的数据或溢出到磁盘"""
+        # 1.已溢出或即将超出内存上限时写入磁盘，磁盘模式下不维护行偏移索引，按需从文件反向扫描
+        if self._segments or (0 < self.spill_max_bytes and 0 < self.max_bytes < self._size + len(data)):
+            self._spill(data)
+            return
+
+        # 2.记录新数据中每个换行符之后的绝对偏移
+        pos = data.find(b"\n")
+        while pos != -1:
+            self._line_offsets.append(self.end_offset + pos + 1)
+            pos = data.find(b"\n", pos + 1)
+
+        # 3.小块数据合并到上一个块中，否则单独存储
+        if self._chunks and len(self._chunks[-1]) < self.merge_chunk_size:
+            self._chunks[-1] += data
+        else:
+            self._chunks.append(data)
+        self._size += len(data)
+        self.end_offset += len(data)
+
+        # 4.淘汰超出上限的旧数据
+        self._evict()
+
+    def _spill(self, data: bytes) -> None:
+        """将数据追加到磁盘分段文件，首次溢出时先将内存中的数据写入文件"""
+        if not self._segments:
+            logger.debug(f"Shell输出超过内存上限{self.max_bytes}字节，溢出到磁盘")
+            segment = ShellOutputSpillSegment(self.start_offset, self.spill_dir)
+            self._segments.append(segment)
+            for chunk in self._chunks:
+                segment.write(chunk)
+            self._chunks.clear()
+            self._size = 0
+            self._line_offsets = array("q")
+            self._line_head = 0
+
+        # 1.当前分段写满后新建分段，旧分段可以整体删除
+        if self._segments[-1].size >= self.spill_segment_bytes:
+            self._segments.append(ShellOutputSpillSegment(self.end_offset, self.spill_dir))
+        self._segments[-1].write(data)
+        self.end_offset += len(data)
+
+        # 2.磁盘数据超过上限时删除最旧的分段
+        while len(self._segments) > 1 and self.end_offset - self._segments[0].start_offset > self.spill_max_bytes:
+            self._segments.popleft().close()
+            self.start_offset = self._segments[0].start_offset
+
+    def subscribe(self, maxsize: int) -> ShellOutputSubscriber:
+        """创建一个实时输出订阅者"""
+        subscriber = ShellOutputSubscriber(maxsize)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: ShellOutputSubscriber) -> None:
+        """移除实时输出订阅者"""
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """向所有订阅者广播事件"""
+        for subscriber in list(self._subscribers):
+            subscriber.put(event)
+        self._notify()
+
+    def _notify(self) -> None:
+        """唤醒所有等待输出变化的协程"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def wait_changed(self) -> Awaitable[bool]:
+        """返回等待下一次输出变化(新输出、当前行更新或进程退出)的协程，调用时即绑定当前事件，避免检查与等待之间丢失通知"""
+        return self._changed.wait()
+
+    def _evict(self) -> None:
+        """从头部淘汰数据直到缓冲区大小不超过上限"""
+        if self.max_bytes <= 0:
+            return
+        while self._size > self.max_bytes:
+            overflow = self._size - self.max_bytes
+            head = self._chunks[0]
+            if len(head) <= overflow:
+                self._chunks.popleft()
+                removed = len(head)
+            else:
+                self._chunks[0] = head[overflow:]
+                removed = overflow
+            self._size -= removed
+            self.start_offset += removed
+        self._evict_line_offsets()
+
+    def _evict_line_offsets(self) -> None:
+        """移除已淘汰数据对应的行偏移，并在失效条目过多时压缩索引"""
+        offsets = self._line_offsets
+        while self._line_head < len(offsets) and offsets[self._line_head] <= self.start_offset:
+            self._line_head += 1
+        if self._line_head > 1024 and self._line_head * 2 > len(offsets):
+            del offsets[:self._line_head]
+            self._line_head = 0
+
+    def tail_offset(self, lines: int) -> int:
+        """根据行偏移索引计算最后lines行的起始偏移，无需扫描缓冲区数据，已溢出到磁盘时从文件末尾反向扫描"""
+        # 1.未换行的当前行和不以换行结尾的数据都算作一行
+        if self.pending:
+            lines -= 1
+        if lines <= 0:
+            return self.end_offset
+        if self._segments:
+            return self._spilled_tail_offset(lines)
+        offsets = self._line_offsets
+        count = len(offsets) - self._line_head
+        if count and offsets[-1] == self.end_offset:
+            lines += 1
+        # 2.保留的行数不足时从缓冲区开头读取
+        if lines > count:
+            return self.start_offset
+        return offsets[len(offsets) - lines]
+
+    def _spilled_tail_offset(self, lines: int) -> int:
+        """从磁盘分段的末尾反向查找换行符，计算最后lines行的起始偏移"""
+        for segment in reversed(self._segments):
+            mapped = segment.map()
+            if mapped is None:
+                continue
+            with mapped:
+                pos = len(mapped)
+                while True:
+                    pos = mapped.rfind(b"\n", 0, pos)
+                    if pos == -1:
+                        break
+                    line_start = segment.start_offset + pos + 1
+                    # 数据末尾的换行符不单独算作一行
+                    if line_start == self.end_offset:
+                        continue
+                    lines -= 1
+                    if lines == 0:
+                        return line_start
+        return self.start_offset
+
+    def _read_spilled(self, start: int, end: int) -> bytes:
+        """通过mmap读取磁盘分段中[start, end)范围的数据"""
+        pieces: List[bytes] = []
+        for segment in self._segments:
+            segment_end = segment.start_offset + segment.size
+            if segment_end <= start or segment.start_offset >= end:
+                continue
+            mapped = segment.map()
+            if mapped is None:
+                continue
+            with mapped:
+                pieces.append(mapped[max(start - segment.start_offset, 0):end - segment.start_offset])
+        return b"".join(pieces)
+
+    def char_boundary(self, offset: int) -> int:
+        """将偏移向前调整到utf-8字符的起始位置，避免按字节范围读取时截断多字节字符"""
+        offset = min(max(offset, self.start_offset), self.end_offset)
+        for _ in range(3):
+            byte = self.read(offset, offset + 1)
+            if not byte or not 0x80 <= byte[0] < 0xC0 or offset <= self.start_offset:
+                break
+            offset -= 1
+        return offset
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        """读取绝对偏移[start, end)范围内仍保留在缓冲区中的字节"""
+        start = max(start, self.start_offset)
+        end = self.end_offset if end is None else min(end, self.end_offset)
+        if start >= end:
+            return b""
+        if self._segments:
+            return self._read_spilled(start, end)
+
+        # 从尾部往前遍历，读取最近的数据时只需要访问少量块
+        pieces = []
+        chunk_end = self.end_offset
+        for chunk in reversed(self._chunks):
+            chunk_start = chunk_end - len(chunk)
+            if chunk_start < end:
+                pieces.append(chunk[max(start - chunk_start, 0):end - chunk_start])
+            if chunk_start <= start:
+                break
+            chunk_end = chunk_start
+        pieces.reverse()
+        return b"".join(pieces)
+
+    def read_text(self, start: int = 0, end: Optional[int] = None) -> str:
+        """读取指定范围的内容并解码为文本，读取的数据已被淘汰时在开头添加截断标记。
+        结果不包含未结束的当前行(pending)，它不占用偏移，需要时由调用方单独返回，避免按偏移增量读取时重复出现"""
+        data = self.read(start, end)
+        # 跳过开头残缺的utf-8多字节字符(淘汰或偏移落在字符中间时出现)
+        skip = 0
+        while skip < min(len(data), 3) and 0x80 <= data[skip] < 0xC0:
+            skip += 1
+        text = data[skip:].decode("utf-8", errors="replace")
+
+        if start < self.start_offset:
+            text = f"[...已截断{self.start_offset - start}字节...]\n" + text
+        return text
+
@@ -1,92 +1,426 @@
 import asyncio
-from genericpath import exists
-import glob
+import functools
+import hashlib
 import logging
-from multiprocessing import process
+import multiprocessing
 import os
 import re
-from sys import stderr
-from typing import Optional
+import stat
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 
 from fastapi import UploadFile
 
+from app.core.config import get_settings
 from app.interfaces.errors.exceptions import AppException, BadRequestException, NotFoundException
 from app.models.file import (
     FileReadResult,
+    FileBatchReadItem,
+    FileBatchReadItemResult,
+    FileBatchReadResult,
     FileWriteResult,
     FileReplaceResult,
     FileSearchResult,
+    FileGrepMatch,
+    FileGrepResult,
+    FileIndexInfo,
+    FileFindEntry,
     FileFindResult,
+    FileFuzzyMatch,
+    FileFuzzyFindResult,
+    FileChange,
+    FileChangesResult,
     FileUploadResult,
     FileCheckResult,
     FileDeleteResult
 )
+from app.services.file_finder import decode_cursor, encode_cursor, iter_find_entries
+from app.services.file_fuzzy import PathIndex
+from app.services.file_grep import DEFAULT_EXCLUDE_DIRS, filter_grep_files, grep_files, iter_grep_files, take_batch
+from app.services.file_index import WorkspaceIndex
+from app.services.file_inotify import IN_Q_OVERFLOW, InotifyEvent, TreeWatcher
+from app.services.file_lines import (
+    READ_CHUNK_SIZE,
+    LineIndexCache,
+    LineWindow,
+    read_lines_at,
+    read_tail_lines,
+    strip_line_ending,
+)
+from app.services.file_manifest import CREATED_SEQ, HASH, INODE, MTIME_NS, SIZE, WorkspaceManifest
+from app.services.file_watch import ChangeCoalescer
+
 logger = logging.getLogger(__name__)
 
+# 按需计算内容哈希时支持的算法
+HASH_ALGORITHMS = ("sha256", "sha1", "md5", "blake2b")
+# 查找文件时每次在线程中遍历的条目数
+FIND_BATCH_SIZE = 256
+
+
+def format_fingerprint(inode: int, mtime_ns: int, size: int) -> str:
+    """根据inode、修改时间和大小生成文件指纹"""
+    return f"{inode:x}-{mtime_ns:x}-{size:x}"
+
+
+def file_fingerprint(stat_result: os.stat_result) -> str:
+    """根据inode、修改时间和大小生成文件指纹，不需要读取文件内容"""
+    return format_fingerprint(stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def stat_fingerprint(filepath: str) -> Optional[str]:
+    """获取文件当前的指纹，无法获取文件信息时返回None"""
+    try:
+        return file_fingerprint(os.stat(filepath))
+    except OSError:
+        return None
+
 class FileService:
     """文件服务模块"""
     def __init__(self) -> None:
-        pass
-    @classmethod
+        settings = get_settings()
+        # 大文件按行范围读取时使用的行偏移索引缓存
+        self.line_index_cache = LineIndexCache(
+            max_entries=settings.file_line_index_cache_size,
+            interval=settings.file_line_index_interval,
+        )
+        # 批量读取文件的并发上限
+        self.batch_read_semaphore = asyncio.Semaphore(max(settings.file_batch_read_concurrency, 1))
+        # 多文件正则搜索的进程池，首次搜索时创建
+        self.grep_workers = settings.file_grep_workers if settings.file_grep_workers > 0 else (os.cpu_count() or 1)
+        self.grep_batch_size = max(settings.file_grep_batch_size, 1)
+        self.grep_max_file_size = settings.file_grep_max_file_size
+        self._grep_pool: Optional[ProcessPoolExecutor] = None
+        # 按根目录维护的三元组内容索引
+        self.index_dir = settings.file_index_dir or os.path.expanduser("~/.cache/sandbox-file-index")
+        self.index_roots = [root.strip() for root in settings.file_index_roots.split(",") if root.strip()]
+        self.index_overlay_limit = settings.file_index_overlay_limit
+        self.index_debounce_seconds = settings.file_index_debounce_seconds
+        self.indexes: Dict[str, WorkspaceIndex] = {}
+        # 模糊查找文件名使用的内存路径索引，按最近使用的顺序排列
+        self.fuzzy_max_roots = max(settings.file_fuzzy_max_roots, 1)
+        self.fuzzy_max_candidates = settings.file_fuzzy_max_candidates
+        self.path_indexes: Dict[str, PathIndex] = {}
+        # 通过inotify推送文件变化的订阅
+        self.watch_debounce_seconds = settings.file_watch_debounce_seconds
+        self.watch_max_delay_seconds = settings.file_watch_max_delay_seconds
+        self.watch_heartbeat_seconds = settings.file_watch_heartbeat_seconds
+        self.watch_max_subscriptions = settings.file_watch_max_subscriptions
+        self.watch_subscriptions = 0
+        # 增量同步使用的文件清单，按最近使用的顺序淘汰
+        self.manifest_max_roots = max(settings.file_manifest_max_roots, 1)
+        self.manifest_max_tombstones = settings.file_manifest_max_tombstones
+        self.manifests: Dict[str, WorkspaceManifest] = {}
+
+    async def start(self) -> None:
+        """启动文件服务的后台任务，为配置的根目录建立内容索引"""
+        for root in self.index_roots:
+            try:
+                await self.enable_index(root)
+            except AppException as e:
+                logger.warning(f"启用目录索引失败：{e.msg}")
+
+    async def close(self) -> None:
+        """关闭文件服务的目录索引和搜索进程池"""
+        for index in list(self.indexes.values()):
+            await index.close()
+        self.indexes.clear()
+        for path_index in list(self.path_indexes.values()):
+            await path_index.close()
+        self.path_indexes.clear()
+        for manifest in list(self.manifests.values()):
+            await manifest.close()
+        self.manifests.clear()
+        if self._grep_pool is not None:
+            self._grep_pool.shutdown(wait=False, cancel_futures=True)
+            self._grep_pool = None
+
+    def _get_grep_pool(self) -> ProcessPoolExecutor:
+        """获取搜索进程池，使用forkserver启动工作进程，避免从带有线程和事件循环的服务进程直接fork"""
+        if self._grep_pool is None:
+            self._grep_pool = ProcessPoolExecutor(
+                max_workers=self.grep_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return self._grep_pool
+
     async def read_file(
             self,
             filepath: str,
             start_line: Optional[int] = None,
             end_line: Optional[int] = None,
             sudo: bool = False,
-            max_lenght: Optional[int] = 10000,
+            max_length: Optional[int] = 10000,
+            tail_lines: Optional[int] = None,
+            if_none_match: Optional[str] = None,
+            hash_algorithm: Optional[str] = None,
+            errors: str = "replace",
     ) -> FileReadResult:
-        """根据传递的文件路径，起始终止行号+root+最大长度读取文件内容"""
+        """根据传递的文件路径，起始终止行号+root+最大长度读取文件内容，按行读取时只读取需要的部分，
+        传递了上次返回的指纹且文件未变化时只返回未修改标记，errors为utf-8解码的错误处理方式"""
+        # 1.tail模式等同于读取最后tail_lines行
+        if tail_lines is not None:
+            if tail_lines <= 0:
+                raise BadRequestException(f"tail_lines必须大于0: {tail_lines}")
+            start_line, end_line = -tail_lines, None
+        if hash_algorithm is not None and hash_algorithm not in HASH_ALGORITHMS:
+            raise BadRequestException(f"不支持的哈希算法: {hash_algorithm}，可选值: {'/'.join(HASH_ALGORITHMS)}")
+
+        # 2.先获取指纹再读取内容，读取期间文件发生变化时客户端下次请求会因指纹不一致重新读取
+        fingerprint = await asyncio.to_thread(stat_fingerprint, filepath)
+        content_hash = None
+        if hash_algorithm is not None and (fingerprint is not None or sudo):
+            content_hash = await self._hash_file(filepath, hash_algorithm, sudo)
+        if if_none_match and if_none_match in (fingerprint, content_hash):
+            return FileReadResult(
+                filepath=filepath,
+                content="",
+                fingerprint=fingerprint,
+                content_hash=content_hash,
+                not_modified=True,
+            )
+
+        # 3.按最大长度换算最多需要读取的字节数，utf-8中每个字符最多4个字节
+        max_bytes = (max_length + 1) * 4 if max_length is not None and max_length > 0 else None
+
         try:
-            # 检测当前权限下能否获取该文件
-            if not os.path.exists(filepath) and not sudo:
-                logger.error(f"要读取的文件不存在或无权限：{filepath}")
-            encoding = "utf-8"
-            # 判断是否是sudo，是的话用命令形式读取
-            if sudo:
-                command = f"sudo cat '{filepath}'"
-                process = await asyncio.create_subprocess_shell(
-                    command,
+            # 4.当前用户可以直接读取时不需要sudo，直接打开文件随机访问
+            if os.path.isfile(filepath) and os.access(filepath, os.R_OK):
+                result = await asyncio.to_thread(self._read_lines, filepath, start_line, end_line, max_bytes, errors)
+            elif not sudo:
+                if not os.path.exists(filepath):
+                    raise NotFoundException(f"要读取的文件不存在：{filepath}")
+                if os.path.isdir(filepath):
+                    raise BadRequestException(f"要读取的路径是文件夹：{filepath}")
+                raise BadRequestException(f"无权限读取文件：{filepath}")
+            else:
+                result = await self._read_lines_sudo(filepath, start_line, end_line, max_bytes, errors)
+        except AppException:
+            raise
+        except Exception as e:
+            raise AppException(f"文件内容读取失败：{str(e)}")
+
+        # 5.裁剪数据长度，tail模式保留末尾的内容
+        result.fingerprint = fingerprint
+        result.content_hash = content_hash
+        content = result.content
+        if (max_length is not None and 0 < max_length < len(content)) or result.truncated:
+            result.truncated = True
+            # 裁剪后按实际返回的行重新计算行号，被截断的首行/末行仍计入
+            if tail_lines is not None:
+                kept = content[-max_length:]
+                result.content = "(truncated)" + kept
+                if result.start_line is not None:
+                    result.start_line += content[:len(content) - len(kept)].count("\n")
+            else:
+                kept = content[:max_length]
+                result.content = kept + "(truncated)"
+                if result.start_line is not None:
+                    result.end_line = result.start_line + kept.count("\n") + 1
+        return result
+
+    @classmethod
+    async def _hash_file(cls, filepath: str, algorithm: str, sudo: bool = False) -> str:
+        """流式计算文件内容的哈希，返回"算法:十六进制摘要"，当前用户无权限读取时使用sudo cat"""
+        digest = hashlib.new(algorithm)
+        try:
+            if os.path.isfile(filepath) and os.access(filepath, os.R_OK):
+                def hash_file() -> None:
+                    with open(filepath, "rb") as f:
+                        while chunk := f.read(READ_CHUNK_SIZE):
+                            digest.update(chunk)
+
+                await asyncio.to_thread(hash_file)
+            elif sudo:
+                process = await asyncio.create_subprocess_exec(
+                    "sudo", "cat", "--", filepath,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE,
                 )
-                # 读取子进程的输出，并等待子进程结束
-                stdout, stderr = process.communicate()
-
-                # 判断子进程的状态是否正常结束
-                if process.returncode != 0:
-                    raise BadRequestException(f"阅读文件失败：{stderr.decode()}")
-                # 读取输出内容
-                content = stdout.decode(encoding,errors="replace")
+                while chunk := await process.stdout.read(READ_CHUNK_SIZE):
+                    digest.update(chunk)
+                stderr = await process.stderr.read()
+                if await process.wait() != 0:
+                    raise BadRequestException(f"计算文件哈希失败：{stderr.decode(errors='replace')}")
             else:
-                # 内部创建一个读取函数
-                def async_read_file() -> str:
-                    try:
-                        with open(filepath, "r", encoding=encoding) as f:
-                            return f.read()
-                    except Exception as async_read_file_exception:
-                        raise AppException(msg=f"读取文件失败:{str(async_read_file_exception)}")
-
-                content = await asyncio.to_thread(async_read_file)
-            # 判断是否传递了读取范围
-            if start_line is not None or end_line is not None:
-                # 将内容切割成行，并提取指定范围的行号数据
-                lines = content.splitlines()
-                start = start_line if start_line is not None else 0
-                end = end_line if end_line is not None else len(lines)
-                content = "\n".join(lines[start:end])
-
-                # 裁剪数据长度
-                if max_lenght is not None and 0 < max_lenght < len(content):
-                    content = content[:max_lenght] + "(truncated)"
+                raise BadRequestException(f"无权限读取文件：{filepath}")
+        except AppException:
+            raise
+        except Exception as e:
+            raise AppException(f"计算文件哈希失败：{str(e)}")
+        return f"{algorithm}:{digest.hexdigest()}"
+
+    async def read_files(self, files: List[FileBatchReadItem]) -> FileBatchReadResult:
+        """并发读取一组文件，受并发上限限制，单个文件读取失败时记录错误而不影响其他文件"""
+        logger.info(f"批量读取{len(files)}个文件")
+        results = await asyncio.gather(*[
+            self._read_batch_file(index, item)
+            for index, item in enumerate(files)
+        ])
+        return FileBatchReadResult(results=list(results))
+
+    async def _read_batch_file(self, index: int, item: FileBatchReadItem) -> FileBatchReadItemResult:
+        """读取批量读取中的一个文件"""
+        result = FileBatchReadItemResult(index=index, filepath=item.filepath)
+        async with self.batch_read_semaphore:
+            try:
+                result.result = await self.read_file(
+                    filepath=item.filepath,
+                    start_line=item.start_line,
+                    end_line=item.end_line,
+                    sudo=item.sudo,
+                    max_length=item.max_length,
+                    tail_lines=item.tail_lines,
+                    if_none_match=item.if_none_match,
+                    hash_algorithm=item.hash_algorithm,
+                )
+                result.success = True
+            except AppException as e:
+                result.error = e.msg
+            except Exception as e:
+                result.error = f"文件内容读取失败：{str(e)}"
+        return result
+
+    def _read_lines(
+            self,
+            filepath: str,
+            start_line: Optional[int],
+            end_line: Optional[int],
+            max_bytes: Optional[int],
+            errors: str = "replace",
+    ) -> FileReadResult:
+        """在子线程中读取文件的指定行，借助行索引定位到起始行附近，不加载整个文件"""
+        with open(filepath, "rb") as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+
+            # 1.没有传递读取范围时按原样返回文件开头的内容
+            if start_line is None and end_line is None:
+                data = f.read(-1 if max_bytes is None else max_bytes + 1)
+                truncated = max_bytes is not None and len(data) > max_bytes
                 return FileReadResult(
                     filepath=filepath,
-                    content=content
+                    content=data[:max_bytes].decode("utf-8", errors=errors),
+                    file_size=size,
+                    truncated=truncated,
                 )
-        except Exception as e:
-            if isinstance(e, BadRequestException) or isinstance(e, AppException):
-                raise
-            raise AppException(f"文件内容读取失败：{str(e)}")
+
+            index = self.line_index_cache.get(filepath, st, f)
+            if start_line is not None and start_line < 0 and (end_line is None or end_line < 0):
+                # 2.读取末尾的行时从文件末尾向前扫描，不需要知道总行数
+                lines, truncated = read_tail_lines(f, size, -start_line, max_bytes)
+                first_line = None
+                if index.complete and not truncated:
+                    first_line = index.total_lines - len(lines)
+                if end_line is not None:
+                    lines = lines[:end_line]
+            else:
+                # 3.其余的负数行号需要总行数，将索引扫描到文件末尾后换算成非负的范围
+                if (start_line or 0) < 0 or (end_line is not None and end_line < 0):
+                    with index.lock:
+                        index.extend(f, size)
+                    total = index.total_lines if index.complete else index.scanned_lines
+                    first_line, last_line, _ = slice(start_line, end_line).indices(total)
+                    count = max(last_line - first_line, 0)
+                else:
+                    first_line = start_line or 0
+                    count = None if end_line is None else max(end_line - first_line, 0)
+
+                # 4.从不超过起始行的最近检查点开始，跳过少量的行后读取
+                with index.lock:
+                    index.extend(f, size, first_line)
+                    checkpoint_line, offset = index.locate(first_line)
+                lines, truncated = read_lines_at(f, offset, first_line - checkpoint_line, count, max_bytes)
+
+        return FileReadResult(
+            filepath=filepath,
+            content="\n".join(line.decode("utf-8", errors=errors) for line in lines),
+            start_line=first_line,
+            end_line=first_line + len(lines) if first_line is not None else None,
+            total_lines=index.total_lines,
+            file_size=size,
+            truncated=truncated,
+        )
+
+    @classmethod
+    async def _read_lines_sudo(
+            cls,
+            filepath: str,
+            start_line: Optional[int],
+            end_line: Optional[int],
+            max_bytes: Optional[int],
+            errors: str = "replace",
+    ) -> FileReadResult:
+        """使用sudo以流的方式读取文件的指定行，读够需要的行后提前结束子进程"""
+        # 1.只需要末尾的行时使用tail，其余情况使用cat
+        from_tail = start_line is not None and start_line < 0 and (end_line is None or end_line < 0)
+        if from_tail:
+            args = ["sudo", "tail", "-n", str(-start_line), "--", filepath]
+        else:
+            args = ["sudo", "cat", "--", filepath]
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        # 2.分块读取子进程的输出并按行交给窗口截取
+        raw_read = start_line is None and end_line is None
+        window = LineWindow(start_line, end_line, max_bytes)
+        chunks = []
+        received = 0
+        pending = b""
+        finished = False
+        while not finished:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if raw_read:
+                chunks.append(chunk)
+                received += len(chunk)
+                finished = max_bytes is not None and received > max_bytes
+                continue
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if not window.feed(strip_line_ending(line)):
+                    finished = True
+                    break
+        if not finished and pending:
+            window.feed(strip_line_ending(pending))
+
+        # 3.提前结束时终止子进程，否则检查子进程是否正常结束
+        if finished and process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        stderr = await process.stderr.read()
+        await process.wait()
+        if not finished and process.returncode != 0:
+            raise BadRequestException(f"阅读文件失败：{stderr.decode(errors='replace')}")
+
+        if raw_read:
+            data = b"".join(chunks)
+            return FileReadResult(
+                filepath=filepath,
+                content=data[:max_bytes].decode("utf-8", errors=errors),
+                truncated=max_bytes is not None and len(data) > max_bytes,
+            )
+        # tail只输出了末尾的行，无法得知行号和总行数
+        lines, first_line = window.result()
+        if from_tail:
+            first_line = None
+        return FileReadResult(
+            filepath=filepath,
+            content="\n".join(line.decode("utf-8", errors=errors) for line in lines),
+            start_line=first_line,
+            end_line=first_line + len(lines) if first_line is not None else None,
+            total_lines=None if window.bounded or from_tail else window.seen,
+            truncated=window.truncated,
+        )
+
     @classmethod
     async def write_file(
             cls,
@@ -155,6 +489,7 @@ class FileService:
             return FileWriteResult(
                 filepath=filepath,
                 bytes_written=bytes_written,
+                fingerprint=await asyncio.to_thread(stat_fingerprint, filepath),
             )
         except Exception as e:
             # 14.根据不同的错误执行不同的操作
@@ -171,26 +506,34 @@ class FileService:
             sudo: bool = False,
     ) -> FileReplaceResult:
         """根据传递的数据替换文件内指定的内容"""
-        # 1.调用服务获取对应的文件内容
-        file_read_result = await self.read_file(filepath=filepath, sudo=sudo, max_length=None)
+        # 1.调用服务获取对应的文件内容，替换后会写回文件，不是合法utf-8的内容直接报错，避免被替换字符覆盖
+        file_read_result = await self.read_file(filepath=filepath, sudo=sudo, max_length=None, errors="strict")
         content = file_read_result.content
 
         # 2.计算old_str出现的次数，只有出现次数>0才需要替换
         replaced_count = content.count(old_str)
         if replaced_count == 0:
-            return FileReplaceResult(filepath=filepath, replaced_count=replaced_count)
+            return FileReplaceResult(
+                filepath=filepath,
+                replaced_count=replaced_count,
+                fingerprint=file_read_result.fingerprint,
+            )
 
         # 3.替换旧内容
         new_content = content.replace(old_str, new_str)
 
         # 4.将替换后的新内容写入到文件中
-        await self.write_file(
+        file_write_result = await self.write_file(
             filepath=filepath,
             content=new_content,
             sudo=sudo,
         )
 
-        return FileReplaceResult(filepath=filepath, replaced_count=replaced_count)
+        return FileReplaceResult(
+            filepath=filepath,
+            replaced_count=replaced_count,
+            fingerprint=file_write_result.fingerprint,
+        )
 
     async def search_in_file(
             self,
@@ -231,22 +574,502 @@ class FileService:
             line_numbers=line_numbers,
         )
 
-    @classmethod
-    async def find_files(cls, dir_path: str, glob_pattern: str) -> FileFindResult:
-        """根据传递的文件夹路径+glob规则查询文件列表"""
-        # 1.检测下传递进来的目录是否存在
-        if not os.path.exists(dir_path):
+    def grep_stream(
+            self,
+            dir_path: str,
+            regex: str,
+            include: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            exclude_dirs: Optional[List[str]] = None,
+            ignore_case: bool = False,
+            context_lines: Optional[int] = 0,
+            max_results: Optional[int] = 1000,
+            use_index: bool = True,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """在目录树中递归搜索正则，以异步迭代器的形式逐条返回匹配事件，最后返回summary事件"""
+        # 在返回异步迭代器之前校验参数，保证响应开始前就能返回错误
+        if not os.path.isdir(dir_path):
             raise NotFoundException(f"当前文件夹不存在: {dir_path}")
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        try:
+            re.compile(regex, flags)
+        except re.error as e:
+            raise BadRequestException(f"传递正则表达式[{regex}]出错: {str(e)}")
+        if max_results is not None and max_results <= 0:
+            raise BadRequestException(f"max_results必须大于0: {max_results}")
+        return self._iter_grep_events(
+            dir_path=dir_path,
+            regex=regex,
+            flags=flags,
+            include=include or [],
+            exclude=exclude or [],
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS if exclude_dirs is None else exclude_dirs,
+            context_lines=max(context_lines or 0, 0),
+            max_results=max_results or 0,
+            use_index=use_index,
+        )
 
-        # 2.定义一个异步函数使用asyncio子线程运行避免IO阻塞
-        def async_glob():
-            search_pattern = os.path.join(dir_path, glob_pattern)
-            return glob.glob(search_pattern, recursive=True)
+    async def _iter_grep_events(
+            self,
+            dir_path: str,
+            regex: str,
+            flags: int,
+            include: List[str],
+            exclude: List[str],
+            exclude_dirs: List[str],
+            context_lines: int,
+            max_results: int,
+            use_index: bool,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """在线程中遍历目录，将文件分批交给进程池搜索，先完成的批次先返回，匹配数达到上限后取消剩余的任务，
+        目录位于已建立索引的根目录下时只搜索索引查询出的候选文件"""
+        loop = asyncio.get_running_loop()
+        pool = self._get_grep_pool()
+        candidates = await self._index_candidates(dir_path, regex, flags, exclude_dirs) if use_index else None
+        if candidates is not None:
+            files = filter_grep_files(candidates, dir_path, include, exclude, exclude_dirs)
+        else:
+            files = iter_grep_files(dir_path, include, exclude, exclude_dirs)
+        summary = {
+            "files_scanned": 0,
+            "files_matched": 0,
+            "files_skipped": 0,
+            "total_matches": 0,
+            "truncated": False,
+            "indexed": candidates is not None,
+        }
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                # 1.保持进程池中有足够的任务，遍历目录是阻塞IO，放到线程中执行
+                while not exhausted and len(pending) < self.grep_workers * 2:
+                    batch = await asyncio.to_thread(take_batch, files, self.grep_batch_size)
+                    if not batch:
+                        exhausted = True
+                        break
+                    limit = max_results - summary["total_matches"] if max_results else sys.maxsize
+                    pending.add(loop.run_in_executor(
+                        pool, grep_files, batch, regex, flags, context_lines, limit, self.grep_max_file_size,
+                    ))
+                if not pending:
+                    break
 
-        # 3.创建子线程完成任务
-        files = await asyncio.to_thread(async_glob)
+                # 2.等待任意一批完成并返回其中的匹配
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    for file_result in future.result():
+                        summary["files_scanned"] += 1
+                        if file_result["status"] in ("binary", "too_large", "error"):
+                            summary["files_skipped"] += 1
+                        if file_result["matches"]:
+                            summary["files_matched"] += 1
+                        for match in file_result["matches"]:
+                            if max_results and summary["total_matches"] >= max_results:
+                                summary["truncated"] = True
+                                break
+                            summary["total_matches"] += 1
+                            yield {"type": "match", **match}
 
-        return FileFindResult(dir_path=dir_path, files=files)
+                # 3.达到匹配上限后提前结束
+                if max_results and summary["total_matches"] >= max_results:
+                    summary["truncated"] = summary["truncated"] or bool(pending) or not exhausted
+                    break
+        except Exception as e:
+            logger.error(f"搜索目录{dir_path}失败: {str(e)}")
+            raise AppException(f"搜索目录{dir_path}失败: {str(e)}")
+        finally:
+            for future in pending:
+                future.cancel()
+        yield {"type": "summary", "dir_path": dir_path, **summary}
+
+    async def _index_candidates(
+            self,
+            dir_path: str,
+            regex: str,
+            flags: int,
+            exclude_dirs: List[str],
+    ) -> Optional[List[str]]:
+        """查找覆盖搜索目录的索引并查询候选文件，索引不覆盖本次搜索的范围时返回None"""
+        # 索引跳过了默认的排除目录，搜索需要包含这些目录时不能使用索引
+        if not set(DEFAULT_EXCLUDE_DIRS).issubset(exclude_dirs):
+            return None
+        dir_path = os.path.abspath(dir_path)
+        for root, index in self.indexes.items():
+            if dir_path == root or dir_path.startswith(root.rstrip("/") + "/"):
+                return await index.candidates(regex, flags)
+        return None
+
+    async def enable_index(self, root: str) -> FileIndexInfo:
+        """为根目录启用三元组内容索引，索引在后台建立，之后通过inotify增量更新"""
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            raise NotFoundException(f"当前文件夹不存在: {root}")
+        if root not in self.indexes:
+            index = WorkspaceIndex(
+                root=root,
+                index_dir=self.index_dir,
+                pool_getter=self._get_grep_pool,
+                workers=self.grep_workers,
+                batch_size=self.grep_batch_size,
+                max_file_size=self.grep_max_file_size,
+                overlay_limit=self.index_overlay_limit,
+                debounce_seconds=self.index_debounce_seconds,
+            )
+            self.indexes[root] = index
+            await index.start()
+        return FileIndexInfo(**self.indexes[root].info())
+
+    async def disable_index(self, root: str, delete_files: bool = False) -> FileIndexInfo:
+        """停用根目录的内容索引"""
+        index = self.indexes.pop(os.path.abspath(root), None)
+        if index is None:
+            raise NotFoundException(f"该目录没有启用索引: {root}")
+        await index.close(delete_files=delete_files)
+        info = index.info()
+        info["status"] = "closed"
+        return FileIndexInfo(**info)
+
+    def list_indexes(self) -> List[FileIndexInfo]:
+        """获取所有目录索引的状态"""
+        return [FileIndexInfo(**index.info()) for index in self.indexes.values()]
+
+    async def grep(self, dir_path: str, regex: str, **options: Any) -> FileGrepResult:
+        """在目录树中递归搜索正则，汇总所有匹配后一次返回，options与grep_stream的可选参数一致"""
+        matches = []
+        summary: Dict[str, Any] = {}
+        async for event in self.grep_stream(dir_path, regex, **options):
+            if event.pop("type") == "match":
+                matches.append(FileGrepMatch(**event))
+            else:
+                summary = event
+        return FileGrepResult(matches=matches, **summary)
+
+    def find_stream(
+            self,
+            dir_path: str,
+            glob_pattern: str,
+            exclude: Optional[List[str]] = None,
+            exclude_dirs: Optional[List[str]] = None,
+            max_depth: Optional[int] = None,
+            max_results: Optional[int] = 1000,
+            cursor: Optional[str] = None,
+            with_metadata: bool = False,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """按glob规则查找目录中的条目，以异步迭代器的形式逐条返回entry事件，最后返回summary事件"""
+        # 在返回异步迭代器之前校验参数，保证响应开始前就能返回错误
+        if not os.path.isdir(dir_path):
+            raise NotFoundException(f"当前文件夹不存在: {dir_path}")
+        if max_results is not None and max_results <= 0:
+            raise BadRequestException(f"max_results必须大于0: {max_results}")
+        if max_depth is not None and max_depth <= 0:
+            raise BadRequestException(f"max_depth必须大于0: {max_depth}")
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise BadRequestException(str(e))
+        entries = iter_find_entries(
+            dir_path,
+            glob_pattern,
+            exclude or [],
+            DEFAULT_EXCLUDE_DIRS if exclude_dirs is None else exclude_dirs,
+            max_depth,
+            after,
+            bool(with_metadata),
+        )
+        return self._iter_find_events(dir_path, entries, max_results or 0)
+
+    async def _iter_find_events(
+            self,
+            dir_path: str,
+            entries: Iterator[Dict[str, Any]],
+            max_results: int,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """在线程中分批遍历目录，条目数达到max_results后停止遍历，并以最后一个条目生成下一页的游标"""
+        count = 0
+        last = None
+        truncated = False
+        try:
+            while not truncated:
+                # 多取一个条目用于判断是否还有下一页，遍历目录是阻塞IO，放到线程中执行
+                size = min(FIND_BATCH_SIZE, max_results - count + 1) if max_results else FIND_BATCH_SIZE
+                batch = await asyncio.to_thread(take_batch, entries, size)
+                if not batch:
+                    break
+                for entry in batch:
+                    if max_results and count >= max_results:
+                        truncated = True
+                        break
+                    count += 1
+                    last = entry["relpath"]
+                    yield {"type": "entry", **entry}
+        except Exception as e:
+            logger.error(f"查找目录{dir_path}失败: {str(e)}")
+            raise AppException(f"查找目录{dir_path}失败: {str(e)}")
+        yield {
+            "type": "summary",
+            "dir_path": dir_path,
+            "count": count,
+            "truncated": truncated,
+            "next_cursor": encode_cursor(last) if truncated and last is not None else None,
+        }
+
+    async def find_files(self, dir_path: str, glob_pattern: str, **options: Any) -> FileFindResult:
+        """根据传递的文件夹路径+glob规则查询文件列表，汇总所有条目后一次返回，options与find_stream的可选参数一致"""
+        files = []
+        entries = []
+        summary: Dict[str, Any] = {}
+        async for event in self.find_stream(dir_path, glob_pattern, **options):
+            if event.pop("type") == "entry":
+                files.append(event["path"])
+                entries.append(FileFindEntry(**event))
+            else:
+                summary = event
+        return FileFindResult(
+            dir_path=dir_path,
+            files=files,
+            entries=entries,
+            truncated=summary.get("truncated", False),
+            next_cursor=summary.get("next_cursor"),
+        )
+
+    async def _get_path_index(self, dir_path: str) -> PathIndex:
+        """获取覆盖目录的路径索引，没有时以该目录为根建立，索引数量超过上限时关闭最久未使用的索引"""
+        for root, path_index in self.path_indexes.items():
+            if dir_path == root or dir_path.startswith(os.path.join(root, "")):
+                return path_index
+        path_index = PathIndex(dir_path)
+        self.path_indexes[dir_path] = path_index
+        await path_index.start()
+        while len(self.path_indexes) > self.fuzzy_max_roots:
+            root = min(self.path_indexes, key=lambda key: self.path_indexes[key].last_used)
+            await self.path_indexes.pop(root).close()
+        return path_index
+
+    async def fuzzy_find(self, dir_path: str, query: str, limit: Optional[int] = 50) -> FileFuzzyFindResult:
+        """按子序列模糊查找目录下的文件，首次查找某个目录时建立路径索引，之后通过inotify增量更新"""
+        # 1.校验参数
+        if not os.path.isdir(dir_path):
+            raise NotFoundException(f"当前文件夹不存在: {dir_path}")
+        dir_path = os.path.abspath(dir_path)
+        query = query.replace("\n", "")
+        if not query:
+            raise BadRequestException("查询字符串不能为空")
+        if limit is not None and limit <= 0:
+            raise BadRequestException(f"limit必须大于0: {limit}")
+
+        # 2.获取路径索引并查找
+        path_index = await self._get_path_index(dir_path)
+        result = await path_index.search(
+            subdir=dir_path[len(os.path.join(path_index.root, "")):] if dir_path != path_index.root else "",
+            query=query,
+            limit=limit or 50,
+            max_candidates=self.fuzzy_max_candidates,
+        )
+        if path_index.status == "error":
+            raise AppException(f"建立目录{path_index.root}的路径索引失败: {path_index.error}")
+
+        return FileFuzzyFindResult(
+            dir_path=dir_path,
+            query=query,
+            matches=[
+                FileFuzzyMatch(path=os.path.join(dir_path, match["relpath"]), **match)
+                for match in result["matches"]
+            ],
+            candidates=result["candidates"],
+            truncated=result["truncated"],
+            index_root=path_index.root,
+            indexed_files=len(path_index.paths),
+        )
+
+    def watch(self, paths: List[str], debounce: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """订阅路径的变化，目录递归监听，文件监听其所在目录并只报告该文件(文件可以尚不存在)，
+        以异步迭代器的形式先返回ready事件，之后返回合并后的changes事件，空闲时返回heartbeat事件"""
+        # 在返回异步迭代器之前校验参数，保证响应开始前就能返回错误
+        if not paths:
+            raise BadRequestException("至少需要监听一个路径")
+        if debounce is not None and debounce < 0:
+            raise BadRequestException(f"debounce不能小于0: {debounce}")
+        if self.watch_subscriptions >= self.watch_max_subscriptions:
+            raise BadRequestException(f"目录监听订阅数已达上限: {self.watch_max_subscriptions}")
+        directories: List[str] = []
+        files: Dict[str, set] = {}  # 所在目录 -> 监听的文件名
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                directories.append(path)
+            elif os.path.isdir(os.path.dirname(path)):
+                files.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+            else:
+                raise NotFoundException(f"监听的路径及其所在目录都不存在: {path}")
+        return self._iter_watch_events(
+            directories,
+            files,
+            self.watch_debounce_seconds if debounce is None else debounce,
+        )
+
+    async def _iter_watch_events(
+            self,
+            directories: List[str],
+            files: Dict[str, set],
+            debounce: float,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """建立监听后在事件循环中接收事件，等待事件静默debounce秒(最长max_delay秒)后合并推送一次"""
+        loop = asyncio.get_running_loop()
+        file_paths = sorted(os.path.join(parent, name) for parent, names in files.items() for name in names)
+        coalescer = ChangeCoalescer(directories + file_paths)
+        wakeup = asyncio.Event()
+
+        def on_events(events: List[InotifyEvent], names: Optional[set] = None) -> None:
+            for event in events:
+                if names is not None and os.path.basename(event.path) not in names and not event.mask & IN_Q_OVERFLOW:
+                    continue
+                coalescer.add(event)
+            if coalescer:
+                wakeup.set()
+
+        watchers: List[TreeWatcher] = []
+        self.watch_subscriptions += 1
+        try:
+            # 1.为每个目录建立监听，文件只监听其所在目录本身，遍历目录树在线程中执行
+            targets = [(path, True, None) for path in directories]
+            targets += [(parent, False, names) for parent, names in files.items()]
+            for root, recursive, names in targets:
+                watcher = TreeWatcher(
+                    root,
+                    functools.partial(on_events, names=names),
+                    DEFAULT_EXCLUDE_DIRS if recursive else (),
+                    recursive=recursive,
+                )
+                watchers.append(watcher)
+                try:
+                    await watcher.start()
+                except OSError as e:
+                    raise AppException(f"监听目录{root}失败: {str(e)}")
+                if watcher.watch_count == 0:
+                    raise AppException(f"监听目录{root}失败，请检查目录权限或inotify监听数量上限")
+            yield {"type": "ready", "paths": directories + file_paths}
+
+            # 2.等待事件，持续有事件时最多等待max_delay秒，空闲时定期推送心跳以便及时发现断开的连接
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.watch_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield {"type": "heartbeat"}
+                    continue
+                started_at = loop.time()
+                while True:
+                    wakeup.clear()
+                    remaining = self.watch_max_delay_seconds - (loop.time() - started_at)
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), min(debounce, remaining))
+                    except asyncio.TimeoutError:
+                        break
+                wakeup.clear()
+                changes, overflow = coalescer.drain()
+                if overflow:
+                    # 事件队列溢出后部分变化已经丢失，客户端需要重新扫描
+                    yield {"type": "overflow"}
+                if changes:
+                    yield {"type": "changes", "changes": changes}
+        finally:
+            for watcher in watchers:
+                watcher.close()
+            self.watch_subscriptions -= 1
+
+    async def _get_manifest(self, root: str) -> WorkspaceManifest:
+        """获取根目录的文件清单，没有时建立，清单数量超过上限时关闭最久未使用的清单"""
+        manifest = self.manifests.get(root)
+        if manifest is None:
+            manifest = WorkspaceManifest(
+                root=root,
+                max_tombstones=self.manifest_max_tombstones,
+                debounce_seconds=self.index_debounce_seconds,
+            )
+            self.manifests[root] = manifest
+            await manifest.start()
+            while len(self.manifests) > self.manifest_max_roots:
+                oldest = min(self.manifests, key=lambda key: self.manifests[key].last_used)
+                await self.manifests.pop(oldest).close()
+        return manifest
+
+    async def changes_since(
+            self,
+            root: str,
+            since: Optional[str] = None,
+            limit: Optional[int] = 10000,
+            hash_algorithm: Optional[str] = None,
+    ) -> FileChangesResult:
+        """获取根目录下自令牌以来新增、修改、删除的文件，令牌为空或已失效时返回全部文件(full为true)，
+        结果超过limit时分页，使用返回的token继续获取"""
+        # 1.校验参数
+        if not os.path.isdir(root):
+            raise NotFoundException(f"当前文件夹不存在: {root}")
+        root = os.path.abspath(root)
+        if limit is not None and limit <= 0:
+            raise BadRequestException(f"limit必须大于0: {limit}")
+        if hash_algorithm is not None and hash_algorithm not in HASH_ALGORITHMS:
+            raise BadRequestException(f"不支持的哈希算法: {hash_algorithm}，可选值: {'/'.join(HASH_ALGORITHMS)}")
+
+        # 2.更新清单后按序号取出变化
+        manifest = await self._get_manifest(root)
+        await manifest.sync()
+        if manifest.status == "error":
+            raise AppException(f"扫描目录{root}的文件清单失败: {manifest.error}")
+        since_seq = manifest.parse_token(since)
+        result = manifest.changes_since(since_seq, limit or 10000)
+
+        # 3.按需计算内容哈希，已缓存且文件未变化时直接使用
+        changes = []
+        for seq, relpath, entry in result["changes"]:
+            if entry is None:
+                changes.append(FileChange(action="deleted", path=os.path.join(root, relpath), relpath=relpath, seq=seq))
+                continue
+            changes.append(FileChange(
+                action="created" if since_seq is None or entry[CREATED_SEQ] > since_seq else "modified",
+                path=os.path.join(root, relpath),
+                relpath=relpath,
+                seq=seq,
+                size=entry[SIZE],
+                mtime=entry[MTIME_NS] / 1e9,
+                fingerprint=format_fingerprint(entry[INODE], entry[MTIME_NS], entry[SIZE]),
+                content_hash=entry[HASH],
+            ))
+        if hash_algorithm is not None:
+            await asyncio.gather(*[
+                self._manifest_hash(manifest, change, entry, hash_algorithm)
+                for change, (_, _, entry) in zip(changes, result["changes"]) if entry is not None
+            ])
+
+        return FileChangesResult(
+            root=root,
+            since=since,
+            token=manifest.make_token(result["next_seq"]),
+            full=since_seq is None,
+            has_more=result["has_more"],
+            changes=changes,
+            total_files=len(manifest.entries),
+        )
+
+    async def _manifest_hash(
+            self,
+            manifest: WorkspaceManifest,
+            change: FileChange,
+            entry: tuple,
+            algorithm: str,
+    ) -> None:
+        """计算变化文件的内容哈希并缓存到清单中，文件已经无法读取时不返回哈希"""
+        if change.content_hash is not None and change.content_hash.startswith(f"{algorithm}:"):
+            return
+        async with self.batch_read_semaphore:
+            try:
+                change.content_hash = await self._hash_file(change.path, algorithm)
+            except AppException:
+                change.content_hash = None
+                return
+        manifest.set_hash(change.relpath, entry, change.content_hash)
 
     @classmethod
     async def upload_file(cls, file: UploadFile, filepath: str) -> FileUploadResult:
@@ -288,6 +1111,19 @@ class FileService:
         if not os.path.exists(filepath):
             raise NotFoundException(f"该文件不存在: {filepath}")
 
+    @classmethod
+    async def stat_file(cls, filepath: str) -> os.stat_result:
+        """获取要下载文件的状态信息，确保该路径是一个普通文件"""
+        try:
+            stat_result = await asyncio.to_thread(os.stat, filepath)
+        except FileNotFoundError:
+            raise NotFoundException(f"该文件不存在: {filepath}")
+        except OSError as e:
+            raise BadRequestException(f"获取文件信息失败: {str(e)}")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise BadRequestException(f"该路径不是文件: {filepath}")
+        return stat_result
+
     @classmethod
     async def check_file_exists(cls, filepath: str) -> FileCheckResult:
         """根据传递的路径判断文件是否存在"""
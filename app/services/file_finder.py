@@ -0,0 +1,128 @@
+import base64
+import binascii
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.services.file_grep import match_any
+
+
+def compile_glob(pattern: str) -> "re.Pattern[str]":
+    """将glob规则转换为匹配相对路径的正则: **匹配任意层目录，*和?不跨越目录分隔符，[...]为字符集合"""
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                i += 2
+                if pattern.startswith("/", i):
+                    i += 1
+                    parts.append("(?:.*/)?")
+                else:
+                    parts.append(".*")
+                continue
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j == -1:
+                parts.append(re.escape(c))
+            else:
+                chars = pattern[i + 1:j].replace("\\", "\\\\")
+                if chars[:1] in ("!", "^"):
+                    chars = "^" + chars[1:]
+                parts.append(f"[{chars}]")
+                i = j
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile("(?s:" + "".join(parts) + r")\Z")
+
+
+def encode_cursor(relpath: str) -> str:
+    """将最后返回的相对路径编码为分页游标"""
+    return base64.urlsafe_b64encode(os.fsencode(relpath)).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        return os.fsdecode(base64.b64decode(cursor.encode(), altchars=b"-_", validate=True))
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def _sorted_entries(path: str) -> List[os.DirEntry]:
+    """按名称排序读取目录，保证多次遍历的顺序一致，无权限访问的目录视为空目录"""
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entries, key=lambda entry: entry.name)
+    except OSError:
+        return []
+
+
+def _entry_type(entry: os.DirEntry) -> str:
+    """根据scandir返回的类型信息判断条目类型，不需要额外的系统调用"""
+    if entry.is_symlink():
+        return "symlink"
+    if entry.is_dir(follow_symlinks=False):
+        return "dir"
+    if entry.is_file(follow_symlinks=False):
+        return "file"
+    return "other"
+
+
+def iter_find_entries(
+        root: str,
+        pattern: Optional[str],
+        exclude: Sequence[str],
+        exclude_dirs: Sequence[str],
+        max_depth: Optional[int],
+        after: Optional[str],
+        with_metadata: bool,
+) -> Iterator[Dict[str, Any]]:
+    """按路径字典序深度优先遍历目录，返回匹配glob规则的条目。after为上一页最后一个条目的相对路径，
+    遍历顺序与路径组件元组的大小顺序一致，整棵子树都位于游标之前的目录直接跳过，不会重新遍历"""
+    matcher = compile_glob(pattern) if pattern else None
+    after_parts = tuple(after.split("/")) if after else None
+    stack = [((), iter(_sorted_entries(root)))]
+    while stack:
+        parts, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        entry_parts = parts + (entry.name,)
+        relpath = "/".join(entry_parts)
+        # 不跟随指向目录的符号链接，避免循环
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if is_dir and entry.name in exclude_dirs:
+            continue
+        if exclude and match_any(entry.name, relpath, exclude):
+            continue
+
+        emit = True
+        if after_parts is not None and entry_parts <= after_parts:
+            # 不是游标的祖先目录时整棵子树都已经返回过
+            if entry_parts != after_parts[:len(entry_parts)]:
+                continue
+            emit = False
+        if emit and (matcher is None or matcher.match(relpath)):
+            info: Dict[str, Any] = {"path": entry.path, "relpath": relpath, "file_type": _entry_type(entry)}
+            if with_metadata:
+                try:
+                    stat_result = entry.stat(follow_symlinks=False)
+                    info["size"] = stat_result.st_size
+                    info["mtime"] = stat_result.st_mtime
+                except OSError:
+                    pass
+            yield info
+        if is_dir and (max_depth is None or len(entry_parts) < max_depth):
+            stack.append((entry_parts, iter(_sorted_entries(entry.path))))
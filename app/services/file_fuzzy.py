@@ -0,0 +1,310 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.services.file_grep import DEFAULT_EXCLUDE_DIRS
+from app.services.file_inotify import (
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyEvent,
+    TreeWatcher,
+)
+
+logger = logging.getLogger(__name__)
+
+# 打分参数，参考fzf: 每个匹配字符的基础分，单词边界、驼峰、连续匹配的加分，字符之间间隔的扣分
+SCORE_MATCH = 16
+BONUS_BOUNDARY = 8
+BONUS_CAMEL = 7
+BONUS_CONSECUTIVE = 12
+BONUS_BASENAME = 24
+MAX_GAP_PENALTY = 8
+BOUNDARY_CHARS = "/_-. "
+ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def subsequence_pattern(query: str) -> str:
+    """将查询转换为匹配子序列的正则，每个字符之前使用排除该字符的字符集，分组位置即每个字符最靠左的匹配位置"""
+    parts = []
+    for c in query:
+        escaped = re.escape(c)
+        parts.append(f"[^{escaped}\\n]*({escaped})")
+    return "".join(parts)
+
+
+def score_positions(line: str, positions: Sequence[int], basename_start: int) -> int:
+    """根据匹配位置计算得分: 边界和连续匹配加分，间隔扣分，全部落在文件名中额外加分，得分相同时路径越短越靠前"""
+    score = 0
+    previous = -1
+    for pos in positions:
+        score += SCORE_MATCH
+        before = line[pos - 1] if pos > 0 else "/"
+        if before in BOUNDARY_CHARS:
+            score += BONUS_BOUNDARY
+        elif before.islower() and line[pos].isupper():
+            score += BONUS_CAMEL
+        if previous >= 0:
+            if pos == previous + 1:
+                score += BONUS_CONSECUTIVE
+            else:
+                score -= min(pos - previous - 1, MAX_GAP_PENALTY)
+        previous = pos
+    if positions[0] >= basename_start:
+        score += BONUS_BASENAME
+    return score * 1000 - len(line)
+
+
+# 选择查询中最少见的字符时抽样统计的文本长度和分段数
+PIVOT_SAMPLE_SIZE = 256 * 1024
+PIVOT_SAMPLE_COUNT = 16
+
+
+def best_match(
+        line: str,
+        folded: str,
+        query: str,
+        basename_pattern: "re.Pattern[str]",
+        offset: int,
+        greedy: List[int],
+) -> Tuple[int, List[int]]:
+    """最靠左的子序列不一定是最好的匹配，再尝试最靠后的连续子串和文件名中的子序列，返回得分最高的一种，
+    folded为用于匹配的行(忽略大小写时已转为小写)，offset为查询目录前缀的长度，前缀部分不参与匹配"""
+    basename_start = max(line.rfind("/") + 1, offset)
+    options = [greedy]
+    pos = folded.rfind(query, offset)
+    if pos >= 0:
+        options.append(list(range(pos, pos + len(query))))
+    if greedy[0] < basename_start:
+        match = basename_pattern.match(folded, basename_start)
+        if match is not None:
+            options.append([match.start(i) for i in range(1, len(query) + 1)])
+    return max((score_positions(line, positions, basename_start), positions) for positions in options)
+
+
+def search_paths(
+        blob: str,
+        folded_blob: str,
+        prefix: str,
+        query: str,
+        limit: int,
+        max_candidates: int,
+) -> Dict[str, Any]:
+    """在以\\n连接的路径文本中模糊查找，folded_blob为转为小写、长度与blob相同的文本，查询全部为小写时使用它忽略大小写。
+    先找出查询中最少见的字符，以它开头、后面接查询剩余部分的正则在C层搜索(引擎直接跳到该字符出现的位置)，
+    只对找到的行匹配完整的子序列并打分，不需要逐行检查所有路径，候选数超过max_candidates后不再继续"""
+    haystack = folded_blob if query == query.lower() else blob
+    pattern = re.compile(subsequence_pattern(query))
+    # 从文本中均匀抽取若干段估计字符频率，路径按目录聚集，只取开头一段不能代表整体
+    step = max(len(haystack) // PIVOT_SAMPLE_COUNT, 1)
+    sample = "".join(haystack[i:i + PIVOT_SAMPLE_SIZE // PIVOT_SAMPLE_COUNT] for i in range(0, len(haystack), step))
+    pivot = min(set(query), key=sample.count)
+    pivot_pattern = re.compile(re.escape(pivot) + subsequence_pattern(query[query.index(pivot) + 1:]))
+    offset = len(prefix)
+    stats = {"candidates": 0, "truncated": False}
+
+    def scored() -> Iterator[Tuple[int, str, List[int]]]:
+        pos = 0
+        while True:
+            hit = pivot_pattern.search(haystack, pos)
+            if hit is None:
+                break
+            start = haystack.rfind("\n", 0, hit.start()) + 1
+            end = haystack.find("\n", hit.end())
+            end = len(haystack) if end < 0 else end
+            pos = end + 1
+            if prefix and not haystack.startswith(prefix, start, end):
+                continue
+            folded = haystack[start:end]
+            match = pattern.match(folded, offset)
+            if match is None:
+                continue
+            if max_candidates > 0 and stats["candidates"] >= max_candidates:
+                stats["truncated"] = True
+                break
+            stats["candidates"] += 1
+            line = blob[start:end]
+            greedy = [match.start(i) for i in range(1, len(query) + 1)]
+            score, positions = best_match(line, folded, query, pattern, offset, greedy)
+            yield score, line, positions
+
+    top = heapq.nlargest(limit, scored(), key=lambda item: item[0])
+    return {
+        "matches": [
+            {"relpath": line[offset:], "score": score, "positions": [pos - offset for pos in positions]}
+            for score, line, positions in top
+        ],
+        **stats,
+    }
+
+
+def fold_case(blob: str) -> str:
+    """将路径文本转为小写，个别非ASCII字符转换后长度会变化，此时只转换ASCII字符，保证位置与原文本一致"""
+    folded = blob.lower()
+    if len(folded) != len(blob):
+        folded = blob.translate(ASCII_LOWER)
+    return folded
+
+
+class PathIndex:
+    """单个根目录的内存路径索引: 建立时遍历一次目录树，之后通过inotify事件增量增删路径，
+    查询时将所有路径连接成一段文本，交给正则在C层完成筛选"""
+
+    def __init__(self, root: str, exclude_dirs: Sequence[str] = DEFAULT_EXCLUDE_DIRS) -> None:
+        self.root = root
+        self.exclude_dirs = set(exclude_dirs)
+        self._prefix = os.path.join(root, "")
+        self._prefix_len = len(self._prefix)
+        self.status = "pending"  # pending/building/ready/error
+        self.error: Optional[str] = None
+        # 相对于根目录的文件路径，使用字典保持插入顺序并支持O(1)的增删
+        self.paths: Dict[str, None] = {}
+        self.version = 0  # 路径集合每次变化加1，用于判断缓存的文本是否过期
+        self.last_used = time.monotonic()
+        self.watcher = TreeWatcher(root, self._on_events, exclude_dirs)
+        self.watching = False
+        self._blob: Optional[str] = None
+        self._folded_blob: Optional[str] = None
+        self._blob_version = -1
+        self._queued: Optional[List[InotifyEvent]] = None  # 建立索引期间到达的事件
+        self._build_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """开始监听目录变化并在后台建立索引，监听目录树和扫描都在线程中执行，监听先于扫描开始，扫描期间的变化不会丢失"""
+        try:
+            await self.watcher.start()
+            self.watching = True
+        except OSError as e:
+            logger.warning(f"监听目录{self.root}失败，路径索引只能通过重建更新：{str(e)}")
+        self._build_task = asyncio.create_task(self.build())
+
+    async def build(self) -> None:
+        """全量遍历目录树建立路径索引，完成后补充处理遍历期间到达的事件"""
+        self.status = "building"
+        self._queued = []
+        started_at = time.monotonic()
+        try:
+            paths = await asyncio.to_thread(self._scan)
+        except Exception as e:
+            logger.error(f"建立目录{self.root}的路径索引失败：{str(e)}")
+            self._queued = None
+            self.error = str(e)
+            self.status = "error"
+            return
+        queued, self._queued = self._queued, None
+        self.paths = paths
+        self.version += 1
+        self._apply(queued)
+        self.status = "ready"
+        self.error = None
+        logger.info(f"目录{self.root}的路径索引建立完成，{len(paths)}个文件，耗时{time.monotonic() - started_at:.2f}s")
+
+    def _scan(self) -> Dict[str, None]:
+        """在线程中遍历目录树，收集所有文件的相对路径"""
+        paths: Dict[str, None] = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(name for name in dirnames if name not in self.exclude_dirs)
+            relative = os.path.join(dirpath, "")[self._prefix_len:]
+            for name in sorted(filenames):
+                paths[relative + name] = None
+        return paths
+
+    def _relpath(self, path: str) -> Optional[str]:
+        """将事件中的绝对路径转换为相对路径，不在根目录下时返回None"""
+        if path == self.root:
+            return ""
+        if path.startswith(self._prefix):
+            return path[self._prefix_len:]
+        return None
+
+    def _on_events(self, events: List[InotifyEvent]) -> None:
+        """处理文件变化事件，建立索引期间先暂存，建立完成后再处理"""
+        if self._queued is not None:
+            self._queued.extend(events)
+            return
+        self._apply(events)
+
+    def _apply(self, events: List[InotifyEvent]) -> None:
+        """根据创建、删除、移动事件增删路径，目录被删除或移走时删除其下的所有路径"""
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # 事件队列溢出后无法得知哪些文件发生了变化，只能重建
+                logger.warning(f"目录{self.root}的inotify事件队列溢出，重建路径索引")
+                if self._build_task is None or self._build_task.done():
+                    self._build_task = asyncio.create_task(self.build())
+                continue
+            relpath = self._relpath(event.path)
+            if relpath is None:
+                continue
+            if event.is_dir or event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if event.mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self._remove_tree(relpath)
+                continue
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                if relpath not in self.paths:
+                    self.paths[relpath] = None
+                    self.version += 1
+            elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+                if relpath in self.paths:
+                    del self.paths[relpath]
+                    self.version += 1
+
+    def _remove_tree(self, relpath: str) -> None:
+        """删除目录下的所有路径，relpath为空表示根目录本身被删除"""
+        prefix = relpath + "/" if relpath else ""
+        paths = {path: None for path in self.paths if not path.startswith(prefix)}
+        if len(paths) != len(self.paths):
+            self.paths = paths
+            self.version += 1
+
+    async def wait_ready(self) -> None:
+        """等待正在进行的建立过程完成，请求取消时不影响后台的建立"""
+        task = self._build_task
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+
+    async def search(self, subdir: str, query: str, limit: int, max_candidates: int) -> Dict[str, Any]:
+        """在根目录下的子目录subdir(相对路径，空字符串表示根目录)中模糊查找文件"""
+        self.last_used = time.monotonic()
+        await self.wait_ready()
+        blob, folded_blob = self._blob, self._folded_blob
+        if blob is None or self._blob_version != self.version:
+            # 在事件循环中复制路径列表，避免线程中遍历时字典被事件回调修改
+            version = self.version
+            paths = list(self.paths)
+            blob = await asyncio.to_thread("\n".join, paths)
+            folded_blob = await asyncio.to_thread(fold_case, blob)
+            self._blob, self._folded_blob, self._blob_version = blob, folded_blob, version
+        prefix = subdir + "/" if subdir else ""
+        return await asyncio.to_thread(search_paths, blob, folded_blob, prefix, query, limit, max_candidates)
+
+    def info(self) -> Dict[str, Any]:
+        """获取路径索引的状态信息"""
+        return {
+            "root": self.root,
+            "status": self.status,
+            "error": self.error,
+            "files": len(self.paths),
+            "watching": self.watching,
+            "watched_dirs": self.watcher.watch_count,
+        }
+
+    async def close(self) -> None:
+        """停止监听和后台建立任务，释放内存中的路径"""
+        self.watcher.close()
+        if self._build_task is not None and not self._build_task.done():
+            self._build_task.cancel()
+            try:
+                await self._build_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.paths = {}
+        self._blob = self._folded_blob = None
@@ -0,0 +1,169 @@
+import fnmatch
+import os
+import re
+from typing import Any, Dict, Iterator, List, Sequence
+
+# 默认跳过的体积大、几乎不需要搜索的目录
+DEFAULT_EXCLUDE_DIRS = (
+    ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv",
+    ".tox", ".mypy_cache", ".pytest_cache", ".cache", ".idea",
+)
+# 判断二进制文件时检查的文件开头字节数
+BINARY_SNIFF_SIZE = 8192
+# 返回的单行内容最大长度
+MAX_LINE_LENGTH = 1000
+
+
+def match_any(name: str, relpath: str, patterns: Sequence[str]) -> bool:
+    """判断文件名或相对路径是否匹配任意一个glob规则"""
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern) for pattern in patterns)
+
+
+def iter_grep_files(
+        root: str,
+        include: Sequence[str],
+        exclude: Sequence[str],
+        exclude_dirs: Sequence[str],
+) -> Iterator[str]:
+    """遍历目录返回需要搜索的文件，跳过排除的目录和文件，include为空时包含所有文件"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        # 原地修改dirnames剪枝，被排除的目录不会再向下遍历
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if name not in exclude_dirs
+            and not match_any(name, os.path.relpath(os.path.join(dirpath, name), root), exclude)
+        )
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, root)
+            if include and not match_any(name, relpath, include):
+                continue
+            if exclude and match_any(name, relpath, exclude):
+                continue
+            yield path
+
+
+def filter_grep_files(
+        paths: Sequence[str],
+        root: str,
+        include: Sequence[str],
+        exclude: Sequence[str],
+        exclude_dirs: Sequence[str],
+) -> Iterator[str]:
+    """按与iter_grep_files相同的规则过滤已知的文件列表(如索引查询出的候选文件)"""
+    for path in paths:
+        relpath = os.path.relpath(path, root)
+        if relpath.startswith(".."):
+            continue
+        parts = relpath.split(os.sep)
+        if any(
+                part in exclude_dirs or (exclude and match_any(part, os.path.join(*parts[:i + 1]), exclude))
+                for i, part in enumerate(parts[:-1])
+        ):
+            continue
+        if include and not match_any(parts[-1], relpath, include):
+            continue
+        if exclude and match_any(parts[-1], relpath, exclude):
+            continue
+        yield path
+
+
+def take_batch(files: Iterator[str], size: int) -> List[str]:
+    """从文件迭代器中取出一批文件，迭代结束时返回空列表"""
+    batch = []
+    for path in files:
+        batch.append(path)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def _clip(line: str) -> str:
+    """去除行尾的\\r并限制单行的长度"""
+    line = line[:-1] if line.endswith("\r") else line
+    return line if len(line) <= MAX_LINE_LENGTH else line[:MAX_LINE_LENGTH] + "..."
+
+
+def grep_file(path: str, pattern: "re.Pattern[str]", context_lines: int, limit: int, max_file_size: int) -> Dict[str, Any]:
+    """在单个文件中搜索正则，每行最多报告一次，返回文件的搜索状态和匹配列表"""
+    result: Dict[str, Any] = {"filepath": path, "status": "nomatch", "matches": []}
+    try:
+        with open(path, "rb") as f:
+            if max_file_size > 0 and os.fstat(f.fileno()).st_size > max_file_size:
+                result["status"] = "too_large"
+                return result
+            data = f.read()
+    except OSError as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+        return result
+    if b"\0" in data[:BINARY_SNIFF_SIZE]:
+        result["status"] = "binary"
+        return result
+
+    # 对整个文件执行finditer，大部分不匹配的文件只需要一次C层的扫描，匹配后再换算行号和上下文
+    text = data.decode("utf-8", errors="replace")
+    matches = result["matches"]
+    line_number = 0
+    counted = 0
+    last_line_start = -1
+    for match in pattern.finditer(text):
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        if line_start == last_line_start:
+            continue
+        last_line_start = line_start
+        line_number += text.count("\n", counted, line_start)
+        counted = line_start
+        line_end = text.find("\n", match.start())
+        line_end = len(text) if line_end == -1 else line_end
+
+        before = []
+        pos = line_start
+        for _ in range(context_lines):
+            if pos == 0:
+                break
+            previous_start = text.rfind("\n", 0, pos - 1) + 1
+            before.insert(0, _clip(text[previous_start:pos - 1]))
+            pos = previous_start
+        after = []
+        pos = line_end
+        for _ in range(context_lines):
+            if pos + 1 >= len(text):
+                break
+            next_end = text.find("\n", pos + 1)
+            next_end = len(text) if next_end == -1 else next_end
+            after.append(_clip(text[pos + 1:next_end]))
+            pos = next_end
+
+        matches.append({
+            "filepath": path,
+            "line_number": line_number,
+            "line": _clip(text[line_start:line_end]),
+            "before_context": before,
+            "after_context": after,
+        })
+        if len(matches) >= limit:
+            break
+    if matches:
+        result["status"] = "matched"
+    return result
+
+
+def grep_files(
+        paths: List[str],
+        regex: str,
+        flags: int,
+        context_lines: int,
+        limit: int,
+        max_file_size: int,
+) -> List[Dict[str, Any]]:
+    """进程池中执行的任务: 搜索一批文件，匹配数达到limit后不再搜索剩余文件"""
+    pattern = re.compile(regex, flags)
+    results = []
+    for path in paths:
+        if limit <= 0:
+            break
+        result = grep_file(path, pattern, context_lines, limit, max_file_size)
+        limit -= len(result["matches"])
+        results.append(result)
+    return results
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from array import array
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.services.file_grep import DEFAULT_EXCLUDE_DIRS, iter_grep_files, take_batch
+from app.services.file_inotify import (
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_Q_OVERFLOW,
+    InotifyEvent,
+    TreeWatcher,
+)
+from app.services.file_trigram import TrigramIndexReader, index_files, plan_query, write_index
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceIndex:
+    """单个根目录的三元组内容索引: 磁盘上的基础索引加上内存中的增量覆盖层，
+    inotify事件驱动增量更新，覆盖层过大时在后台重建基础索引"""
+
+    def __init__(
+            self,
+            root: str,
+            index_dir: str,
+            pool_getter: Callable[[], Executor],
+            workers: int,
+            batch_size: int,
+            max_file_size: int,
+            overlay_limit: int,
+            debounce_seconds: float,
+    ) -> None:
+        self.root = root
+        self.index_dir = os.path.join(index_dir, hashlib.sha1(root.encode()).hexdigest()[:16])
+        self._pool_getter = pool_getter
+        self.workers = max(workers, 1)
+        self.batch_size = batch_size
+        self.max_file_size = max_file_size
+        self.overlay_limit = overlay_limit
+        self.debounce_seconds = debounce_seconds
+        self.status = "pending"  # pending/building/ready/error
+        self.error: Optional[str] = None
+        self.reader: Optional[TrigramIndexReader] = None
+        # 基础索引之后发生变化的文件: 路径 -> (变化时间, 三元组集合)，集合为None表示文件已删除或不需要索引
+        self.overlay: Dict[str, Tuple[float, Optional[Set[int]]]] = {}
+        self.pending: Set[str] = set()  # 收到事件尚未重新索引的文件
+        self.watcher = TreeWatcher(root, self._on_events, DEFAULT_EXCLUDE_DIRS)
+        self.watching = False
+        self._build_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        """开始监听目录变化并在后台加载或建立索引，监听先于扫描开始，扫描期间的变化不会丢失"""
+        try:
+            await self.watcher.start()
+            self.watching = True
+        except OSError as e:
+            logger.warning(f"监听目录{self.root}失败，索引只能通过重建更新：{str(e)}")
+        self._build_task = asyncio.create_task(self._load_or_build())
+
+    async def _load_or_build(self) -> None:
+        """优先加载磁盘上已有的索引，按修改时间找出之后变化的文件做增量更新，没有可用索引时全量建立"""
+        try:
+            reader = await asyncio.to_thread(TrigramIndexReader, self.index_dir)
+            if reader.meta.get("root") != self.root:
+                raise ValueError("索引的根目录不一致")
+        except (OSError, ValueError) as e:
+            logger.info(f"目录{self.root}没有可用的索引，开始建立：{str(e)}")
+            await self.build()
+            return
+        self.reader = reader
+        self.status = "ready"
+        changed = await asyncio.to_thread(self._changed_since, reader)
+        self.pending |= changed
+        await self.flush()
+        logger.info(f"已加载目录{self.root}的索引，{len(reader.paths)}个文件，{len(changed)}个文件需要更新")
+
+    def _changed_since(self, reader: TrigramIndexReader) -> Set[str]:
+        """只检查文件的修改时间，找出索引建立之后新增、修改或删除的文件"""
+        built_at = reader.meta.get("built_at", 0)
+        indexed = set(reader.paths)
+        changed = set()
+        seen = set()
+        for path in iter_grep_files(self.root, [], [], DEFAULT_EXCLUDE_DIRS):
+            seen.add(path)
+            try:
+                if path not in indexed or os.stat(path).st_mtime >= built_at:
+                    changed.add(path)
+            except OSError:
+                changed.add(path)
+        return changed | (indexed - seen)
+
+    async def build(self) -> None:
+        """全量建立基础索引，建立期间继续使用旧索引和覆盖层响应查询"""
+        self.status = "building" if self.reader is None else self.status
+        started_at = time.time()
+        try:
+            reader = await asyncio.to_thread(self._build_sync, started_at)
+        except Exception as e:
+            logger.error(f"建立目录{self.root}的索引失败：{str(e)}")
+            self.error = str(e)
+            self.status = "error" if self.reader is None else self.status
+            return
+        self.reader = reader
+        # 建立开始之后才变化的文件仍以覆盖层为准
+        self.overlay = {path: entry for path, entry in self.overlay.items() if entry[0] >= started_at}
+        self.status = "ready"
+        self.error = None
+        logger.info(f"目录{self.root}的索引建立完成，{len(reader.paths)}个文件，耗时{time.time() - started_at:.2f}s")
+
+    def _build_sync(self, started_at: float) -> TrigramIndexReader:
+        """在线程中遍历目录，将文件分批交给进程池提取三元组，合并成倒排列表后写入磁盘"""
+        pool = self._pool_getter()
+        files = iter_grep_files(self.root, [], [], DEFAULT_EXCLUDE_DIRS)
+        paths: List[str] = []
+        postings: Dict[int, array] = {}
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.workers * 2:
+                batch = take_batch(files, self.batch_size)
+                if not batch:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(index_files, batch, self.max_file_size))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for path, data in future.result():
+                    if data is None:
+                        continue
+                    file_id = len(paths)
+                    paths.append(path)
+                    keys = array("I")
+                    keys.frombytes(data)
+                    for key in keys:
+                        posting = postings.get(key)
+                        if posting is None:
+                            posting = postings[key] = array("I")
+                        posting.append(file_id)
+        write_index(self.index_dir, self.root, paths, postings, started_at)
+        return TrigramIndexReader(self.index_dir)
+
+    def _on_events(self, events: List[InotifyEvent]) -> None:
+        """记录发生变化的文件，目录被删除或移走时其中已索引的文件都视为删除，稍后合并处理"""
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # 事件队列溢出后无法得知哪些文件发生了变化，只能重建
+                logger.warning(f"目录{self.root}的inotify事件队列溢出，重建索引")
+                self._schedule_build()
+                continue
+            if event.is_dir or event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if event.mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.pending |= self._known_paths(event.path)
+                continue
+            self.pending.add(event.path)
+        if self.pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    def _known_paths(self, directory: str) -> Set[str]:
+        """获取索引和覆盖层中位于目录下的所有文件"""
+        prefix = directory.rstrip("/") + "/"
+        paths = set(self.reader.paths) if self.reader is not None else set()
+        paths |= set(self.overlay)
+        return {path for path in paths if path.startswith(prefix)}
+
+    async def _delayed_flush(self) -> None:
+        """合并短时间内的连续事件(如编辑器保存时的多次写入)后再重新索引"""
+        await asyncio.sleep(self.debounce_seconds)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"更新目录{self.root}的索引失败：{str(e)}")
+
+    async def flush(self) -> None:
+        """重新索引所有发生变化的文件并更新覆盖层，覆盖层超过上限时在后台重建基础索引"""
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            paths = sorted(self.pending)
+            self.pending = set()
+            changed_at = time.time()
+            loop = asyncio.get_running_loop()
+            pool = self._pool_getter()
+            results = await asyncio.gather(*[
+                loop.run_in_executor(pool, index_files, paths[i:i + self.batch_size], self.max_file_size)
+                for i in range(0, len(paths), self.batch_size)
+            ])
+            for batch in results:
+                for path, data in batch:
+                    keys = None
+                    if data is not None:
+                        trigrams = array("I")
+                        trigrams.frombytes(data)
+                        keys = set(trigrams)
+                    self.overlay[path] = (changed_at, keys)
+        if len(self.overlay) > self.overlay_limit:
+            self._schedule_build()
+
+    def _schedule_build(self) -> None:
+        """在后台重建基础索引，已经在重建时忽略"""
+        if self._build_task is None or self._build_task.done():
+            self._build_task = asyncio.create_task(self.build())
+
+    async def candidates(self, regex: str, flags: int) -> Optional[List[str]]:
+        """根据正则中必然出现的字面量查询可能匹配的文件，索引不可用或正则无法提供约束时返回None"""
+        reader = self.reader
+        if reader is None:
+            return None
+        plan = plan_query(regex, flags)
+        if plan is None:
+            return None
+        # 查询前先合并已到达的变化，保证结果不落后于文件系统
+        await self.flush()
+        file_ids = await asyncio.to_thread(reader.query, plan)
+        overlay = self.overlay
+        result = {reader.paths[file_id] for file_id in file_ids}
+        result = {path for path in result if path not in overlay}
+        for path, (_, keys) in overlay.items():
+            if keys is not None and any(alternative <= keys for alternative in plan):
+                result.add(path)
+        return sorted(result)
+
+    def info(self) -> Dict[str, Any]:
+        """获取索引的状态信息"""
+        meta = self.reader.meta if self.reader is not None else {}
+        return {
+            "root": self.root,
+            "status": self.status,
+            "error": self.error,
+            "files": meta.get("files", 0),
+            "trigrams": meta.get("trigrams", 0),
+            "built_at": meta.get("built_at"),
+            "overlay_files": len(self.overlay),
+            "pending_files": len(self.pending),
+            "watching": self.watching,
+            "watched_dirs": self.watcher.watch_count,
+        }
+
+    async def close(self, delete_files: bool = False) -> None:
+        """停止监听和后台任务，delete_files为True时删除磁盘上的索引"""
+        self.watcher.close()
+        for task in (self._build_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if delete_files:
+            await asyncio.to_thread(shutil.rmtree, self.index_dir, True)
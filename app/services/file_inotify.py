@@ -0,0 +1,241 @@
+import asyncio
+import ctypes
+import errno
+import logging
+import os
+import struct
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+# inotify事件类型，取值来自<sys/inotify.h>
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# 监听目录树内容变化使用的事件
+TREE_EVENTS = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE
+    | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _get_libc() -> ctypes.CDLL:
+    """加载libc，Python标准库没有封装inotify"""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+
+class InotifyEvent(NamedTuple):
+    """一个inotify事件，path为事件对应的完整路径"""
+    wd: int
+    mask: int
+    cookie: int
+    path: str
+
+    @property
+    def is_dir(self) -> bool:
+        """事件的对象是否是目录"""
+        return bool(self.mask & IN_ISDIR)
+
+
+class Inotify:
+    """inotify的ctypes封装，维护监听描述符与目录路径的对应关系"""
+
+    def __init__(self) -> None:
+        libc = _get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify初始化失败：{os.strerror(error)}")
+        self.paths: Dict[int, str] = {}  # 监听描述符 -> 目录路径
+        self.watches: Dict[str, int] = {}  # 目录路径 -> 监听描述符
+
+    def add_watch(self, path: str, mask: int = TREE_EVENTS) -> Optional[int]:
+        """添加目录监听，失败时返回None，超过系统的监听数量上限时记录警告"""
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning(f"inotify监听数量达到上限(fs.inotify.max_user_watches)，无法监听：{path}")
+            return None
+        self.paths[wd] = path
+        self.watches[path] = wd
+        return wd
+
+    def remove_watch(self, path: str) -> None:
+        """移除目录及其子目录的监听"""
+        prefix = path.rstrip("/") + "/"
+        # 新目录的监听在线程中建立，先复制一份再遍历
+        for watched in [p for p in list(self.watches) if p == path or p.startswith(prefix)]:
+            wd = self.watches.pop(watched)
+            self.paths.pop(wd, None)
+            _get_libc().inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[InotifyEvent]:
+        """读取所有已到达的事件(非阻塞)"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                directory = self.paths.get(wd)
+                if mask & IN_IGNORED:
+                    # 目录被删除或移除监听后内核发送IN_IGNORED，清理对应关系
+                    if directory is not None:
+                        self.paths.pop(wd, None)
+                        if self.watches.get(directory) == wd:
+                            self.watches.pop(directory, None)
+                    continue
+                if directory is None and not mask & IN_Q_OVERFLOW:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if directory and name else (directory or "")
+                events.append(InotifyEvent(wd, mask, cookie, path))
+        return events
+
+    def close(self) -> None:
+        """关闭inotify描述符，所有监听随之失效"""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.paths.clear()
+        self.watches.clear()
+
+
+class TreeWatcher:
+    """递归监听目录树: 启动时监听所有子目录，新建或移入的目录自动加入监听，事件在事件循环中交给回调处理，
+    recursive为False时只监听根目录本身。遍历目录树添加监听是阻塞IO，都在线程中执行"""
+
+    def __init__(
+            self,
+            root: str,
+            callback: Callable[[List[InotifyEvent]], None],
+            exclude_dirs: Sequence[str] = (),
+            recursive: bool = True,
+    ) -> None:
+        self.root = root
+        self.callback = callback
+        self.exclude_dirs = set(exclude_dirs)
+        self.recursive = recursive
+        self.inotify: Optional[Inotify] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subtree_tasks: Set[asyncio.Task] = set()  # 正在为新目录建立监听的任务
+
+    @property
+    def watch_count(self) -> int:
+        """当前监听的目录数量"""
+        return len(self.inotify.watches) if self.inotify else 0
+
+    async def start(self) -> None:
+        """初始化inotify并在线程中监听整个目录树，遍历期间到达的事件暂存在inotify队列中，遍历完成后再开始处理"""
+        self.inotify = Inotify()
+        self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.to_thread(self._add_tree, self.root)
+        except BaseException:
+            self.close()
+            raise
+        if self.inotify is None:
+            # 遍历期间已经停止监听
+            return
+        self._loop.add_reader(self.inotify.fd, self._on_readable)
+
+    def _add_tree(self, path: str) -> List[str]:
+        """监听目录及其所有子目录，返回目录中已经存在的文件(监听建立前创建的文件不会产生事件)"""
+        files = []
+        inotify = self.inotify
+        if inotify is None:
+            return files
+        if not self.recursive:
+            inotify.add_watch(path)
+            return files
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [name for name in dirnames if name not in self.exclude_dirs]
+            if inotify.add_watch(dirpath) is None:
+                dirnames[:] = []
+                continue
+            files.extend(os.path.join(dirpath, name) for name in filenames)
+        return files
+
+    def _on_readable(self) -> None:
+        """inotify描述符可读时读取事件，新建或移入的目录在线程中加入监听"""
+        events = self.inotify.read_events()
+        for event in events:
+            if not event.is_dir or not self.recursive:
+                continue
+            name = os.path.basename(event.path)
+            if event.mask & (IN_CREATE | IN_MOVED_TO) and name not in self.exclude_dirs:
+                task = self._loop.create_task(self._add_subtree(event.path))
+                self._subtree_tasks.add(task)
+                task.add_done_callback(self._subtree_tasks.discard)
+            elif event.mask & IN_MOVED_FROM:
+                self.inotify.remove_watch(event.path)
+        self._dispatch(events)
+
+    async def _add_subtree(self, path: str) -> None:
+        """在线程中监听新目录(如git clone、tar解压、mv移入)的整棵子树，完成后为其中已有的文件补充创建事件"""
+        try:
+            files = await asyncio.to_thread(self._add_tree, path)
+        except Exception as e:
+            logger.warning(f"监听新目录{path}失败：{str(e)}")
+            return
+        if self.inotify is not None:
+            self._dispatch([InotifyEvent(-1, IN_CREATE, 0, file) for file in files])
+
+    def _dispatch(self, events: List[InotifyEvent]) -> None:
+        """将事件交给回调处理"""
+        if not events:
+            return
+        try:
+            self.callback(events)
+        except Exception as e:
+            logger.error(f"处理目录{self.root}的文件变化事件失败：{str(e)}")
+
+    def poll(self) -> None:
+        """立即读取并处理已到达的事件，不等待事件循环调度，用于查询前保证结果包含此前发生的变化"""
+        if self.inotify is not None:
+            self._on_readable()
+
+    async def wait_subtrees(self) -> None:
+        """等待新目录的监听建立完成，之后这些目录中已有文件的创建事件都已交给回调"""
+        while self._subtree_tasks:
+            await asyncio.gather(*self._subtree_tasks, return_exceptions=True)
+
+    def close(self) -> None:
+        """停止监听"""
+        for task in self._subtree_tasks:
+            task.cancel()
+        if self.inotify is None:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self.inotify.fd)
+        self.inotify.close()
+        self.inotify = None
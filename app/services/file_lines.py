@@ -0,0 +1,241 @@
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from typing import BinaryIO, Deque, List, Optional, Tuple
+
+# 扫描文件建立索引时每次读取的字节数
+READ_CHUNK_SIZE = 1024 * 1024
+# 从文件末尾向前扫描时每次读取的字节数
+TAIL_BLOCK_SIZE = 64 * 1024
+# 索引记录已扫描末尾的内容，文件追加写入后用于校验前面的内容没有变化
+TAIL_SAMPLE_SIZE = 64
+
+
+def strip_line_ending(line: bytes) -> bytes:
+    """去除行尾的换行符(\\n或\\r\\n)"""
+    if line.endswith(b"\n"):
+        line = line[:-1]
+    if line.endswith(b"\r"):
+        line = line[:-1]
+    return line
+
+
+class LineIndex:
+    """文件的稀疏行偏移索引: 每隔interval字节在之后的第一个行首记录(行号, 字节偏移)作为检查点，
+    读取指定行时定位到之前最近的检查点，只需要跳过检查点之后的少量数据"""
+
+    def __init__(self, interval: int) -> None:
+        self.interval = max(interval, 1)
+        self.lines = array("q", [0])  # 检查点的行号
+        self.offsets = array("q", [0])  # 检查点的行首字节偏移
+        self.scanned_offset = 0  # 已扫描到的字节偏移
+        self.scanned_lines = 0  # 已扫描部分包含的换行符数量
+        self.total_lines: Optional[int] = None  # 扫描到文件末尾后的总行数
+        self.tail = b""  # 已扫描部分末尾的内容
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        """是否已经扫描到文件末尾"""
+        return self.total_lines is not None
+
+    def extend(self, f: BinaryIO, size: int, until_line: Optional[int] = None) -> None:
+        """从上次扫描的位置继续建立索引，直到已扫描部分包含until_line的行首，until_line为None时扫描到文件末尾"""
+        if self.complete or (until_line is not None and self.scanned_lines > until_line):
+            return
+        base = self.scanned_offset
+        lines = self.scanned_lines
+        next_checkpoint = self.offsets[-1] + self.interval
+        f.seek(base)
+        while base < size:
+            data = f.read(min(READ_CHUNK_SIZE, size - base))
+            if not data:
+                break
+            # 换行符的统计使用bytes.count，每个检查点只需要一次find，不逐行处理
+            pos = 0
+            while True:
+                start = max(next_checkpoint - base, pos)
+                newline = data.find(b"\n", start) if start < len(data) else -1
+                if newline == -1:
+                    lines += data.count(b"\n", pos)
+                    break
+                lines += data.count(b"\n", pos, newline + 1)
+                pos = newline + 1
+                self.lines.append(lines)
+                self.offsets.append(base + pos)
+                next_checkpoint = base + pos + self.interval
+            base += len(data)
+            self.tail = (self.tail + data[-TAIL_SAMPLE_SIZE:])[-TAIL_SAMPLE_SIZE:]
+            self.scanned_offset = base
+            self.scanned_lines = lines
+            if until_line is not None and lines > until_line:
+                return
+        if base >= size:
+            # 最后一行没有换行符时也算作一行，与splitlines的行数保持一致
+            self.total_lines = lines + (1 if self.tail and not self.tail.endswith(b"\n") else 0)
+
+    def locate(self, line: int) -> Tuple[int, int]:
+        """获取不超过指定行的最近检查点，返回(检查点行号, 字节偏移)"""
+        i = bisect_right(self.lines, line) - 1
+        return self.lines[i], self.offsets[i]
+
+    def verify_prefix(self, f: BinaryIO) -> bool:
+        """校验文件中已扫描部分的末尾内容是否与索引记录的一致，用于判断文件是否只是追加了内容"""
+        if not self.tail:
+            return self.scanned_offset == 0
+        f.seek(self.scanned_offset - len(self.tail))
+        return f.read(len(self.tail)) == self.tail
+
+
+class LineIndexCache:
+    """行索引的LRU缓存，按(路径, inode, 修改时间, 大小)判断索引是否有效，日志文件追加写入后复用已扫描的部分"""
+
+    def __init__(self, max_entries: int, interval: int) -> None:
+        self.max_entries = max_entries
+        self.interval = interval
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int, int], LineIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, st: os.stat_result, f: BinaryIO) -> LineIndex:
+        """获取文件的行索引，文件发生变化时重新建立"""
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            index = entry[1]
+        else:
+            index = None
+            # 同一个文件只是变大时校验已扫描部分的末尾，一致则视为追加写入继续使用原索引
+            if entry is not None and entry[0][0] == st.st_ino and st.st_size > entry[0][2]:
+                with entry[1].lock:
+                    if entry[1].scanned_offset <= st.st_size and entry[1].verify_prefix(f):
+                        entry[1].total_lines = None
+                        index = entry[1]
+            if index is None:
+                index = LineIndex(self.interval)
+        with self._lock:
+            if self.max_entries > 0:
+                self._entries[path] = (key, index)
+                self._entries.move_to_end(path)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return index
+
+
+def read_lines_at(
+        f: BinaryIO,
+        offset: int,
+        skip: int,
+        count: Optional[int],
+        max_bytes: Optional[int],
+) -> Tuple[List[bytes], bool]:
+    """从offset处跳过skip行后读取count行(None表示读到文件末尾)，读取的字节数超过max_bytes时截断，返回(行列表, 是否被截断)"""
+    f.seek(offset)
+    for _ in range(skip):
+        # 分块跳过，避免超长的行被整行读入内存
+        while True:
+            chunk = f.readline(READ_CHUNK_SIZE)
+            if not chunk or chunk.endswith(b"\n"):
+                break
+        if not chunk:
+            return [], False
+
+    lines = []
+    used = 0
+    while count is None or len(lines) < count:
+        line = f.readline(-1 if max_bytes is None else max_bytes - used + 1)
+        if not line:
+            break
+        if max_bytes is not None and used + len(line) > max_bytes:
+            lines.append(strip_line_ending(line[:max_bytes - used]))
+            return lines, True
+        used += len(line)
+        lines.append(strip_line_ending(line))
+    return lines, False
+
+
+def read_tail_lines(f: BinaryIO, size: int, count: int, max_bytes: Optional[int]) -> Tuple[List[bytes], bool]:
+    """从文件末尾向前分块扫描换行符读取最后count行，不需要读取整个文件，返回(行列表, 是否被截断)"""
+    if size <= 0 or count <= 0:
+        return [], False
+    f.seek(size - 1)
+    # 文件以换行符结尾时该换行符属于最后一行，不作为行分隔
+    end = size - 1 if f.read(1) == b"\n" else size
+    start = 0
+    truncated = False
+    found = 0
+    pos = end
+    while pos > 0:
+        block_start = max(0, pos - TAIL_BLOCK_SIZE)
+        f.seek(block_start)
+        data = f.read(pos - block_start)
+        index = len(data)
+        while found < count:
+            index = data.rfind(b"\n", 0, index)
+            if index == -1:
+                break
+            found += 1
+        if found >= count:
+            start = block_start + index + 1
+            break
+        pos = block_start
+        if max_bytes is not None and size - pos > max_bytes:
+            break
+
+    if max_bytes is not None and size - start > max_bytes:
+        start = size - max_bytes
+        truncated = True
+    f.seek(start)
+    data = f.read(size - start)
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    return [strip_line_ending(line) for line in lines], truncated
+
+
+class LineWindow:
+    """按list切片的语义从逐行到达的数据中截取[start:end)，用于无法随机访问的输出流(如sudo cat)"""
+
+    def __init__(self, start: Optional[int], end: Optional[int], max_bytes: Optional[int]) -> None:
+        self.start = start or 0
+        self.end = end
+        self.max_bytes = max_bytes
+        self.seen = 0  # 已经到达的行数
+        self.used = 0  # 已保留的字节数
+        self.truncated = False
+        # 起始行为负数时只需要保留末尾的行
+        self.lines: Deque[bytes] = deque(maxlen=-self.start if self.start < 0 else None)
+
+    @property
+    def bounded(self) -> bool:
+        """范围是否不依赖总行数，不依赖时读够行数即可停止"""
+        return self.start >= 0 and (self.end is None or self.end >= 0)
+
+    def feed(self, line: bytes) -> bool:
+        """处理一行数据，返回False表示后续的数据已经不需要"""
+        index = self.seen
+        self.seen += 1
+        if self.start >= 0 and index < self.start:
+            return True
+        if self.bounded:
+            if self.end is not None and index >= self.end:
+                return False
+            if self.max_bytes is not None and self.used + len(line) > self.max_bytes:
+                self.lines.append(line[:self.max_bytes - self.used])
+                self.truncated = True
+                return False
+            self.used += len(line)
+        self.lines.append(line)
+        return not self.bounded or self.end is None or self.seen < self.end
+
+    def result(self) -> Tuple[List[bytes], Optional[int]]:
+        """返回(截取的行, 第一行的行号)"""
+        if self.bounded:
+            return list(self.lines), self.start
+        # 依赖总行数的范围在数据读取完毕后按已到达的行数换算
+        first, last, _ = slice(self.start, self.end).indices(self.seen)
+        kept_from = self.seen - len(self.lines) if self.start < 0 else self.start
+        lines = list(self.lines)[max(first - kept_from, 0):max(last - kept_from, 0)]
+        return lines, first
@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import logging
+import os
+import stat
+import time
+import uuid
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.services.file_grep import DEFAULT_EXCLUDE_DIRS
+from app.services.file_inotify import (
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_Q_OVERFLOW,
+    InotifyEvent,
+    TreeWatcher,
+)
+
+logger = logging.getLogger(__name__)
+
+# 清单条目中各字段的位置: 大小、修改时间(纳秒)、inode、创建时的序号、最后变化的序号、缓存的内容哈希
+SIZE, MTIME_NS, INODE, CREATED_SEQ, SEQ, HASH = range(6)
+
+StatKey = Tuple[int, int, int]
+
+
+def stat_key(stat_result: os.stat_result) -> StatKey:
+    """清单中用于判断文件是否变化的信息: 大小、修改时间、inode"""
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+def scan_tree(root: str, exclude_dirs: Sequence[str]) -> Iterator[Tuple[str, StatKey]]:
+    """使用scandir遍历目录树，返回所有文件(包括符号链接本身)的相对路径和状态，不跟随指向目录的符号链接"""
+    prefix_len = len(os.path.join(root, ""))
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in exclude_dirs:
+                                stack.append(entry.path)
+                            continue
+                        yield entry.path[prefix_len:], stat_key(entry.stat(follow_symlinks=False))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def lstat_paths(root: str, relpaths: Sequence[str]) -> List[Tuple[str, Optional[StatKey]]]:
+    """获取一批文件的当前状态，文件不存在或已变成目录时返回None"""
+    results = []
+    for relpath in relpaths:
+        try:
+            stat_result = os.lstat(os.path.join(root, relpath))
+            results.append((relpath, None if stat.S_ISDIR(stat_result.st_mode) else stat_key(stat_result)))
+        except OSError:
+            results.append((relpath, None))
+    return results
+
+
+class WorkspaceManifest:
+    """单个根目录的文件清单: 路径 -> (大小, 修改时间, inode, 可选的内容哈希)。
+    每个文件的每次变化分配一个递增的序号，条目按序号排列，删除的文件保留为墓碑，
+    查询某个序号之后的变化时从末尾向前遍历，开销与变化的数量成正比，与目录树的大小无关"""
+
+    def __init__(self, root: str, max_tombstones: int, debounce_seconds: float) -> None:
+        self.root = root
+        self.max_tombstones = max_tombstones
+        self.debounce_seconds = debounce_seconds
+        # 每次建立清单生成新的纪元，旧纪元的令牌需要全量同步
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        # 早于该序号的删除记录已经被清理，更早的令牌需要全量同步
+        self.horizon = 0
+        self.status = "pending"  # pending/building/ready/error
+        self.error: Optional[str] = None
+        self.last_used = time.monotonic()
+        # 相对路径 -> (大小, 修改时间, inode, 创建序号, 变化序号, 哈希)，按变化序号排列，使用元组减少内存占用
+        self.entries: Dict[str, Tuple[Any, ...]] = {}
+        # 已删除的相对路径 -> 删除时的序号，按序号排列
+        self.tombstones: Dict[str, int] = {}
+        self.pending: Set[str] = set()  # 收到事件尚未重新获取状态的文件
+        self.rescan_needed = False
+        self.watcher = TreeWatcher(root, self._on_events, DEFAULT_EXCLUDE_DIRS)
+        self.watching = False
+        self._lock = asyncio.Lock()
+        self._build_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """开始监听目录变化并在后台建立清单，监听目录树和扫描都在线程中执行，监听先于扫描开始，扫描期间的变化不会丢失"""
+        try:
+            await self.watcher.start()
+            self.watching = True
+        except OSError as e:
+            logger.warning(f"监听目录{self.root}失败，清单只能在查询时重新扫描：{str(e)}")
+        self._build_task = asyncio.create_task(self.rescan())
+
+    async def rescan(self) -> None:
+        """全量扫描目录树并与当前清单比较，只为发生变化的文件分配新序号"""
+        self.status = "building" if self.status != "ready" else self.status
+        started_at = time.monotonic()
+        try:
+            async with self._lock:
+                self.rescan_needed = False
+                self.pending.clear()
+                changes = await asyncio.to_thread(self._diff_tree)
+                self._apply(changes)
+        except Exception as e:
+            logger.error(f"扫描目录{self.root}的文件清单失败：{str(e)}")
+            self.error = str(e)
+            self.status = "error" if self.status != "ready" else self.status
+            return
+        self.status = "ready"
+        self.error = None
+        logger.info(f"目录{self.root}的文件清单扫描完成，{len(self.entries)}个文件，{len(changes)}处变化，"
+                    f"耗时{time.monotonic() - started_at:.2f}s")
+
+    def _diff_tree(self) -> List[Tuple[str, Optional[StatKey]]]:
+        """在线程中扫描目录树，返回与清单不一致的文件，持有锁期间清单不会被修改"""
+        changes: List[Tuple[str, Optional[StatKey]]] = []
+        seen = set()
+        for relpath, key in scan_tree(self.root, DEFAULT_EXCLUDE_DIRS):
+            seen.add(relpath)
+            entry = self.entries.get(relpath)
+            if entry is None or entry[:3] != key:
+                changes.append((relpath, key))
+        changes.extend((relpath, None) for relpath in self.entries if relpath not in seen)
+        return changes
+
+    def _apply(self, changes: List[Tuple[str, Optional[StatKey]]]) -> None:
+        """将文件状态的变化写入清单，每个实际变化的文件分配一个新序号并移动到末尾"""
+        for relpath, key in changes:
+            entry = self.entries.get(relpath)
+            if key is None:
+                if entry is None:
+                    continue
+                self.seq += 1
+                del self.entries[relpath]
+                self.tombstones.pop(relpath, None)
+                self.tombstones[relpath] = self.seq
+                continue
+            if entry is not None and entry[:3] == key:
+                continue
+            self.seq += 1
+            created_seq = entry[CREATED_SEQ] if entry is not None else self.seq
+            self.entries.pop(relpath, None)
+            self.entries[relpath] = (*key, created_seq, self.seq, None)
+            self.tombstones.pop(relpath, None)
+        # 删除记录过多时清理最早的部分，依赖这些记录的令牌需要全量同步
+        while len(self.tombstones) > self.max_tombstones:
+            relpath = next(iter(self.tombstones))
+            self.horizon = self.tombstones.pop(relpath)
+
+    def _relpath(self, path: str) -> Optional[str]:
+        """将事件中的绝对路径转换为相对路径，不在根目录下时返回None"""
+        prefix = os.path.join(self.root, "")
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+    def _on_events(self, events: List[InotifyEvent]) -> None:
+        """记录发生变化的文件，目录被删除或移走时其下已知的文件都需要重新检查，稍后合并处理"""
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # 事件队列溢出后无法得知哪些文件发生了变化，只能重新扫描
+                logger.warning(f"目录{self.root}的inotify事件队列溢出，重新扫描文件清单")
+                self.rescan_needed = True
+                continue
+            if event.is_dir or event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if event.mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.pending |= self._known_paths(event.path)
+                continue
+            relpath = self._relpath(event.path)
+            if relpath is not None:
+                self.pending.add(relpath)
+        if self.rescan_needed and (self._build_task is None or self._build_task.done()):
+            self._build_task = asyncio.create_task(self.rescan())
+        elif self.pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    def _known_paths(self, directory: str) -> Set[str]:
+        """获取清单中位于目录下的所有文件"""
+        if directory == self.root:
+            return set(self.entries)
+        relative = self._relpath(directory)
+        if relative is None:
+            return set()
+        prefix = relative + "/"
+        return {relpath for relpath in self.entries if relpath.startswith(prefix)}
+
+    async def _delayed_flush(self) -> None:
+        """合并短时间内的连续事件(如编辑器保存时的多次写入)后再更新清单"""
+        await asyncio.sleep(self.debounce_seconds)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"更新目录{self.root}的文件清单失败：{str(e)}")
+
+    async def flush(self) -> None:
+        """重新获取所有发生变化的文件的状态并更新清单"""
+        async with self._lock:
+            if not self.pending:
+                return
+            relpaths = sorted(self.pending)
+            self.pending = set()
+            changes = await asyncio.to_thread(lstat_paths, self.root, relpaths)
+            self._apply(changes)
+
+    async def sync(self) -> None:
+        """查询前调用: 等待清单建立完成，读取已到达的事件并更新清单，保证结果包含此前发生的所有变化"""
+        self.last_used = time.monotonic()
+        task = self._build_task
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+        if not self.watching or self.rescan_needed:
+            await self.rescan()
+            return
+        self.watcher.poll()
+        await self.watcher.wait_subtrees()
+        await self.flush()
+
+    def parse_token(self, token: Optional[str]) -> Optional[int]:
+        """解析同步令牌，返回其中的序号，令牌为空、格式错误、来自其他纪元或早于清理边界时返回None(需要全量同步)"""
+        if not token:
+            return None
+        epoch, _, seq = token.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        since = int(seq)
+        if since > self.seq or since < self.horizon:
+            return None
+        return since
+
+    @staticmethod
+    def _after(mapping: Dict[str, Any], seq_of: Callable[[Any], int], since: int, limit: int) -> List[Tuple[int, str, Any]]:
+        """从按序号排列的映射中取出序号大于since的最早limit个，since靠近开头时正向遍历，靠近末尾时反向遍历，
+        开销与跳过或取出的条目数成正比"""
+        if not mapping:
+            return []
+        first = seq_of(next(iter(mapping.values())))
+        last = seq_of(mapping[next(reversed(mapping))])
+        result = []
+        if since - first < last - since:
+            for key, value in mapping.items():
+                seq = seq_of(value)
+                if seq <= since:
+                    continue
+                result.append((seq, key, value))
+                if len(result) >= limit:
+                    break
+            return result
+        for key in reversed(mapping):
+            value = mapping[key]
+            seq = seq_of(value)
+            if seq <= since:
+                break
+            result.append((seq, key, value))
+        result.reverse()
+        return result[:limit]
+
+    def changes_since(self, since: Optional[int], limit: int) -> Dict[str, Any]:
+        """获取序号since之后的变化，按序号从小到大最多返回limit个，since为None时返回所有文件(全量同步)。
+        返回的next_seq为最后一个返回的变化的序号，没有更多变化时为当前序号"""
+        if since is None:
+            changes = self._after(self.entries, itemgetter(SEQ), 0, limit + 1)
+        else:
+            entries = self._after(self.entries, itemgetter(SEQ), since, limit + 1)
+            tombstones = [(seq, relpath, None) for seq, relpath, _ in self._after(self.tombstones, int, since, limit + 1)]
+            changes = list(heapq.merge(entries, tombstones, key=itemgetter(0)))[:limit + 1]
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        return {
+            "changes": changes,
+            "has_more": has_more,
+            "next_seq": changes[-1][0] if has_more else self.seq,
+        }
+
+    def set_hash(self, relpath: str, entry: Tuple[Any, ...], content_hash: str) -> None:
+        """缓存文件的内容哈希，计算期间文件已经变化时不缓存"""
+        if self.entries.get(relpath) is entry:
+            self.entries[relpath] = entry[:HASH] + (content_hash,)
+
+    def make_token(self, seq: int) -> str:
+        """生成同步令牌"""
+        return f"{self.epoch}-{seq}"
+
+    def info(self) -> Dict[str, Any]:
+        """获取清单的状态信息"""
+        return {
+            "root": self.root,
+            "status": self.status,
+            "error": self.error,
+            "files": len(self.entries),
+            "tombstones": len(self.tombstones),
+            "seq": self.seq,
+            "watching": self.watching,
+        }
+
+    async def close(self) -> None:
+        """停止监听和后台任务，释放内存中的清单"""
+        self.watcher.close()
+        for task in (self._build_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self.entries = {}
+        self.tombstones = {}
@@ -0,0 +1,198 @@
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python 3.10
+    import sre_parse
+
+from app.services.file_grep import BINARY_SNIFF_SIZE
+
+# 按字节提取所有(可重叠的)三元组，使用前瞻让findall在C层完成遍历
+TRIGRAM_PATTERN = re.compile(rb"(?=(...))", re.DOTALL)
+# 索引表中的一项: 三元组(大端序整数)、倒排列表在postings.bin中的偏移和文件数
+TABLE_ENTRY = struct.Struct("<IQI")
+INDEX_VERSION = 1
+# 一个正则最多展开的分支数，超过后放弃这部分约束
+MAX_ALTERNATIVES = 16
+
+
+def extract_trigrams(data: bytes) -> Set[int]:
+    """提取内容中所有三元组，内容先转为小写，大小写敏感和不敏感的查询都可以使用同一份索引"""
+    return {int.from_bytes(trigram, "big") for trigram in set(TRIGRAM_PATTERN.findall(data.lower()))}
+
+
+def index_files(paths: List[str], max_file_size: int) -> List[Tuple[str, Optional[bytes]]]:
+    """进程池中执行的任务: 提取一批文件的三元组，返回(路径, 排序后的三元组数组)，二进制、过大或无法读取的文件返回None"""
+    results = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                if max_file_size > 0 and os.fstat(f.fileno()).st_size > max_file_size:
+                    results.append((path, None))
+                    continue
+                data = f.read()
+        except OSError:
+            results.append((path, None))
+            continue
+        if b"\0" in data[:BINARY_SNIFF_SIZE]:
+            results.append((path, None))
+            continue
+        results.append((path, array("I", sorted(extract_trigrams(data))).tobytes()))
+    return results
+
+
+def write_index(index_dir: str, root: str, paths: List[str], postings: Dict[int, array], built_at: float) -> None:
+    """将索引写入磁盘: files.bin为\\0分隔的路径，table.bin为按三元组排序的定长索引表，postings.bin为文件编号列表"""
+    os.makedirs(index_dir, exist_ok=True)
+
+    def write(name: str, data: Iterable[bytes]) -> None:
+        # 先写临时文件再替换，已经映射旧文件的查询不受影响
+        tmp = os.path.join(index_dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            for chunk in data:
+                f.write(chunk)
+        os.replace(tmp, os.path.join(index_dir, name))
+
+    keys = sorted(postings)
+    table = bytearray(TABLE_ENTRY.size * len(keys))
+    offset = 0
+    for i, key in enumerate(keys):
+        TABLE_ENTRY.pack_into(table, i * TABLE_ENTRY.size, key, offset, len(postings[key]))
+        offset += len(postings[key]) * postings[key].itemsize
+    write("postings.bin", (postings[key].tobytes() for key in keys))
+    write("table.bin", [bytes(table)])
+    write("files.bin", [b"\0".join(os.fsencode(path) for path in paths)])
+    write("meta.json", [json.dumps({
+        "version": INDEX_VERSION,
+        "root": root,
+        "built_at": built_at,
+        "files": len(paths),
+        "trigrams": len(keys),
+    }).encode()])
+
+
+class TrigramIndexReader:
+    """以内存映射的方式读取磁盘上的三元组索引，查询时在索引表中二分查找，只访问用到的倒排列表"""
+
+    def __init__(self, index_dir: str) -> None:
+        with open(os.path.join(index_dir, "meta.json"), "rb") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"索引版本不兼容：{self.meta.get('version')}")
+        with open(os.path.join(index_dir, "files.bin"), "rb") as f:
+            data = f.read()
+        self.paths = [os.fsdecode(path) for path in data.split(b"\0")] if data else []
+        self._table = self._map(os.path.join(index_dir, "table.bin"))
+        self._postings = self._map(os.path.join(index_dir, "postings.bin"))
+        self._count = len(self._table) // TABLE_ENTRY.size if self._table is not None else 0
+
+    @staticmethod
+    def _map(path: str) -> Optional[mmap.mmap]:
+        """只读映射文件，空文件无法映射时返回None"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def lookup(self, key: int) -> array:
+        """查找包含该三元组的文件编号列表"""
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            entry_key, offset, count = TABLE_ENTRY.unpack_from(self._table, mid * TABLE_ENTRY.size)
+            if entry_key < key:
+                low = mid + 1
+            elif entry_key > key:
+                high = mid
+            else:
+                files = array("I")
+                files.frombytes(self._postings[offset:offset + count * files.itemsize])
+                return files
+        return array("I")
+
+    def query(self, alternatives: List[Set[int]]) -> Set[int]:
+        """查询满足任意一组三元组(组内需要全部包含)的文件编号，倒排列表从短到长求交集"""
+        result: Set[int] = set()
+        for keys in alternatives:
+            lists = sorted((self.lookup(key) for key in keys), key=len)
+            if not lists or not lists[0]:
+                continue
+            files = set(lists[0])
+            for posting in lists[1:]:
+                files.intersection_update(posting)
+                if not files:
+                    break
+            result |= files
+        return result
+
+    def close(self) -> None:
+        """释放内存映射"""
+        for mapped in (self._table, self._postings):
+            if mapped is not None:
+                mapped.close()
+        self._table = self._postings = None
+        self._count = 0
+
+
+def _literal_alternatives(items: Sequence, ignore_case: bool) -> List[List[str]]:
+    """分析正则语法树，返回匹配文本中必然包含的字面量: 外层为或(任意一组成立)，内层为且(全部出现)"""
+    alternatives: List[List[str]] = [[]]
+    run = ""
+
+    def combine(current: List[List[str]], sub: List[List[str]]) -> List[List[str]]:
+        # 两组约束的笛卡尔积，分支过多时放弃子表达式的约束(结果仍然正确，只是筛选效果变差)
+        if len(current) * len(sub) > MAX_ALTERNATIVES:
+            return current
+        return [a + b for a in current for b in sub]
+
+    def flush() -> None:
+        nonlocal run, alternatives
+        literal = run
+        run = ""
+        # 忽略大小写时非ASCII字符的大小写形式字节不同，索引只对ASCII做了小写
+        if len(literal.encode()) >= 3 and not (ignore_case and not literal.isascii()):
+            alternatives = [a + [literal] for a in alternatives]
+
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            run += chr(av)
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            alternatives = combine(alternatives, _literal_alternatives(av[-1], ignore_case))
+        elif op is sre_parse.BRANCH:
+            sub = []
+            for branch in av[1]:
+                sub.extend(_literal_alternatives(branch, ignore_case))
+            # 任意一个分支没有约束时整个分支都没有约束
+            if all(sub):
+                alternatives = combine(alternatives, sub)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            alternatives = combine(alternatives, _literal_alternatives(av[2], ignore_case))
+    flush()
+    return alternatives
+
+
+def plan_query(regex: str, flags: int) -> Optional[List[Set[int]]]:
+    """将正则转换为三元组查询，无法从正则中得到约束时返回None(需要搜索所有文件)"""
+    try:
+        parsed = sre_parse.parse(regex, flags)
+    except re.error:
+        return None
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    alternatives = _literal_alternatives(list(parsed), ignore_case)
+    if not all(alternatives):
+        return None
+    plan = []
+    for literals in alternatives:
+        keys: Set[int] = set()
+        for literal in literals:
+            keys |= extract_trigrams(literal.encode())
+        plan.append(keys)
+    return plan
@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.file_inotify import (
+    IN_ATTRIB,
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_MODIFY,
+    IN_MOVE_SELF,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyEvent,
+)
+
+
+def merge_action(previous: Optional[str], action: str) -> Optional[str]:
+    """合并同一路径先后发生的两个变化，返回None表示两者相互抵消(如创建后又删除)"""
+    if previous is None:
+        return action
+    if action == "deleted":
+        return None if previous == "created" else "deleted"
+    if action == "created":
+        # 删除后又创建视为内容被替换
+        return "modified" if previous in ("deleted", "modified") else previous
+    # 新创建或移入的文件随后被修改，仍然只报告创建或移动
+    return previous
+
+
+class ChangeCoalescer:
+    """合并一段时间内的inotify事件: 同一路径的多次变化合并为一个净变化，
+    成对的MOVED_FROM/MOVED_TO合并为一个moved变化，按变化首次出现的顺序输出"""
+
+    def __init__(self, roots: Sequence[str]) -> None:
+        self.roots = set(roots)
+        self.changes: Dict[str, Dict[str, Any]] = {}
+        # MOVED_FROM的cookie -> (原路径, 移动前该路径已合并的变化)，等待同一cookie的MOVED_TO
+        self.moves: Dict[int, Tuple[str, Optional[Dict[str, Any]]]] = {}
+        self.overflow = False
+
+    def __bool__(self) -> bool:
+        return bool(self.changes) or self.overflow
+
+    def _merge(self, path: str, action: str, is_dir: bool) -> None:
+        """将一个变化合并到路径已有的变化中"""
+        previous = self.changes.get(path)
+        if previous is not None and previous["action"] == "moved" and action == "deleted":
+            # 移入后又被删除，相当于原路径被删除
+            del self.changes[path]
+            self._merge(previous["from_path"], "deleted", is_dir)
+            return
+        merged = merge_action(previous["action"] if previous else None, action)
+        if merged is None:
+            self.changes.pop(path, None)
+        elif previous is None:
+            self.changes[path] = {"action": merged, "path": path, "is_dir": is_dir}
+        else:
+            previous["action"] = merged
+
+    def add(self, event: InotifyEvent) -> None:
+        """按事件类型合并一个inotify事件"""
+        mask = event.mask
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+        elif mask & IN_MOVED_FROM:
+            self.moves[event.cookie] = (event.path, dict(self.changes.get(event.path) or {}) or None)
+            self._merge(event.path, "deleted", event.is_dir)
+        elif mask & IN_MOVED_TO:
+            source = self.moves.pop(event.cookie, None)
+            if source is None:
+                self._merge(event.path, "created", event.is_dir)
+                return
+            from_path, before = source
+            # 撤销MOVED_FROM时记录的删除，原路径已经不存在，只在新路径报告变化
+            self.changes.pop(from_path, None)
+            if before is not None and before["action"] == "created":
+                # 窗口内新建的文件被移走，只报告新位置的创建
+                self._merge(event.path, "created", event.is_dir)
+                return
+            if before is not None and before["action"] == "moved":
+                # 连续移动合并为从最初位置的一次移动
+                from_path = before["from_path"]
+            self.changes.pop(event.path, None)
+            self.changes[event.path] = {
+                "action": "moved", "path": event.path, "from_path": from_path, "is_dir": event.is_dir,
+            }
+        elif mask & IN_CREATE:
+            self._merge(event.path, "created", event.is_dir)
+        elif mask & IN_DELETE:
+            self._merge(event.path, "deleted", event.is_dir)
+        elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # 子目录自身的删除和移动已经由父目录的事件报告，只报告订阅的根目录本身
+            if event.path in self.roots:
+                self._merge(event.path, "deleted", True)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB):
+            self._merge(event.path, "modified", event.is_dir)
+
+    def drain(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """取出已合并的变化和是否发生过事件队列溢出，并清空状态"""
+        changes, overflow = list(self.changes.values()), self.overflow
+        self.changes = {}
+        self.moves = {}
+        self.overflow = False
+        return changes, overflow
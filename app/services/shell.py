@@ -4,19 +4,276 @@ import getpass
 import logging
 import os
 import re
+import signal
 import socket
+import time
 import uuid
-from typing import Dict, Optional, List
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, List, Set, Tuple
 
+from app.core.config import get_settings
 from app.interfaces.errors.exceptions import AppException, BadRequestException, NotFoundException
-from app.models.shell import ConsoleRecord, Shell, ShellExecuteResult, ShellKillResult, ShellReadResult, ShellWaitResult, ShellWriteResult
+from app.models.shell import (
+    ConsoleRecord,
+    QueuedCommand,
+    Shell,
+    ShellBatchCommand,
+    ShellBatchCommandResult,
+    ShellBatchExecuteResult,
+    ShellCommandUsage,
+    ShellExecuteResult,
+    ShellExpectResult,
+    ShellKillResult,
+    ShellOrphanProcess,
+    ShellResourceLimits,
+    ShellReadResult,
+    ShellSessionInfo,
+    ShellWaitResult,
+    ShellWriteResult,
+)
+from app.models.shell_output import AnsiStripper, ShellOutputBuffer
+from app.services.shell_limits import CgroupManager, apply_process_limits
+from app.services.shell_pool import PtyShellPool
+from app.services.shell_process import (
+    SHELL_TAG_ENV,
+    find_tagged_processes,
+    kill_session,
+    read_cmdline,
+    terminate_session,
+)
+from app.services.shell_pty import PtyShell
+from app.services.shell_throttle import ShellOutputThrottle
+from app.services.shell_usage import ProcessUsageTracker
 logger = logging.getLogger(__name__)
 
 class ShellService:
     """shell的服务"""
     active_shells: Dict[str, Shell]
+    # 等待输出匹配时每次重新扫描的重叠字节数，用于匹配跨越多次写入的内容
+    expect_overlap_bytes: int = 4096
     def __init__(self) -> None:
-        self.active_shells = {}
+        # 按最近访问时间排序，最久未访问的会话在最前面
+        self.active_shells = OrderedDict()
+        settings = get_settings()
+        # 每个会话输出缓冲区的字节上限
+        self.output_max_bytes = settings.shell_output_max_bytes
+        # 会话输出的限速配置
+        self.output_rate_limit = settings.shell_output_rate_limit
+        self.output_rate_policy = settings.shell_output_rate_policy
+        self.output_max_read_size = settings.shell_output_max_read_size
+        # 输出超过内存上限后溢出到磁盘的配置
+        self.spill_max_bytes = settings.shell_spill_max_bytes
+        self.spill_segment_bytes = settings.shell_spill_segment_bytes
+        self.spill_dir = settings.shell_spill_dir or None
+        # 实时输出订阅者的队列大小
+        self.stream_queue_size = settings.shell_stream_queue_size
+        # 常驻会话使用的预热bash进程池
+        self.pty_pool = PtyShellPool(
+            size=settings.shell_pool_size,
+            max_idle_seconds=settings.shell_pool_max_idle_seconds,
+        )
+        # 会话容量与空闲回收配置
+        self.max_sessions = settings.shell_max_sessions
+        self.session_idle_ttl = settings.shell_session_idle_ttl_seconds
+        self.reaper_interval = settings.shell_reaper_interval_seconds
+        self._reaper_task: Optional[asyncio.Task] = None
+        # 批量执行命令的并发限制，所有批量请求共享
+        self.batch_semaphore = asyncio.Semaphore(max(settings.shell_batch_concurrency, 1))
+        self.batch_timeout = settings.shell_batch_timeout_seconds
+        # 命令资源占用的采样间隔
+        self.usage_sample_interval = settings.shell_usage_sample_interval
+        # 排队执行命令的队列长度上限以及保留的历史命令数
+        self.queue_max_size = settings.shell_queue_max_size
+        self.queue_history_size = settings.shell_queue_history_size
+        # 泄漏进程的回收配置: 已结束会话/命令的进程标记，以及最近发现的泄漏进程
+        self.orphan_reap_interval = settings.shell_orphan_reap_interval_seconds
+        self.orphan_kill = settings.shell_orphan_kill
+        self._retired_tags: Set[str] = set()
+        self.orphan_processes: Deque[ShellOrphanProcess] = deque(maxlen=100)
+        self._orphan_task: Optional[asyncio.Task] = None
+        # 命令默认的调度优先级和资源上限，以及会话使用的cgroup
+        self.default_limits = ShellResourceLimits(
+            nice=settings.shell_nice,
+            ionice_class=settings.shell_ionice_class,
+            ionice_level=settings.shell_ionice_level,
+            cpu_limit=settings.shell_cpu_limit,
+            memory_limit=settings.shell_memory_limit,
+        )
+        self.cgroups = CgroupManager(settings.shell_cgroup_root)
+
+    async def start(self) -> None:
+        """启动Shell服务的后台任务"""
+        self.pty_pool.start()
+        if self._reaper_task is None and self.reaper_interval > 0:
+            self._reaper_task = asyncio.create_task(self._reap_sessions())
+        if self._orphan_task is None and self.orphan_reap_interval > 0:
+            self._orphan_task = asyncio.create_task(self._reap_orphans_periodically())
+
+    async def close(self) -> None:
+        """关闭Shell服务的后台任务，释放预热进程并关闭所有会话"""
+        for task in (self._reaper_task, self._orphan_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._reaper_task = None
+        self._orphan_task = None
+        await self.pty_pool.close()
+        for session_id in list(self.active_shells):
+            self._close_session(session_id)
+
+    def _create_output_buffer(self) -> ShellOutputBuffer:
+        """创建会话输出缓冲区，超过内存上限的输出溢出到磁盘"""
+        return ShellOutputBuffer(
+            max_bytes=self.output_max_bytes,
+            spill_max_bytes=self.spill_max_bytes,
+            spill_dir=self.spill_dir,
+            spill_segment_bytes=self.spill_segment_bytes,
+        )
+
+    def _create_output_throttle(self) -> ShellOutputThrottle:
+        """创建会话输出的流量控制器"""
+        return ShellOutputThrottle(
+            rate=self.output_rate_limit,
+            policy=self.output_rate_policy,
+            max_read_size=self.output_max_read_size,
+        )
+
+    def _touch_session(self, session_id: str) -> None:
+        """更新会话的最近访问时间，并移动到LRU队列的末尾"""
+        self.active_shells[session_id].last_active_at = time.time()
+        self.active_shells.move_to_end(session_id)
+
+    def _close_session(self, session_id: str) -> None:
+        """关闭会话中的进程并释放会话占用的资源"""
+        shell = self.active_shells.pop(session_id, None)
+        if shell is None:
+            return
+        logger.info(f"正在回收Shell会话：{session_id}")
+        # 结束会话中的所有进程，包括后台作业，并记录进程标记以便回收脱离会话的子孙进程
+        if shell.pty is not None:
+            shell.pty.kill()
+            self._retired_tags.add(shell.pty.tag)
+        else:
+            kill_session(shell.process.pid)
+            if shell.process.returncode is None:
+                shell.process.kill()
+            self._retired_tags.add(session_id)
+        # 删除会话的cgroup，cgroup中残留的进程会被一并结束
+        self.cgroups.remove(shell.cgroup_path)
+        # 停止资源占用的后台采样
+        if shell.usage_tracker is not None:
+            shell.usage_tracker.finish()
+        # 取消尚未执行的排队命令
+        if shell.queue_worker is not None:
+            shell.queue_worker.cancel()
+        while shell.command_queue:
+            queued = shell.command_queue.popleft()
+            queued.status = "cancelled"
+            queued.done.set()
+        # 通知实时订阅者会话已结束，并删除溢出到磁盘的输出文件
+        shell.buffer.publish({"type": "exit", "returncode": self._last_returncode(shell)})
+        shell.buffer.close()
+
+    def _ensure_capacity(self) -> None:
+        """会话数量达到上限时按LRU淘汰，优先淘汰没有命令在执行的会话"""
+        if self.max_sessions <= 0:
+            return
+        while len(self.active_shells) >= self.max_sessions:
+            victim = next(
+                (session_id for session_id, shell in self.active_shells.items() if not self._is_running(shell)),
+                next(iter(self.active_shells)),
+            )
+            logger.warning(f"Shell会话数量达到上限{self.max_sessions}，淘汰会话：{victim}")
+            self._close_session(victim)
+
+    async def _reap_sessions(self) -> None:
+        """后台定期回收空闲超时且没有命令在执行的会话"""
+        while True:
+            await asyncio.sleep(self.reaper_interval)
+            if self.session_idle_ttl <= 0:
+                continue
+            now = time.time()
+            for session_id, shell in list(self.active_shells.items()):
+                if now - shell.last_active_at > self.session_idle_ttl and not self._is_running(shell):
+                    self._close_session(session_id)
+
+    async def _reap_orphans_periodically(self) -> None:
+        """后台定期查找并回收已结束会话泄漏的子孙进程"""
+        while True:
+            await asyncio.sleep(self.orphan_reap_interval)
+            try:
+                self.reap_orphans()
+                self.cgroups.retry_pending()
+            except Exception as e:
+                logger.error(f"回收泄漏进程出错：{str(e)}")
+
+    def reap_orphans(self) -> List[ShellOrphanProcess]:
+        """扫描带有已结束会话/命令标记的存活进程(后台作业、守护进程等)，记录并按配置强制结束"""
+        if not self._retired_tags:
+            return []
+        # 1.会话重新使用的标记不再视为泄漏(普通会话以会话id作为标记)
+        self._retired_tags -= set(self.active_shells)
+        tagged = find_tagged_processes()
+
+        # 2.已结束标记下仍然存活的进程即为泄漏进程
+        orphans = []
+        for tag in list(self._retired_tags):
+            pids = tagged.get(tag)
+            if not pids:
+                # 没有残留进程的标记不会再产生新的进程，不再跟踪
+                self._retired_tags.discard(tag)
+                continue
+            for pid in pids:
+                orphan = ShellOrphanProcess(pid=pid, tag=tag, command=read_cmdline(pid), found_at=time.time())
+                if self.orphan_kill:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                        orphan.killed = True
+                    except (ProcessLookupError, PermissionError):
+                        pass
+                orphans.append(orphan)
+
+        if orphans:
+            logger.warning(f"发现{len(orphans)}个已结束会话泄漏的进程：{[(o.pid, o.command) for o in orphans]}")
+        self.orphan_processes.extend(orphans)
+        return orphans
+
+    @classmethod
+    def _memory_usage(cls, shell: Shell) -> int:
+        """估算会话占用的内存字节数: 输出缓冲区、行索引以及控制台记录"""
+        records_size = sum(len(record.command) + len(record.ps1) for record in shell.console_records)
+        return shell.buffer.memory_usage() + records_size
+
+    def list_sessions(self) -> List[ShellSessionInfo]:
+        """列出所有Shell会话的状态，按最近访问时间倒序"""
+        now = time.time()
+        sessions = []
+        for session_id, shell in reversed(self.active_shells.items()):
+            sessions.append(ShellSessionInfo(
+                session_id=session_id,
+                pid=shell.process.pid,
+                persistent=shell.pty is not None,
+                running=self._is_running(shell),
+                returncode=self._last_returncode(shell),
+                exec_dir=shell.exec_dir,
+                command=shell.console_records[-1].command if shell.console_records else None,
+                command_count=len(shell.console_records),
+                age_seconds=round(now - shell.created_at, 3),
+                idle_seconds=round(now - shell.last_active_at, 3),
+                limits=shell.limits,
+                cgroup=shell.cgroup_path,
+                output_bytes_read=shell.throttle.bytes_read,
+                output_bytes_dropped=shell.throttle.bytes_dropped,
+                throttled_seconds=round(shell.throttle.throttled_seconds, 3),
+                buffered_bytes=shell.buffer.size,
+                spilled_bytes=shell.buffer.disk_usage(),
+                memory_bytes=self._memory_usage(shell),
+            ))
+        return sessions
     @classmethod
     def create_session_id(cls) -> str:
         """创建会话id，使用uuid4"""
@@ -38,13 +295,20 @@ class ShellService:
         hostname = socket.gethostname()
         display_dir = self._get_display_path(exec_dir)
         return f"{username}@{hostname}:{display_dir} $"
-    @classmethod
-    async def _create_process(cls, exec_dir: str, command: str) -> asyncio.subprocess.Process:
-        """根据传递的执行目录+命令创建一个asyncio管理的子进程"""
+    async def _create_process(
+            self,
+            exec_dir: str,
+            command: str,
+            tag: str,
+            limits: Optional[ShellResourceLimits] = None,
+            cgroup_path: Optional[str] = None,
+    ) -> asyncio.subprocess.Process:
+        """根据传递的执行目录+命令创建一个asyncio管理的子进程，子进程运行在独立的会话(进程组)中，
+        tag写入环境变量，用于识别脱离会话后泄漏的子孙进程，limits和cgroup_path在进程启动后立即设置"""
         logger.debug(f"在目录{exec_dir}下使用命令{command}创建一个子进程")
         shell_exec= "/bin/bash"
         # 创建一个系统级的子进程执行shell命令
-        return await asyncio.create_subprocess_shell(
+        process = await asyncio.create_subprocess_shell(
             command,
             executable=shell_exec,
             cwd=exec_dir,
@@ -52,9 +316,23 @@ class ShellService:
             stderr=asyncio.subprocess.STDOUT,
             stdin=asyncio.subprocess.PIPE,
             limit=1024* 1024,
+            env={**os.environ, SHELL_TAG_ENV: tag},
+            start_new_session=True,
         )
-    async def _start_output_reader(self, session_id: str, process: asyncio.subprocess.Process) -> None:
-        """启动写成连续读取进程输出并将其存储到会话中"""
+        # 不使用preexec_fn: 它会关闭posix_spawn/vfork快速路径，并且在多线程进程中fork后执行Python代码并不安全，
+        # 改为启动后对子进程设置，bash之后创建的子进程都会继承
+        if limits is not None:
+            apply_process_limits(process.pid, limits)
+        self.cgroups.add_process(cgroup_path, process.pid)
+        return process
+    async def _start_output_reader(
+            self,
+            session_id: str,
+            process: asyncio.subprocess.Process,
+            record: Optional[ConsoleRecord] = None,
+            tracker: Optional[ProcessUsageTracker] = None,
+    ) -> None:
+        """启动写成连续读取进程输出并将其存储到会话中，进程结束时将资源占用统计写入对应的控制台记录"""
         # 使用统一utf-8
         logger.debug(f"正在启用输出读取器：{session_id}")
         encoding = "utf-8"
@@ -62,107 +340,601 @@ class ShellService:
         decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
 
         shell = self.active_shells.get(session_id)
+        throttle = shell.throttle if shell else None
         while True:
             # 判断子进程是否又标准版输出管道
             if process.stdout:
                 try:
-                    # 读取缓存区的数据，假设一次读取4096
-                    buffer = await process.stdout.read(4096)
+                    # 读取缓存区的数据，读取大小根据输出速度自适应调整
+                    buffer = await process.stdout.read(throttle.read_size if throttle else 4096)
                     if not buffer:
                         break
+                    # 超出会话输出速率时暂停读取(反压)或丢弃该块输出
+                    if throttle is not None:
+                        throttle.record_read(len(buffer))
+                        if not await self._admit_output(shell, len(buffer)):
+                            continue
                     # 使用编码器进行编码，同时设置final=false表示未结束
                     output = decoder.decode(buffer, final=False)
-                    # 判断会话是否存在
-                    if shell:
-                        shell.output += output
-                        if shell.console_records:
-                            shell.console_records[-1].output += output
+                    # 判断会话是否存在，输出过滤后统一写入会话缓冲区，控制台记录通过偏移共享
+                    if shell and output:
+                        self._ingest_output(shell, output)
+                    # 管道中持续有数据时read不会挂起，主动让出事件循环避免其他请求被饿死
+                    await asyncio.sleep(0)
                 except Exception as e:
                     logger.error(f"读取进程输出出错：{str(e)}")
                     break
             else:
                 break
+
+        # 输出读取完毕后等待进程结束，提交未换行的内容并向实时输出订阅者广播退出事件
+        if shell:
+            self._ingest_dropped_notice(shell)
+        if tracker is not None:
+            # 管道关闭时进程可能尚未被回收，此时还能读取到最终的CPU时间
+            tracker.sample()
+        returncode = await process.wait()
+        if record is not None and tracker is not None:
+            self._finish_usage(record, tracker)
+        if shell:
+            if shell.process is process:
+                self._flush_output(shell)
+            if record is not None:
+                record.returncode = returncode
+            shell.buffer.publish({"type": "exit", "returncode": returncode})
         logger.debug(f"会话{session_id}的输出读取器已完成")
+
+    async def _start_pty_output_reader(self, session_id: str, shell: Shell, pty_shell: PtyShell) -> None:
+        """持续读取常驻PTY bash的输出，剥离命令结束标记后写入会话，并在命令结束时结束对应的控制台记录"""
+        logger.debug(f"正在启用PTY输出读取器：{session_id}")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        throttle = shell.throttle
+        while True:
+            try:
+                data = await pty_shell.read(throttle.read_size)
+                if not data:
+                    break
+                throttle.record_read(len(data))
+                # 剥离结束标记，标记之前的输出属于刚结束的命令，限速只作用于输出，结束标记始终处理
+                output, finished = pty_shell.parser.feed(data)
+                if output and await self._admit_output(shell, len(output)):
+                    text = decoder.decode(output, final=False)
+                    if text:
+                        self._ingest_output(shell, text)
+                if finished:
+                    self._ingest_dropped_notice(shell)
+                for token, returncode in finished:
+                    if pty_shell.finish(token, returncode):
+                        self._finish_pty_command(shell, returncode)
+                # 主动让出事件循环，避免持续输出的会话饿死其他请求
+                await asyncio.sleep(0)
+            except Exception as e:
+                logger.error(f"读取PTY输出出错：{str(e)}")
+                break
+
+        # bash退出后结束正在执行的命令(bash已被替换时不再影响新的控制台记录)
+        await pty_shell.process.wait()
+        was_busy = pty_shell.busy
+        pty_shell.exited()
+        if was_busy and shell.pty is pty_shell:
+            self._finish_pty_command(shell, pty_shell.returncode)
+        logger.debug(f"会话{session_id}的PTY输出读取器已完成")
+
+    async def _admit_output(self, shell: Shell, size: int) -> bool:
+        """按会话的输出速率限制处理一块输出，返回False表示该块被丢弃，恢复写入前先插入丢弃提示"""
+        if not await shell.throttle.admit(size):
+            return False
+        self._ingest_dropped_notice(shell)
+        return True
+
+    @classmethod
+    def _ingest_dropped_notice(cls, shell: Shell) -> None:
+        """将上次提示之后丢弃的字节数作为提示写入会话输出"""
+        dropped = shell.throttle.take_dropped()
+        if dropped:
+            cls._ingest_output(shell, f"\n[...输出过快，已丢弃{dropped}字节...]\n")
+
+    @classmethod
+    def _ingest_output(cls, shell: Shell, text: str) -> None:
+        """过滤原始输出中的ANSI序列并写入会话缓冲区，只在写入时处理一次"""
+        committed = shell.stripper.feed(text)
+        shell.buffer.append(committed.encode("utf-8"), pending=shell.stripper.line, raw=text)
+
+    @classmethod
+    def _flush_output(cls, shell: Shell) -> None:
+        """命令结束时将未换行的当前行提交到缓冲区"""
+        line = shell.stripper.flush()
+        if line or shell.buffer.pending:
+            shell.buffer.append(line.encode("utf-8"), pending="")
+
+    @classmethod
+    def _finish_pty_command(cls, shell: Shell, returncode: int) -> None:
+        """结束常驻会话中当前命令的控制台记录并广播退出事件"""
+        cls._flush_output(shell)
+        if shell.console_records:
+            shell.console_records[-1].end_offset = shell.buffer.end_offset
+            shell.console_records[-1].returncode = returncode
+            if shell.usage_tracker is not None:
+                cls._finish_usage(shell.console_records[-1], shell.usage_tracker)
+        shell.buffer.publish({"type": "exit", "returncode": returncode})
+
+    def _start_usage_tracker(self, shell: Shell, pid: int, count_root_memory: bool = True) -> ProcessUsageTracker:
+        """为会话中的新命令创建资源占用统计器并启动后台采样"""
+        tracker = ProcessUsageTracker(pid, count_root_memory=count_root_memory)
+        tracker.start(self.usage_sample_interval)
+        shell.usage_tracker = tracker
+        return tracker
+
+    @classmethod
+    def _finish_usage(cls, record: ConsoleRecord, tracker: ProcessUsageTracker) -> None:
+        """停止采样并将最终的资源占用统计写入控制台记录"""
+        if record.usage is None:
+            record.usage = ShellCommandUsage(**tracker.finish())
+
+    @classmethod
+    def _command_usage(cls, shell: Shell, record: Optional[ConsoleRecord] = None) -> Optional[ShellCommandUsage]:
+        """获取命令的资源占用统计，默认为最近一条命令，命令未结束时返回当前的统计"""
+        if record is None:
+            if not shell.console_records:
+                return None
+            record = shell.console_records[-1]
+        if record.usage is not None:
+            return record.usage
+        if shell.usage_tracker is not None and shell.console_records and record is shell.console_records[-1]:
+            return ShellCommandUsage(**shell.usage_tracker.snapshot())
+        return None
+
+    def _resolve_limits(self, limits: Optional[ShellResourceLimits]) -> ShellResourceLimits:
+        """合并请求的资源限制与默认配置，未设置的字段使用默认值"""
+        if limits is None:
+            return self.default_limits.model_copy()
+        return self.default_limits.model_copy(update=limits.model_dump(exclude_none=True))
+
+    def _apply_pty_limits(self, shell: Shell, pty_shell: PtyShell) -> None:
+        """预热的bash在取出时才知道所属会话，此时bash还没有子进程，设置后之后的命令都会继承"""
+        apply_process_limits(pty_shell.process.pid, shell.limits)
+        self.cgroups.add_process(shell.cgroup_path, pty_shell.process.pid)
+
+    async def _spawn_pty_shell(self, session_id: str, shell: Shell) -> None:
+        """从进程池为会话取出常驻PTY bash并创建后台输出读取任务"""
+        pty_shell = await self.pty_pool.acquire()
+        self._apply_pty_limits(shell, pty_shell)
+        shell.pty = pty_shell
+        shell.process = pty_shell.process
+        shell.output_reader = asyncio.create_task(self._start_pty_output_reader(session_id, shell, pty_shell))
+
+    async def _run_pty_command(
+            self,
+            session_id: str,
+            shell: Shell,
+            command: str,
+            exec_dir: Optional[str],
+    ) -> None:
+        """在常驻PTY bash中执行命令，bash已退出时重新启动，上一条命令未结束时先中断"""
+        pty_shell = shell.pty
+        # 1.bash已退出则重新启动，会话状态(环境变量等)将重置，工作目录切换回会话最后的目录
+        if pty_shell.process.returncode is not None:
+            logger.warning(f"会话{session_id}的常驻bash已退出，重新启动")
+            self._retired_tags.add(pty_shell.tag)
+            await self._spawn_pty_shell(session_id, shell)
+            pty_shell = shell.pty
+            exec_dir = exec_dir or shell.exec_dir
+        # 2.上一条命令仍在执行时先发送Ctrl+C，中断失败则重启bash
+        elif pty_shell.busy:
+            logger.debug(f"正在中断上一条命令:{session_id}")
+            await pty_shell.interrupt()
+            try:
+                await asyncio.wait_for(pty_shell.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                logger.warning(f"中断会话{session_id}中的命令失败，重新启动常驻bash")
+                exec_dir = exec_dir or pty_shell.cwd or shell.exec_dir
+                pty_shell.kill()
+                self._retired_tags.add(pty_shell.tag)
+                await self._spawn_pty_shell(session_id, shell)
+                pty_shell = shell.pty
+
+        # 3.结束上一条控制台记录并从缓冲区末尾开始记录新命令的输出
+        cwd = exec_dir or pty_shell.cwd or shell.exec_dir
+        shell.exec_dir = cwd
+        self._flush_output(shell)
+        if shell.console_records:
+            shell.console_records[-1].end_offset = shell.buffer.end_offset
+            # 上一条命令随bash被重启时不会收到结束标记，在此结束其资源统计
+            if shell.usage_tracker is not None:
+                self._finish_usage(shell.console_records[-1], shell.usage_tracker)
+        shell.console_records.append(ConsoleRecord(
+            ps1=self._format_ps1(cwd),
+            command=command,
+            start_offset=shell.buffer.end_offset,
+        ))
+        # bash本身是进程树的根，以其累计的CPU时间(含已回收子进程)的增量作为命令的CPU时间
+        self._start_usage_tracker(shell, pty_shell.process.pid, count_root_memory=False)
+        await pty_shell.run(command, exec_dir=exec_dir)
+
+    @classmethod
+    def _is_running(cls, shell: Shell) -> bool:
+        """判断会话中当前的命令是否仍在执行，有排队等待的命令也视为在执行"""
+        if shell.command_queue:
+            return True
+        if shell.pty is not None:
+            return shell.pty.busy
+        return shell.output_reader is None or not shell.output_reader.done()
+
+    @classmethod
+    def _last_returncode(cls, shell: Shell) -> Optional[int]:
+        """获取会话中最近一条命令的返回码"""
+        if shell.pty is not None:
+            return shell.pty.returncode
+        return shell.process.returncode
+
     async def wait_process(self, session_id: str, seconds: Optional[int] = None) -> ShellWaitResult:
         """传递会话Id+时间，等待子进程结束"""
         logger.debug(f"正在Shell会话中等待进程：{session_id},超时：{seconds}s")
         if session_id not in self.active_shells:
             logger.error(f"Shell会话不存在：{session_id}")
             raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
         # 获取会话和子进程
         shell = self.active_shells[session_id]
         process = shell.process
 
         try:
             seconds = 60 if seconds is None or seconds <= 0 else seconds
+            # 常驻会话等待当前命令结束，而不是等待bash进程退出
+            if shell.pty is not None:
+                returncode = await asyncio.wait_for(shell.pty.wait(), timeout=seconds)
+                logger.info(f"命令已完成，返回代码为：{returncode}")
+                return ShellWaitResult(returncode=returncode, usage=self._command_usage(shell))
             await asyncio.wait_for(process.wait(),timeout=seconds)
+            # 进程结束后稍等输出读取器读完管道中剩余的数据
+            if shell.output_reader is not None:
+                await asyncio.wait({shell.output_reader}, timeout=1)
             # 记录日志并发你结果
             logger.info(f"进程已完成，返回代码为：{process.returncode}")
-            return ShellWaitResult(returncode=process.returncode)
+            return ShellWaitResult(returncode=process.returncode, usage=self._command_usage(shell))
         except asyncio.TimeoutError:
             logger.warning(f"Shell会话进程等待超时：{seconds}s")
             raise BadRequestException(f"Shell会话进程等待超时：{seconds}s")
         except Exception as e:
             logger.error(f"Shell会话进程等待过程出错：{str(e)}")
             raise AppException(f"shell会话进程等待出错：{seconds}s")
+    async def wait_output(
+            self,
+            session_id: str,
+            pattern: Optional[str] = None,
+            offset: Optional[int] = None,
+            seconds: Optional[int] = None,
+    ) -> ShellExpectResult:
+        """等待会话输出匹配正则表达式、命令结束或超时，pattern为空时有任意新输出即返回"""
+        logger.debug(f"正在等待Shell会话输出：{session_id},匹配：{pattern},超时：{seconds}s")
+        if session_id not in self.active_shells:
+            logger.error(f"Shell会话不存在：{session_id}")
+            raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
+        shell = self.active_shells[session_id]
+        regex = self._compile_pattern(pattern)
+
+        # 1.确定匹配的起始偏移，默认从当前命令的输出开头开始
+        buffer = shell.buffer
+        if offset is None:
+            start_offset = shell.console_records[-1].start_offset if shell.console_records else buffer.start_offset
+        else:
+            start_offset = min(max(offset, 0), buffer.end_offset)
+        scan_offset = start_offset
+        initial_pending = buffer.pending
+
+        seconds = 60 if seconds is None or seconds <= 0 else seconds
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while True:
+            # 2.检查新输出是否满足条件，输出由读取器写入后通过事件唤醒，无需轮询
+            matched = None
+            if regex is not None:
+                matched, scan_offset = await self._search_output(buffer, regex, scan_offset)
+            elif buffer.end_offset > start_offset or buffer.pending != initial_pending:
+                matched = True
+
+            exited = not self._is_running(shell)
+            if matched is not None or exited:
+                output, output_offset, truncated = self._read_tail(buffer, start_offset)
+                return ShellExpectResult(
+                    session_id=session_id,
+                    matched=matched is not None,
+                    match=matched.group() if isinstance(matched, re.Match) else None,
+                    groups=list(matched.groups()) if isinstance(matched, re.Match) else [],
+                    exited=exited,
+                    returncode=self._last_returncode(shell) if exited else None,
+                    output=output,
+                    output_offset=output_offset,
+                    truncated=truncated,
+                    pending=buffer.pending,
+                    next_offset=buffer.end_offset,
+                )
+
+            # 3.等待下一次输出变化，超时后返回当前的输出
+            remaining = deadline - loop.time()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(buffer.wait_changed(), timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.debug(f"等待Shell会话输出超时：{session_id}")
+                output, output_offset, truncated = self._read_tail(buffer, start_offset)
+                return ShellExpectResult(
+                    session_id=session_id,
+                    timed_out=True,
+                    output=output,
+                    output_offset=output_offset,
+                    truncated=truncated,
+                    pending=buffer.pending,
+                    next_offset=buffer.end_offset,
+                )
+
+    async def wait_output_any(
+            self,
+            session_ids: List[str],
+            pattern: Optional[str] = None,
+            seconds: Optional[int] = None,
+    ) -> ShellExpectResult:
+        """同时等待多个会话，任意一个会话的输出匹配或命令结束即返回该会话的结果"""
+        session_ids = list(dict.fromkeys(session_ids))
+        if not session_ids:
+            raise BadRequestException("等待的会话列表不能为空")
+        # 在创建任务之前校验会话和正则表达式，避免错误被等待任务吞掉
+        for session_id in session_ids:
+            if session_id not in self.active_shells:
+                logger.error(f"Shell会话不存在：{session_id}")
+                raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._compile_pattern(pattern)
+
+        tasks = [
+            asyncio.create_task(self.wait_output(session_id, pattern=pattern, seconds=seconds))
+            for session_id in session_ids
+        ]
+        try:
+            pending = set(tasks)
+            timed_out_result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task not in done:
+                        continue
+                    result = task.result()
+                    if not result.timed_out:
+                        return result
+                    timed_out_result = timed_out_result or result
+            return timed_out_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _search_output(
+            self,
+            buffer: ShellOutputBuffer,
+            regex: re.Pattern,
+            scan_offset: int,
+    ) -> Tuple[Optional[re.Match], int]:
+        """从scan_offset开始按窗口匹配输出，每个窗口不超过单次读取上限，避免将溢出到磁盘的大量输出一次性读入内存，
+        返回匹配结果和下次扫描的起始偏移(保留一段重叠以匹配跨越两次写入的内容)"""
+        window = self.output_max_bytes
+        while True:
+            scan_start = max(scan_offset, buffer.start_offset)
+            scan_end = buffer.end_offset
+            if 0 < window < scan_end - scan_start:
+                scan_end = buffer.char_boundary(scan_start + window)
+            text = buffer.read_text(scan_start, scan_end)
+            if scan_end >= buffer.end_offset:
+                # 交互提示(如Password:)通常没有换行，匹配时需要包含未结束的当前行
+                text += buffer.pending
+            matched = regex.search(text)
+            if matched is not None or scan_end >= buffer.end_offset:
+                return matched, max(scan_offset, scan_end - self.expect_overlap_bytes)
+            scan_offset = max(scan_end - self.expect_overlap_bytes, scan_start + 1)
+            # 扫描大量输出时让出事件循环
+            await asyncio.sleep(0)
+
+    def _read_tail(
+            self,
+            buffer: ShellOutputBuffer,
+            start: int,
+            end: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+    ) -> Tuple[str, int, bool]:
+        """读取[start, end)范围的输出，超过max_bytes(默认为单次读取上限)时只保留末尾部分，
+        返回文本、文本的起始偏移以及是否被截断，被截断的部分可通过read-shell-output按偏移分页读取"""
+        max_bytes = self.output_max_bytes if max_bytes is None else max(max_bytes, 0)
+        stop = buffer.end_offset if end is None else min(end, buffer.end_offset)
+        if self.output_max_bytes > 0 and stop - max(start, buffer.start_offset) > max_bytes:
+            start = buffer.char_boundary(stop - max_bytes)
+            return buffer.read_text(start, end), start, True
+        return buffer.read_text(start, end), start, False
+
     @classmethod
-    def _remove_ansi_escape_codes(cls, text: str) -> str:
-        """从文本中删除ANSI转意字符"""
-        assi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        return assi_escape.sub("", text)
+    def _compile_pattern(cls, pattern: Optional[str]) -> Optional[re.Pattern]:
+        """编译等待输出使用的正则表达式，多行模式下^和$匹配每一行"""
+        if not pattern:
+            return None
+        try:
+            return re.compile(pattern, re.MULTILINE)
+        except re.error as e:
+            raise BadRequestException(f"正则表达式不合法：{str(e)}")
 
-    def get_console_records(self, session_id: str) -> List[ConsoleRecord]:
-        """从指定会话中获取控制台记录"""
+    def get_console_records(self, session_id: str, offset: int = 0) -> List[ConsoleRecord]:
+        """从指定会话中获取控制台记录，只返回offset之后的输出，所有记录的输出合计不超过单次读取上限，
+        从最新的记录开始分配，超出的部分只保留末尾并标记truncated"""
         # 判断会话是否存在
         logger.debug(f"正在获取Shell会话的控制台记录：{session_id}")
         if session_id not in self.active_shells:
             logger.error(f"shell会话不存在：{session_id}")
             raise NotFoundException(f"shell会话不存在：{session_id}")
+        self._touch_session(session_id)
         # 获取原始的控制台记录列表
-        console_records = self.active_shells[session_id].console_records
+        shell = self.active_shells[session_id]
+        buffer = shell.buffer
         clean_console_records = []
+        budget = self.output_max_bytes
 
-        for console_record in console_records:
+        for console_record in reversed(shell.console_records):
+            # 跳过输出全部位于offset之前的记录
+            end_offset = console_record.end_offset
+            if end_offset is not None and end_offset <= offset and console_record.start_offset < offset:
+                continue
+            start_offset = max(console_record.start_offset, offset)
+            output, output_start, truncated = self._read_tail(buffer, start_offset, end_offset, max_bytes=budget)
+            stop = buffer.end_offset if end_offset is None else min(end_offset, buffer.end_offset)
+            budget -= max(stop - max(output_start, buffer.start_offset), 0)
+            # 控制台记录用于展示，未结束的命令附加尚未换行的当前行
+            if end_offset is None:
+                output += buffer.pending
             clean_console_records.append(ConsoleRecord(
                 ps1=console_record.ps1,
                 command=console_record.command,
-                output=self._remove_ansi_escape_codes(console_record.output)
+                output=output,
+                truncated=truncated,
+                start_offset=console_record.start_offset,
+                end_offset=console_record.end_offset,
+                usage=self._command_usage(shell, console_record),
+                returncode=console_record.returncode,
             ))
+        clean_console_records.reverse()
         return clean_console_records
 
 
 
-    async def read_shell_output(self, session_id: str, console: bool = False) -> ShellReadResult:
-        """根据传递的会话id+是否输出控制台记录获取Shell命令结果"""
+    async def read_shell_output(
+            self,
+            session_id: str,
+            console: bool = False,
+            offset: Optional[int] = None,
+            tail_lines: Optional[int] = None,
+            limit: Optional[int] = None,
+    ) -> ShellReadResult:
+        """根据传递的会话id+是否输出控制台记录+读取偏移/末尾行数/最大字节数获取Shell命令结果"""
         # 判断下传递的会话是否存在
         logger.debug(f"查看shell会话那天：{session_id}")
         if session_id not in self.active_shells:
             logger.error(f"shell会话不存在：{session_id}")
             raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
         # 获取会话
         shell = self.active_shells[session_id]
 
-        # 获取原声输出并移除额外字符
-        raw_out= shell.output
-        clean_output = self._remove_ansi_escape_codes(raw_out)
+        # 计算读取的起始偏移: 未传递offset时读取当前命令的输出，传递tail_lines时只读取最后N行
+        buffer = shell.buffer
+        if offset is None:
+            start_offset = shell.console_records[-1].start_offset if shell.console_records else buffer.start_offset
+        else:
+            start_offset = min(max(offset, 0), buffer.end_offset)
+        if tail_lines is not None:
+            start_offset = max(start_offset, buffer.tail_offset(tail_lines))
+
+        # 单次读取不超过单次读取上限，避免溢出到磁盘的大量输出一次性读入内存: 按偏移增量读取时向后分页，
+        # 读取当前命令或最后N行时只保留末尾部分
+        max_read = self.output_max_bytes
+        if limit is not None and limit > 0:
+            limit = min(limit, max_read) if max_read > 0 else limit
+        elif offset is not None and tail_lines is None and max_read > 0:
+            limit = max_read
+
+        # 记录本次读取的结束位置，输出在写入时已过滤，读取只需要切片
+        end_offset = None
+        truncated = False
+        if limit is not None and limit > 0:
+            end_offset = buffer.char_boundary(max(start_offset, buffer.start_offset) + limit)
+            if end_offset >= buffer.end_offset:
+                end_offset = None
+            truncated = end_offset is not None
+            clean_output = buffer.read_text(start_offset, end_offset)
+        else:
+            clean_output, start_offset, truncated = self._read_tail(buffer, start_offset)
+        next_offset = buffer.end_offset if end_offset is None else end_offset
+        # 尚未换行的当前行可能被回车覆盖，不计入偏移，单独返回
+        pending = buffer.pending if end_offset is None else ""
         # 判断是否获取控制台记录
         if console:
-            console_records = self.get_console_records(session_id)
+            console_records = self.get_console_records(session_id, offset=offset or 0)
         else:
             console_records = []
         return ShellReadResult(
             session_id=session_id,
             output=clean_output,
-            console_records=console_records
+            output_offset=start_offset,
+            truncated=truncated,
+            console_records=console_records,
+            pending=pending,
+            next_offset=next_offset,
         )
+    def stream_output(
+            self,
+            session_id: str,
+            raw: bool = False,
+            offset: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """根据传递的会话id订阅实时输出，先补发offset之后已缓冲的数据，进程结束时以exit事件收尾"""
+        # 在返回异步迭代器之前校验会话，保证响应开始前就能返回404
+        if session_id not in self.active_shells:
+            logger.error(f"Shell会话不存在：{session_id}")
+            raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
+        return self._iter_output_events(self.active_shells[session_id], raw, offset)
+
+    async def _iter_output_events(
+            self,
+            shell: Shell,
+            raw: bool,
+            offset: Optional[int],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """订阅会话输出缓冲区并逐个产出输出事件"""
+        buffer = shell.buffer
+
+        # 1.订阅与读取已缓冲数据之间没有await，保证补发数据与实时数据无缝衔接
+        subscriber = buffer.subscribe(self.stream_queue_size)
+        try:
+            if offset is not None and (offset < buffer.end_offset or buffer.pending):
+                next_offset = buffer.end_offset
+                yield {
+                    "type": "output",
+                    "offset": offset,
+                    "next_offset": next_offset,
+                    "data": buffer.read_text(offset, next_offset),
+                    "pending": buffer.pending,
+                }
+
+            # 2.命令已经结束且输出读取完毕时直接返回退出事件
+            if not self._is_running(shell):
+                yield {"type": "exit", "returncode": self._last_returncode(shell)}
+                return
+
+            # 3.持续转发订阅到的事件直到进程退出，raw模式推送未过滤的原始输出
+            while True:
+                event = await subscriber.get()
+                if event["type"] == "output":
+                    event = {
+                        "type": "output",
+                        "offset": event["offset"],
+                        "next_offset": event["next_offset"],
+                        **({"data": event["raw"]} if raw else {"data": event["data"], "pending": event["pending"]}),
+                    }
+                yield event
+                if event["type"] == "exit":
+                    return
+        finally:
+            buffer.unsubscribe(subscriber)
+
     async def exec_command(
             self,
             session_id: str,
             exec_dir: Optional[str],
             command: str,
+            persistent: bool = False,
+            queued: bool = False,
+            limits: Optional[ShellResourceLimits] = None,
     ) -> ShellExecuteResult:
-        """传递会话id+执行目录+命令执行后返回结果"""
+        """传递会话id+执行目录+命令执行后返回结果，persistent表示新建会话时使用常驻PTY bash，
+        queued表示会话已存在时将命令排队执行而不是终止正在执行的命令，limits只在新建会话时生效"""
         logger.info(f"正在会话{session_id}中执行命令：{command}")
+        # 常驻会话只在显式传递执行目录时切换目录，否则沿用bash当前的工作目录
+        requested_dir = exec_dir or None
         if not exec_dir or exec_dir == "":
             exec_dir = os.path.expanduser("~")
         if not os.path.exists(exec_dir):
@@ -172,73 +944,79 @@ class ShellService:
             # 格式化成ps1格式
             ps1 = self._format_ps1(exec_dir)
 
-            # 判断当前Shell会话是否存在
-            if session_id not in self.active_shells:
+            # 判断当前Shell会话是否存在，存在则更新最近访问时间
+            if session_id in self.active_shells:
+                self._touch_session(session_id)
+                shell = self.active_shells[session_id]
+                # 常驻会话只在显式传递执行目录时切换目录，普通会话默认在主目录执行
+                command_dir = requested_dir if shell.pty is not None else exec_dir
+                if queued:
+                    # 排队模式下命令加入FIFO队列后立即返回，不终止正在执行的命令
+                    return self._enqueue_command(session_id, shell, command, command_dir)
+                # 持有会话锁启动命令，避免并发请求同时替换会话中的进程
+                async with shell.lock:
+                    record = await self._start_command(session_id, shell, command, command_dir)
+            elif persistent:
+                # 新建常驻会话，从进程池取出预热的bash后切换到执行目录执行命令
+                logger.debug(f"创建一个新的常驻Shell会话：{session_id}")
+                self._ensure_capacity()
+                session_limits = self._resolve_limits(limits)
+                pty_shell = await self.pty_pool.acquire()
+                shell = Shell(
+                    process=pty_shell.process,
+                    exec_dir=exec_dir,
+                    buffer=self._create_output_buffer(),
+                    throttle=self._create_output_throttle(),
+                    pty=pty_shell,
+                    limits=session_limits,
+                    cgroup_path=self.cgroups.create(f"session-{uuid.uuid4().hex}", session_limits),
+                )
+                self._apply_pty_limits(shell, pty_shell)
+                self.active_shells[session_id] = shell
+                shell.output_reader = asyncio.create_task(
+                    self._start_pty_output_reader(session_id, shell, pty_shell)
+                )
+                async with shell.lock:
+                    await self._run_pty_command(session_id, shell, command, exec_dir)
+                    record = shell.console_records[-1]
+            else:
                 # 不在就创建一个新的进程
                 logger.debug(f"创建一个新的Shell会话：{session_id}")
-                process = await self._create_process(exec_dir,command)
+                self._ensure_capacity()
+                session_limits = self._resolve_limits(limits)
+                cgroup_path = self.cgroups.create(f"session-{uuid.uuid4().hex}", session_limits)
+                try:
+                    process = await self._create_process(
+                        exec_dir, command, tag=session_id, limits=session_limits, cgroup_path=cgroup_path,
+                    )
+                except Exception:
+                    self.cgroups.remove(cgroup_path)
+                    raise
                 self.active_shells[session_id] = Shell(
                     process=process,
                     exec_dir=exec_dir,
-                    output="",
-                    console_records=[ConsoleRecord(ps1=ps1,command=command,output="")]
+                    buffer=self._create_output_buffer(),
+                    throttle=self._create_output_throttle(),
+                    console_records=[ConsoleRecord(ps1=ps1,command=command)],
+                    limits=session_limits,
+                    cgroup_path=cgroup_path,
                 )
                 # 创建后台任务来运行输出读取器
-                await asyncio.create_task(self._start_output_reader(session_id, process))
-            else:
-                # 该会话已存在直接读取
-                logger.debug(f"使用现有的shell会话")
                 shell = self.active_shells[session_id]
-                old_process = shell.process
-                # 判断旧进程是否还在运行，如果在运行，则停止就进程在执行新命令
-                if old_process.returncode is None:
-                    logger.debug(f"正在终止上一个进程:{session_id}")
-                    try:
-                        old_process.terminate()
-                        await asyncio.wait_for(old_process.wait(), timeout=1)
-                    except Exception as e:
-                        logger.warning(f"强制终止Shell会话中的进程{session_id}失败：{str(e)}")
-                        old_process.kill()
-                # 关闭之后创建一个新的进程
-                process = await self._create_process(exec_dir, command)
-
-                # 更新会话信息
-                shell.process = process
-                shell.exec_dir = exec_dir
-                shell.output = ""
-                shell.console_records.append(ConsoleRecord(ps1=ps1, command=command,output=""))
-                # 创建后台任务来运行输出读取器
-                await asyncio.create_task(self._start_output_reader(session_id,process))
-
-                try:
-                    logger.debug(f"正在等待会话中的进程完成：{session_id}")
-                    wait_result = await self.wait_process(session_id, seconds=5)
-
-                    # 判断返回的代码是否非空（已经结束）则同步返回执行结果
-                    if wait_result.returncode is not None:
-                        # 记录日志并查看结果
-                        logger.debug(f"Shell会话进程已结束，代码：{wait_result.returncode}")
-                        view_result = await self.read_shell_output(session_id)
-                        return ShellExecuteResult(
-                            session_id=session_id,
-                            command=command,
-                            status="completed",
-                            returncode=wait_result.returncode,
-                            output=view_result.output,
-                        )
-                except BadRequestException as _:
-                    logger.warning(f"进程在会话超时后仍在运行：{session_id}")
-                    pass
-                except Exception as e:
-                    logger.warning(f"等待进程出现异常：{str(e)}")
-                    pass
-
-                return ShellExecuteResult(
-                    session_id=session_id,
-                    command=command,
-                    status="running"
+                record = shell.console_records[-1]
+                tracker = self._start_usage_tracker(shell, process.pid)
+                shell.output_reader = asyncio.create_task(
+                    self._start_output_reader(session_id, process, record, tracker)
                 )
 
+            # 等待本条命令结束，超时后返回running，后续通过读取/等待接口获取结果
+            try:
+                logger.debug(f"正在等待会话中的进程完成：{session_id}")
+                await asyncio.wait_for(self._wait_record(shell, record), timeout=5)
+            except asyncio.TimeoutError:
+                logger.warning(f"进程在会话超时后仍在运行：{session_id}")
+            return self._record_result(session_id, shell, record)
+
         except Exception as e:
             logger.error(f"命令执行失败:{str(e)}",exc_info=True)
             raise AppException(
@@ -246,6 +1024,251 @@ class ShellService:
                 data={"seesion_id": session_id, "command": command}
             )
 
+    async def _start_command(
+            self,
+            session_id: str,
+            shell: Shell,
+            command: str,
+            exec_dir: Optional[str],
+    ) -> ConsoleRecord:
+        """在已有会话中启动命令并返回其控制台记录，上一条命令仍在执行时先终止，调用方需持有会话锁"""
+        if shell.pty is not None:
+            # 常驻会话复用已有的bash执行命令
+            logger.debug(f"使用现有的常驻shell会话")
+            await self._run_pty_command(session_id, shell, command, exec_dir)
+            return shell.console_records[-1]
+
+        # 该会话已存在直接读取
+        logger.debug(f"使用现有的shell会话")
+        exec_dir = exec_dir or os.path.expanduser("~")
+        old_process = shell.process
+        # 判断旧进程是否还在运行，如果在运行，则停止旧进程所在的整个进程组再执行新命令
+        if old_process.returncode is None:
+            logger.debug(f"正在终止上一个进程:{session_id}")
+            try:
+                await terminate_session(old_process.pid, grace=1)
+                await asyncio.wait_for(old_process.wait(), timeout=1)
+            except Exception as e:
+                logger.warning(f"强制终止Shell会话中的进程{session_id}失败：{str(e)}")
+                old_process.kill()
+        # 关闭之后创建一个新的进程
+        process = await self._create_process(
+            exec_dir, command, tag=session_id, limits=shell.limits, cgroup_path=shell.cgroup_path,
+        )
+
+        # 更新会话信息，结束上一条控制台记录并从缓冲区末尾开始记录新命令的输出
+        shell.process = process
+        shell.exec_dir = exec_dir
+        self._flush_output(shell)
+        if shell.console_records:
+            shell.console_records[-1].end_offset = shell.buffer.end_offset
+        record = ConsoleRecord(
+            ps1=self._format_ps1(exec_dir),
+            command=command,
+            start_offset=shell.buffer.end_offset,
+        )
+        shell.console_records.append(record)
+        # 创建后台任务来运行输出读取器，读取器在后台持续运行，输出可通过实时订阅获取
+        tracker = self._start_usage_tracker(shell, process.pid)
+        shell.output_reader = asyncio.create_task(
+            self._start_output_reader(session_id, process, record, tracker)
+        )
+        return record
+
+    @classmethod
+    async def _wait_record(cls, shell: Shell, record: ConsoleRecord) -> None:
+        """等待控制台记录对应的命令结束，命令结束时读取器会广播退出事件"""
+        while not record.finished:
+            await shell.buffer.wait_changed()
+
+    def _record_result(
+            self,
+            session_id: str,
+            shell: Shell,
+            record: ConsoleRecord,
+            command_id: Optional[str] = None,
+    ) -> ShellExecuteResult:
+        """根据控制台记录生成命令的执行结果，命令结束后才返回输出"""
+        if not record.finished:
+            return ShellExecuteResult(
+                session_id=session_id,
+                command=record.command,
+                status="running",
+                usage=self._command_usage(shell, record),
+                command_id=command_id,
+            )
+        logger.debug(f"Shell会话进程已结束，代码：{record.returncode}")
+        output, output_offset, truncated = self._read_tail(shell.buffer, record.start_offset, record.end_offset)
+        return ShellExecuteResult(
+            session_id=session_id,
+            command=record.command,
+            status="completed",
+            returncode=record.returncode,
+            output=output,
+            output_offset=output_offset,
+            truncated=truncated,
+            usage=self._command_usage(shell, record),
+            command_id=command_id,
+        )
+
+    def _enqueue_command(
+            self,
+            session_id: str,
+            shell: Shell,
+            command: str,
+            exec_dir: Optional[str],
+    ) -> ShellExecuteResult:
+        """将命令加入会话的FIFO队列，由后台任务在上一条命令结束后依次执行"""
+        if 0 < self.queue_max_size <= len(shell.command_queue):
+            raise BadRequestException(f"Shell会话的命令队列已满：{self.queue_max_size}")
+        queued = QueuedCommand(command_id=uuid.uuid4().hex, command=command, exec_dir=exec_dir)
+        shell.command_queue.append(queued)
+        shell.queued_commands[queued.command_id] = queued
+        logger.info(f"命令已加入会话{session_id}的队列：{queued.command_id}")
+
+        # 只保留最近的排队命令记录，淘汰最早已结束的命令
+        if len(shell.queued_commands) > self.queue_history_size:
+            for command_id in [
+                command_id for command_id, item in shell.queued_commands.items() if item.done.is_set()
+            ][:len(shell.queued_commands) - self.queue_history_size]:
+                del shell.queued_commands[command_id]
+
+        if shell.queue_worker is None or shell.queue_worker.done():
+            shell.queue_worker = asyncio.create_task(self._run_command_queue(session_id, shell))
+        return ShellExecuteResult(
+            session_id=session_id,
+            command=command,
+            status="queued",
+            command_id=queued.command_id,
+        )
+
+    async def _run_command_queue(self, session_id: str, shell: Shell) -> None:
+        """按FIFO顺序执行会话中排队的命令，每条命令在上一条命令结束后才开始"""
+        while shell.command_queue:
+            queued = shell.command_queue[0]
+            try:
+                # 1.持有会话锁确认当前没有命令在执行后再启动，否则等待当前命令结束
+                while queued.record is None:
+                    async with shell.lock:
+                        current = shell.console_records[-1] if shell.console_records else None
+                        if current is None or current.finished:
+                            shell.command_queue.popleft()
+                            queued.status = "running"
+                            queued.record = await self._start_command(session_id, shell, queued.command, queued.exec_dir)
+                            break
+                    await self._wait_record(shell, current)
+
+                # 2.等待本条命令结束
+                await self._wait_record(shell, queued.record)
+                queued.status = "completed"
+            except Exception as e:
+                logger.error(f"执行会话{session_id}中排队的命令失败：{str(e)}")
+                if shell.command_queue and shell.command_queue[0] is queued:
+                    shell.command_queue.popleft()
+                queued.status = "error"
+                queued.error = str(e)
+            finally:
+                queued.done.set()
+
+    async def wait_command(self, session_id: str, command_id: str, seconds: Optional[int] = None) -> ShellExecuteResult:
+        """等待排队执行的命令结束并返回其结果，超时后返回命令当前的状态"""
+        logger.debug(f"正在等待Shell会话中的排队命令：{session_id},{command_id}")
+        if session_id not in self.active_shells:
+            logger.error(f"Shell会话不存在：{session_id}")
+            raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
+        shell = self.active_shells[session_id]
+        queued = shell.queued_commands.get(command_id)
+        if queued is None:
+            raise NotFoundException(f"排队命令不存在：{command_id}")
+
+        seconds = 60 if seconds is None or seconds <= 0 else seconds
+        try:
+            await asyncio.wait_for(queued.done.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            logger.debug(f"等待排队命令超时：{command_id}")
+
+        # 命令尚未开始或启动失败时只返回状态，开始执行后返回对应控制台记录的结果
+        if queued.record is None:
+            return ShellExecuteResult(
+                session_id=session_id,
+                command=queued.command,
+                status=queued.status,
+                output=queued.error,
+                command_id=command_id,
+            )
+        return self._record_result(session_id, shell, queued.record, command_id=command_id)
+
+    async def exec_batch(
+            self,
+            commands: List[ShellBatchCommand],
+            max_output_length: Optional[int] = 10000,
+    ) -> ShellBatchExecuteResult:
+        """并发执行一组相互独立的命令，受并发上限限制，返回每条命令的返回码、耗时和输出"""
+        logger.info(f"批量执行{len(commands)}条命令")
+        results = await asyncio.gather(*[
+            self._exec_batch_command(index, command, max_output_length)
+            for index, command in enumerate(commands)
+        ])
+        return ShellBatchExecuteResult(results=list(results))
+
+    async def _exec_batch_command(
+            self,
+            index: int,
+            batch_command: ShellBatchCommand,
+            max_output_length: Optional[int],
+    ) -> ShellBatchCommandResult:
+        """在独立的子进程中执行批量命令中的一条，超时后结束进程"""
+        exec_dir = batch_command.exec_dir or os.path.expanduser("~")
+        timeout = batch_command.timeout if batch_command.timeout and batch_command.timeout > 0 else self.batch_timeout
+        result = ShellBatchCommandResult(index=index, command=batch_command.command, exec_dir=exec_dir, status="error")
+        if not os.path.exists(exec_dir):
+            result.output = f"当前目录不存在：{exec_dir}"
+            return result
+
+        # 输出使用有上限的缓冲区，只保留末尾部分
+        buffer = ShellOutputBuffer(max_bytes=max_output_length or 0)
+        stripper = AnsiStripper()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        async with self.batch_semaphore:
+            start_time = time.monotonic()
+            tag = f"batch-{uuid.uuid4().hex}"
+            try:
+                process = await self._create_process(exec_dir, batch_command.command, tag=tag, limits=self.default_limits)
+            except Exception as e:
+                result.output = f"创建进程失败：{str(e)}"
+                return result
+            # 批量命令不接收输入，关闭标准输入避免进程阻塞等待
+            process.stdin.close()
+
+            async def collect_output() -> int:
+                while True:
+                    data = await process.stdout.read(4096)
+                    if not data:
+                        break
+                    buffer.append(stripper.feed(decoder.decode(data, final=False)).encode("utf-8"))
+                return await process.wait()
+
+            try:
+                result.returncode = await asyncio.wait_for(collect_output(), timeout=timeout)
+                result.status = "completed"
+            except asyncio.TimeoutError:
+                logger.warning(f"批量命令执行超时({timeout}s)：{batch_command.command}")
+                kill_session(process.pid)
+                if process.returncode is None:
+                    process.kill()
+                result.returncode = await process.wait()
+                result.status = "timeout"
+            result.duration = round(time.monotonic() - start_time, 3)
+            # 批量命令结束后残留的后台进程由泄漏进程回收任务处理
+            self._retired_tags.add(tag)
+
+        buffer.append(stripper.flush().encode("utf-8"))
+        result.output = buffer.read_text(0)
+        result.truncated = buffer.start_offset > 0
+        return result
+
     async def write_shell_input(
             self,
             session_id: str,
@@ -257,6 +1280,7 @@ class ShellService:
         if session_id not in self.active_shells:
             logger.error(f"Shell会话不存在：{session_id}")
             raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
         shell = self.active_shells[session_id]
         process = shell.process
 
@@ -276,13 +1300,14 @@ class ShellService:
             # 将字符串编码为字节流
             input_data = text_to_send.encode(encoding)
             log_text = input_text + ("\n" if press_enter else "")
-            shell.output += log_text
-            if shell.console_records:
-                shell.console_records[-1].output += log_text
+            self._ingest_output(shell, log_text)
 
-            # 向子进程写入数据
-            process.stdin.write(input_data)
-            await process.stdin.drain()
+            # 向子进程写入数据，常驻会话写入伪终端
+            if shell.pty is not None:
+                await shell.pty.write(input_data)
+            else:
+                process.stdin.write(input_data)
+                await process.stdin.drain()
             # 记录日志并返回写入结果
             logger.info("成功向子进程写入结果")
             return ShellWriteResult(
@@ -301,19 +1326,26 @@ class ShellService:
         if session_id not in self.active_shells:
             logger.error(f"Shell会话不存在：{session_id}")
             raise NotFoundException(f"Shell会话不存在：{session_id}")
+        self._touch_session(session_id)
 
         shell = self.active_shells[session_id]
         process = shell.process
 
         try:
-            if process.returncode is None:
-                logger.info(f"优雅的终止进程：{session_id}")
-                process.terminate()
+            # 无论主进程是否已经结束都结束整个会话(进程组)，避免后台作业继续占用CPU和端口
+            running = process.returncode is None
+            logger.info(f"优雅的终止进程：{session_id}")
+            if shell.pty is not None:
+                await shell.pty.terminate(grace=3)
+            else:
+                await terminate_session(process.pid, grace=3)
+            if running:
                 try:
-                    await asyncio.wait_for(process.wait(), timeout=3)
+                    await asyncio.wait_for(process.wait(), timeout=1)
                 except asyncio.TimeoutError as _:
                     logger.warning(f"尝试强制关闭进程：{session_id}")
-                    process.kill
+                    process.kill()
+                    await process.wait()
                 logger.info(f"进程已经终止，返回代码为：{process.returncode}")
                 return ShellKillResult(
                     status="terminated",
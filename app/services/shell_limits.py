@@ -0,0 +1,158 @@
+import ctypes
+import errno
+import logging
+import os
+import platform
+from typing import Optional, Set
+
+from app.models.shell import ShellResourceLimits
+
+logger = logging.getLogger(__name__)
+
+# ioprio_set系统调用号，Python标准库没有封装该调用
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "aarch64": 30,
+    "i386": 289,
+    "i686": 289,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# cpu.max的统计周期，单位为微秒
+CPU_PERIOD_US = 100000
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    """加载libc用于调用ioprio_set"""
+    try:
+        return ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+
+
+_libc = _load_libc()
+_ioprio_syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+
+
+def set_ioprio(pid: int, io_class: int, level: int) -> bool:
+    """设置进程的IO调度优先级(等同于ionice)，pid为0表示当前进程"""
+    if _libc is None or _ioprio_syscall is None:
+        return False
+    ioprio = (io_class << IOPRIO_CLASS_SHIFT) | (level & 0x7)
+    return _libc.syscall(_ioprio_syscall, IOPRIO_WHO_PROCESS, pid, ioprio) == 0
+
+
+def apply_process_limits(pid: int, limits: ShellResourceLimits) -> None:
+    """为已启动的进程设置nice和ionice，之后创建的子进程会继承该设置"""
+    try:
+        if limits.nice is not None:
+            os.setpriority(os.PRIO_PROCESS, pid, limits.nice)
+        if limits.ionice_class:
+            set_ioprio(pid, limits.ionice_class, limits.ionice_level or 0)
+    except ProcessLookupError:
+        # 执行很快的命令在设置之前可能已经结束
+        pass
+    except OSError as e:
+        logger.warning(f"设置进程{pid}的调度优先级失败：{str(e)}")
+
+
+class CgroupManager:
+    """cgroup v2管理器，为每个Shell会话创建子cgroup并设置cpu.max和memory.max，cgroup不可写时自动禁用。
+    只有配置了根目录并且会话设置了CPU或内存上限时才会在首次创建会话cgroup时初始化，不会迁移不属于自己的进程"""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.available = False
+        self._initialized = False  # 是否已经尝试过初始化根cgroup
+        self._pending_removal: Set[str] = set()  # 进程尚未完全退出、需要稍后删除的cgroup
+
+    def setup(self) -> bool:
+        """创建根cgroup并开启cpu和memory控制器，只尝试一次"""
+        if self._initialized:
+            return self.available
+        self._initialized = True
+        if not self.root:
+            return False
+        parent = os.path.dirname(self.root.rstrip("/"))
+        if not os.path.exists(os.path.join(parent, "cgroup.controllers")):
+            logger.info(f"未检测到可用的cgroup v2：{parent}，命令只设置nice/ionice")
+            return False
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # 子cgroup需要父cgroup开启对应的控制器
+            self._enable_controllers(parent)
+            self._enable_controllers(self.root)
+        except OSError as e:
+            if e.errno == errno.EBUSY:
+                # cgroup v2不允许开启了控制器的cgroup中直接包含进程，需要由部署方将父cgroup中的进程移到叶子cgroup
+                logger.warning(f"cgroup {parent}中存在进程，无法开启控制器，禁用会话资源限制，请将根目录配置在没有进程的cgroup下")
+            else:
+                logger.warning(f"cgroup v2不可写，禁用会话资源限制：{str(e)}")
+            return False
+        self.available = True
+        return True
+
+    @classmethod
+    def _enable_controllers(cls, path: str) -> None:
+        """为cgroup的子cgroup开启cpu和memory控制器"""
+        with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+            f.write("+cpu +memory")
+
+    def create(self, name: str, limits: ShellResourceLimits) -> Optional[str]:
+        """为会话创建子cgroup并写入cpu和内存上限，没有设置上限或失败时返回None"""
+        if not (limits.cpu_limit and limits.cpu_limit > 0) and not (limits.memory_limit and limits.memory_limit > 0):
+            return None
+        if not self.setup():
+            return None
+        path = os.path.join(self.root, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            if limits.cpu_limit and limits.cpu_limit > 0:
+                with open(os.path.join(path, "cpu.max"), "w") as f:
+                    f.write(f"{int(limits.cpu_limit * CPU_PERIOD_US)} {CPU_PERIOD_US}")
+            if limits.memory_limit and limits.memory_limit > 0:
+                with open(os.path.join(path, "memory.max"), "w") as f:
+                    f.write(str(limits.memory_limit))
+        except OSError as e:
+            logger.warning(f"创建会话cgroup失败：{path}，{str(e)}")
+            self.remove(path)
+            return None
+        return path
+
+    def add_process(self, path: Optional[str], pid: int) -> None:
+        """将已启动的进程移动到cgroup中"""
+        if not path:
+            return
+        try:
+            with open(os.path.join(path, "cgroup.procs"), "w") as f:
+                f.write(str(pid))
+        except ProcessLookupError:
+            pass
+        except OSError as e:
+            logger.warning(f"将进程{pid}加入cgroup失败：{str(e)}")
+
+    def remove(self, path: Optional[str]) -> None:
+        """结束cgroup中残留的所有进程并删除cgroup，进程尚未退出时稍后重试"""
+        if not path:
+            return
+        try:
+            with open(os.path.join(path, "cgroup.kill"), "w") as f:
+                f.write("1")
+        except OSError:
+            pass
+        try:
+            os.rmdir(path)
+            self._pending_removal.discard(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                self._pending_removal.discard(path)
+            else:
+                self._pending_removal.add(path)
+
+    def retry_pending(self) -> None:
+        """重试删除之前因进程未退出而删除失败的cgroup"""
+        for path in list(self._pending_removal):
+            self.remove(path)
@@ -0,0 +1,91 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+from typing import Deque, Optional, Tuple
+
+from app.services.shell_pty import PtyShell
+
+logger = logging.getLogger(__name__)
+
+
+class PtyShellPool:
+    """预先启动的常驻PTY bash进程池，新建常驻会话时直接取出空闲进程，后台自动补充"""
+
+    def __init__(self, size: int, max_idle_seconds: int) -> None:
+        """构造函数，size<=0表示不预热，所有进程在取出时才启动"""
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: Deque[Tuple[float, PtyShell]] = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def idle_count(self) -> int:
+        """当前空闲进程的数量"""
+        return len(self._idle)
+
+    def start(self) -> None:
+        """启动后台补充任务"""
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        """停止后台补充任务并关闭所有空闲进程"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._idle:
+            _, pty_shell = self._idle.popleft()
+            pty_shell.kill()
+
+    async def acquire(self) -> PtyShell:
+        """取出一个空闲的bash进程，进程池为空时立即启动一个新进程"""
+        # 1.优先取出仍然存活的空闲进程
+        pty_shell = None
+        while self._idle:
+            _, candidate = self._idle.popleft()
+            if candidate.process.returncode is None:
+                pty_shell = candidate
+                break
+
+        # 2.通知后台任务补充进程池
+        self._wakeup.set()
+        if pty_shell is not None:
+            logger.debug(f"从进程池取出预热的bash进程：{pty_shell.process.pid}")
+            return pty_shell
+        return await PtyShell.spawn(os.path.expanduser("~"))
+
+    async def _maintain(self) -> None:
+        """后台维护进程池: 淘汰空闲超时的进程并补充到目标数量"""
+        check_interval = max(min(self.max_idle_seconds / 2, 30), 1) if self.max_idle_seconds > 0 else 30
+        while True:
+            # 1.淘汰空闲时间超过上限的进程，避免长期持有过期的环境
+            now = time.monotonic()
+            while self._idle and (
+                    0 < self.max_idle_seconds < now - self._idle[0][0]
+                    or self._idle[0][1].process.returncode is not None
+            ):
+                _, expired = self._idle.popleft()
+                expired.kill()
+
+            # 2.补充进程池到目标数量
+            while len(self._idle) < self.size:
+                try:
+                    pty_shell = await PtyShell.spawn(os.path.expanduser("~"))
+                except Exception as e:
+                    logger.error(f"预热bash进程失败：{str(e)}")
+                    break
+                self._idle.append((time.monotonic(), pty_shell))
+
+            # 3.等待下一次取出或定时检查
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=check_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 沙箱启动的每个Shell进程都带有该环境变量，子孙进程会继承，即使脱离了会话也能识别其来源
+SHELL_TAG_ENV = "SANDBOX_SHELL_TAG"
+
+
+def iter_processes() -> Iterator[Tuple[int, int, int, str]]:
+    """扫描/proc遍历所有进程，返回(pid, 父进程id, 会话id, 状态)"""
+    try:
+        entries = os.scandir("/proc")
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # 进程名可能包含空格和括号，从最后一个右括号之后开始解析
+            fields = stat[stat.rfind(b")") + 2:].split()
+            if len(fields) < 4:
+                continue
+            yield int(entry.name), int(fields[1]), int(fields[3]), fields[0].decode()
+
+
+def session_processes(sid: int) -> List[int]:
+    """获取会话中仍在运行的进程(不包含僵尸进程)"""
+    return [pid for pid, _, session, state in iter_processes() if session == sid and state != "Z"]
+
+
+def signal_session(sid: int, sig: int) -> List[int]:
+    """向会话中的所有进程发送信号，包括后台作业和不同进程组中的子进程，返回收到信号的pid"""
+    signalled = []
+    for pid in session_processes(sid):
+        try:
+            os.kill(pid, sig)
+            signalled.append(pid)
+        except (ProcessLookupError, PermissionError):
+            pass
+    return signalled
+
+
+def kill_session(sid: int) -> List[int]:
+    """强制结束会话中的所有进程"""
+    return signal_session(sid, signal.SIGKILL)
+
+
+async def terminate_session(sid: int, grace: float = 3.0, first_signal: int = signal.SIGTERM) -> None:
+    """优雅的结束会话中的所有进程: 先发送first_signal，超过grace秒仍未退出的进程强制结束"""
+    if not signal_session(sid, first_signal):
+        return
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        if not session_processes(sid):
+            return
+    killed = kill_session(sid)
+    if killed:
+        logger.warning(f"会话{sid}中的进程未响应信号{first_signal}，已强制结束：{killed}")
+
+
+def read_process_tag(pid: int) -> Optional[str]:
+    """读取进程环境变量中的Shell标记"""
+    prefix = f"{SHELL_TAG_ENV}=".encode()
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            environ = f.read()
+    except OSError:
+        return None
+    for item in environ.split(b"\0"):
+        if item.startswith(prefix):
+            return item[len(prefix):].decode(errors="replace")
+    return None
+
+
+def read_cmdline(pid: int, max_length: int = 256) -> str:
+    """读取进程的命令行"""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read(max_length * 4)
+    except OSError:
+        return ""
+    return cmdline.replace(b"\0", b" ").decode(errors="replace").strip()[:max_length]
+
+
+def find_tagged_processes() -> Dict[str, List[int]]:
+    """查找所有带有Shell标记的存活进程，按标记分组"""
+    tagged: Dict[str, List[int]] = {}
+    own_pid = os.getpid()
+    for pid, _, _, state in iter_processes():
+        if pid == own_pid or state == "Z":
+            continue
+        tag = read_process_tag(pid)
+        if tag:
+            tagged.setdefault(tag, []).append(pid)
+    return tagged
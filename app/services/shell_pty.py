@@ -0,0 +1,235 @@
+import asyncio
+import fcntl
+import logging
+import os
+import pty
+import re
+import shlex
+import signal
+import tempfile
+import termios
+import uuid
+from typing import List, Optional, Tuple
+
+from app.services.shell_process import SHELL_TAG_ENV, kill_session, terminate_session
+
+logger = logging.getLogger(__name__)
+
+
+class PtySentinelParser:
+    """从PTY输出中剥离命令结束标记，标记由PROMPT_COMMAND在每条命令结束后以OSC控制序列打印"""
+
+    marker_head = b"\x1b]5379;SBX_DONE;"
+    marker_regex = re.compile(rb"\x1b\]5379;SBX_DONE;([0-9a-f]*);(\d+)\x07")
+    marker_max_size = 64
+
+    def __init__(self) -> None:
+        self._pending = b""  # 可能是结束标记一部分的尾部数据，等待下一块数据到达后再判断
+
+    def feed(self, data: bytes) -> Tuple[bytes, List[Tuple[str, int]]]:
+        """传入新读取的数据，返回剥离标记后的输出以及结束的(令牌, 返回码)列表"""
+        data = self._pending + data
+        self._pending = b""
+
+        # 1.剥离所有完整的结束标记
+        pieces = []
+        finished = []
+        pos = 0
+        for match in self.marker_regex.finditer(data):
+            pieces.append(data[pos:match.start()])
+            finished.append((match.group(1).decode(), int(match.group(2))))
+            pos = match.end()
+        rest = data[pos:]
+
+        # 2.尾部残缺的标记保留到下次再处理
+        escape_start = rest.rfind(b"\x1b", max(len(rest) - self.marker_max_size, 0))
+        if escape_start != -1 and b"\x07" not in rest[escape_start:]:
+            tail = rest[escape_start:]
+            if self.marker_head.startswith(tail) or tail.startswith(self.marker_head):
+                self._pending = tail
+                rest = rest[:escape_start]
+        pieces.append(rest)
+        return b"".join(pieces), finished
+
+
+class PtyShell:
+    """运行在伪终端上的常驻交互式bash，多条命令复用同一个进程，保留工作目录、环境变量等状态"""
+
+    # bash初始化命令: 关闭回显和换行转换，清空提示符，并在每条命令结束后打印带返回码的结束标记
+    init_command = (
+        "stty -echo -onlcr; unset HISTFILE; PS1=''; PS2=''; "
+        "PROMPT_COMMAND='__sbx_rc=$?; PS1=\"\"; printf \"\\033]5379;SBX_DONE;%s;%s\\007\" \"$__sbx_id\" \"$__sbx_rc\"'; "
+        "__sbx_id={token}\n"
+    )
+
+    def __init__(
+            self,
+            process: asyncio.subprocess.Process,
+            master_fd: int,
+            reader: asyncio.StreamReader,
+            tag: str,
+    ) -> None:
+        self.process = process
+        self.tag = tag  # 进程标记，bash及其所有子孙进程的环境变量中都带有该标记
+        self.master_fd = master_fd
+        self.reader = reader
+        self.parser = PtySentinelParser()
+        self.token: Optional[str] = None  # 当前正在执行命令的令牌
+        self.returncode: Optional[int] = None  # 最近一条命令的返回码
+        self.done = asyncio.Event()  # 当前命令是否执行完毕
+        self.done.set()
+        self._script_path: Optional[str] = None
+
+    @classmethod
+    async def spawn(cls, exec_dir: str, limit: int = 1024 * 1024) -> "PtyShell":
+        """在指定目录下启动一个伪终端上的交互式bash，并等待其初始化完成"""
+        logger.debug(f"在目录{exec_dir}下启动常驻PTY bash")
+        # 1.创建伪终端，子进程使用从设备作为标准输入输出
+        master_fd, slave_fd = pty.openpty()
+        tag = f"pty-{uuid.uuid4().hex}"
+        env = {**os.environ, "TERM": "dumb", SHELL_TAG_ENV: tag}
+
+        def set_controlling_tty() -> None:
+            # start_new_session创建新会话后，将伪终端设置为控制终端以启用作业控制
+            fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "/bin/bash", "--noprofile", "--norc", "--noediting", "-i",
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                cwd=exec_dir,
+                env=env,
+                start_new_session=True,
+                preexec_fn=set_controlling_tty,
+            )
+        except Exception:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+
+        # 2.将主设备接入事件循环进行异步读取
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=limit)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader),
+            os.fdopen(master_fd, "rb", buffering=0),
+        )
+        shell = cls(process, master_fd, reader, tag)
+
+        # 3.发送初始化命令并丢弃结束标记之前的启动输出(提示符、命令回显)
+        token = uuid.uuid4().hex
+        await shell.write(cls.init_command.format(token=token).encode())
+        try:
+            await asyncio.wait_for(shell._read_until(token), timeout=10)
+        except Exception:
+            shell.kill()
+            raise
+        return shell
+
+    async def _read_until(self, token: str) -> None:
+        """读取并丢弃输出，直到出现指定令牌的结束标记"""
+        while True:
+            data = await self.read()
+            if not data:
+                raise RuntimeError("PTY bash在初始化过程中退出")
+            _, finished = self.parser.feed(data)
+            if any(finished_token == token for finished_token, _ in finished):
+                return
+
+    @property
+    def busy(self) -> bool:
+        """是否有命令正在执行"""
+        return not self.done.is_set()
+
+    @property
+    def cwd(self) -> Optional[str]:
+        """读取bash进程当前的工作目录"""
+        try:
+            return os.readlink(f"/proc/{self.process.pid}/cwd")
+        except OSError:
+            return None
+
+    async def read(self, size: int = 4096) -> bytes:
+        """读取伪终端的输出，bash退出后返回空字节"""
+        try:
+            return await self.reader.read(size)
+        except OSError:
+            # 从设备全部关闭后读取主设备会返回EIO，视为读取结束
+            return b""
+
+    async def write(self, data: bytes) -> None:
+        """向伪终端写入数据，缓冲区已满时等待bash读取"""
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.master_fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                await asyncio.sleep(0.01)
+
+    async def run(self, command: str, exec_dir: Optional[str] = None) -> str:
+        """在常驻bash中执行命令，返回本次命令的令牌"""
+        # 1.命令写入临时脚本后通过source在当前shell中执行，避免终端单行长度限制和未闭合语句导致的阻塞
+        fd, script_path = tempfile.mkstemp(prefix="sandbox-cmd-", suffix=".sh")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if exec_dir:
+                f.write(f"cd -- {shlex.quote(exec_dir)} || return 1\n")
+            f.write(command)
+            f.write("\n")
+        self._remove_script()
+        self._script_path = script_path
+
+        # 2.设置命令令牌并提交执行
+        token = uuid.uuid4().hex
+        self.token = token
+        self.returncode = None
+        self.done.clear()
+        await self.write(f"__sbx_id={token}; source {shlex.quote(script_path)}\n".encode())
+        return token
+
+    def finish(self, token: str, returncode: int) -> bool:
+        """处理结束标记，令牌与当前命令一致时标记命令结束"""
+        if token != self.token or self.done.is_set():
+            return False
+        self.returncode = returncode
+        self.done.set()
+        self._remove_script()
+        return True
+
+    def exited(self) -> None:
+        """bash进程退出后结束当前命令并释放资源"""
+        if not self.done.is_set():
+            self.returncode = self.process.returncode
+            self.done.set()
+        self._remove_script()
+
+    async def wait(self) -> Optional[int]:
+        """等待当前命令执行结束并返回返回码"""
+        await self.done.wait()
+        return self.returncode
+
+    async def interrupt(self) -> None:
+        """向前台进程组发送Ctrl+C中断当前命令"""
+        await self.write(b"\x03")
+
+    async def terminate(self, grace: float = 3.0) -> None:
+        """交互式bash会忽略SIGTERM，使用SIGHUP关闭bash以及会话中的所有作业，超时后强制结束"""
+        await terminate_session(self.process.pid, grace=grace, first_signal=signal.SIGHUP)
+
+    def kill(self) -> None:
+        """强制结束bash以及会话中的所有进程(包括后台作业)"""
+        kill_session(self.process.pid)
+        if self.process.returncode is None:
+            self.process.kill()
+
+    def _remove_script(self) -> None:
+        """删除上一条命令的临时脚本"""
+        if self._script_path:
+            try:
+                os.unlink(self._script_path)
+            except OSError:
+                pass
+            self._script_path = None
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+
+class ShellOutputThrottle:
+    """Shell输出读取的流量控制: 根据读取结果自适应调整读取大小，并按令牌桶限制每个会话的输出速率"""
+
+    policies = ("pause", "drop")
+
+    def __init__(
+            self,
+            rate: int = 0,
+            policy: str = "pause",
+            min_read_size: int = 4096,
+            max_read_size: int = 256 * 1024,
+    ) -> None:
+        """构造函数，rate为每秒允许的字节数(<=0不限制)，policy为超出速率时的策略:
+        pause暂停读取，管道写满后输出进程会被阻塞(反压)；drop继续读取但丢弃超出的输出并计数"""
+        self.rate = rate
+        self.policy = policy if policy in self.policies else "pause"
+        self.min_read_size = min_read_size
+        self.max_read_size = max(max_read_size, min_read_size)
+        self.read_size = min_read_size  # 下一次读取的大小
+        self.bytes_read = 0  # 累计读取的字节数
+        self.bytes_dropped = 0  # 累计丢弃的字节数
+        self.throttled_seconds = 0.0  # 累计因限速暂停读取的时间
+        self.pending_dropped = 0  # 上次写入丢弃提示之后丢弃的字节数
+        # 令牌桶，桶容量为1秒的输出量
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+
+    def record_read(self, size: int) -> None:
+        """记录一次读取的字节数: 读满时加倍读取大小以减少单块处理的开销，数据较少时逐步缩小"""
+        self.bytes_read += size
+        if size >= self.read_size:
+            self.read_size = min(self.read_size * 2, self.max_read_size)
+        elif size < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, self.min_read_size)
+
+    def _refill(self) -> None:
+        """按流逝的时间补充令牌"""
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated_at) * self.rate, float(self.rate))
+        self._updated_at = now
+
+    async def admit(self, size: int) -> bool:
+        """申请输出size字节，返回False表示该块输出应被丢弃，pause策略下会等待令牌补足后再返回"""
+        if self.rate <= 0 or size <= 0:
+            return True
+        self._refill()
+        if self._tokens >= size or self._tokens >= self.rate:
+            self._tokens -= size
+            return True
+
+        # 1.drop策略: 令牌不足时丢弃整块输出
+        if self.policy == "drop":
+            self.bytes_dropped += size
+            self.pending_dropped += size
+            return False
+
+        # 2.pause策略: 暂停读取直到令牌补足，期间输出进程写满管道后被阻塞
+        delay = (min(size, self.rate) - self._tokens) / self.rate
+        self.throttled_seconds += delay
+        await asyncio.sleep(delay)
+        self._refill()
+        self._tokens -= size
+        return True
+
+    def take_dropped(self) -> int:
+        """取出上次提示之后丢弃的字节数，用于在输出中插入丢弃提示"""
+        dropped = self.pending_dropped
+        self.pending_dropped = 0
+        return dropped
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每秒的时钟节拍数，/proc/<pid>/stat中的CPU时间以节拍为单位
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def read_process_table() -> Dict[int, Tuple[int, int, int]]:
+    """扫描/proc读取所有进程的(父进程id, 用户态CPU节拍, 内核态CPU节拍)，CPU时间包含已回收子进程的时间"""
+    table = {}
+    try:
+        entries = os.scandir("/proc")
+    except OSError:
+        return table
+    with entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # 进程名可能包含空格和括号，从最后一个右括号之后开始解析
+            fields = stat[stat.rfind(b")") + 2:].split()
+            if len(fields) < 15:
+                continue
+            utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+            table[int(entry.name)] = (int(fields[1]), utime + cutime, stime + cstime)
+    return table
+
+
+def read_peak_rss(pid: int) -> int:
+    """读取进程的内存峰值(VmHWM)，单位为字节"""
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class ProcessUsageTracker:
+    """按进程树采样统计单条命令的资源占用: 墙钟时间、用户态/内核态CPU时间以及内存峰值"""
+
+    def __init__(self, pid: int, count_root_memory: bool = True) -> None:
+        """构造函数，pid为进程树的根进程，常驻会话中根进程是bash本身，其内存不计入命令的峰值"""
+        self.pid = pid
+        self.count_root_memory = count_root_memory
+        self.started_at = time.time()
+        self._started_monotonic = time.monotonic()
+        self._cpu_user = 0
+        self._cpu_system = 0
+        self._peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+        self.finished_at: Optional[float] = None
+        self._wall_time: Optional[float] = None
+        # 启动时的CPU节拍作为基准，常驻bash在命令开始前已经累计了CPU时间
+        self._base_user, self._base_system = self._sample_cpu(read_process_table())
+
+    def start(self, interval: float) -> None:
+        """启动后台定时采样，interval<=0时只在命令结束时采样"""
+        if interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: float) -> None:
+        """定时采样进程树，捕获运行过程中短暂存在的子进程"""
+        while True:
+            await asyncio.sleep(interval)
+            self.sample()
+
+    def _tree(self, table: Dict[int, Tuple[int, int, int]]) -> List[int]:
+        """根据父进程关系获取以根进程为首的进程树"""
+        if self.pid not in table:
+            return []
+        children: Dict[int, List[int]] = {}
+        for pid, (ppid, _, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+        tree = [self.pid]
+        for pid in tree:
+            tree.extend(children.get(pid, ()))
+        return tree
+
+    def _sample_cpu(self, table: Dict[int, Tuple[int, int, int]], tree: Optional[List[int]] = None) -> Tuple[int, int]:
+        """统计进程树中存活进程的CPU节拍，子进程被回收后其CPU时间会累计到父进程中，不会重复统计"""
+        tree = self._tree(table) if tree is None else tree
+        return sum(table[pid][1] for pid in tree), sum(table[pid][2] for pid in tree)
+
+    def sample(self) -> None:
+        """采样一次进程树，CPU时间与内存峰值只增不减，进程退出后保留最后一次采样的结果"""
+        if self.finished:
+            return
+        table = read_process_table()
+        tree = self._tree(table)
+        if not tree:
+            return
+        cpu_user, cpu_system = self._sample_cpu(table, tree)
+        self._cpu_user = max(self._cpu_user, cpu_user - self._base_user)
+        self._cpu_system = max(self._cpu_system, cpu_system - self._base_system)
+        for pid in tree if self.count_root_memory else tree[1:]:
+            self._peak_rss = max(self._peak_rss, read_peak_rss(pid))
+
+    @property
+    def finished(self) -> bool:
+        """统计是否已经结束"""
+        return self.finished_at is not None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取当前的资源占用统计，命令未结束时墙钟时间计算到当前时刻"""
+        wall_time = self._wall_time if self._wall_time is not None else time.monotonic() - self._started_monotonic
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_time": round(wall_time, 6),
+            "cpu_user": round(self._cpu_user / CLOCK_TICKS, 6),
+            "cpu_system": round(self._cpu_system / CLOCK_TICKS, 6),
+            "peak_rss": self._peak_rss,
+        }
+
+    def finish(self) -> Dict[str, Any]:
+        """命令结束时停止采样并返回最终统计，重复调用返回相同的结果"""
+        if not self.finished:
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+            self.sample()
+            self._wall_time = time.monotonic() - self._started_monotonic
+            self.finished_at = time.time()
+        return self.snapshot()